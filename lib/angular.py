@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Fri Oct 23 14:07:26 2026
+
+@author: S.Y. Agustsson
+
+module containing the analysis of rotation series, where scans are measured at different sample orientations or
+beam polarizations. At each delay, the angular dependence is decomposed in harmonics,
+
+    y(theta) = offset + sum_n A_n * cos(n * (theta - theta_n))
+
+for all delays at once, as a single product with the cached pseudo inverse of the harmonic design matrix.
+Angles are in degrees.
+
+"""
+# %% imports
+from functools import lru_cache
+
+import numpy as np
+
+from lib import series
+
+
+def main():
+    pass
+
+
+@lru_cache(maxsize=32)
+def _harmonic_projection(angle_bytes, harmonics, period):
+    """ Harmonic design matrix at the given angles and its pseudo inverse."""
+    theta = 2 * np.pi * np.frombuffer(angle_bytes) / period
+    columns = [np.ones(len(theta))]
+    for n in harmonics:
+        columns += [np.cos(n * theta), np.sin(n * theta)]
+    design = np.column_stack(columns)
+    projection = np.linalg.pinv(design)
+    for array in (design, projection):
+        array.flags.writeable = False
+    return design, projection
+
+
+def angular_harmonics(angles, matrix, harmonics=(1, 2, 4), period=360.):
+    """ Angular harmonics of a series at every delay point.
+
+    Harmonic coefficients are the least squares solution at each delay, so angles need not be evenly spaced, and
+    repeated angles (e.g. both 0 and 360 degrees) are simply averaged.
+
+    :param angles: np.array
+        angle of each scan (row of matrix), in degrees
+    :param matrix: np.array
+        series matrix, one scan per row on a common time axis
+    :param harmonics: tuple of int
+        harmonic orders n. At least 2 * len(harmonics) + 1 distinct angles are needed.
+    :param period: float
+        period of the angle
+    :return offset: np.array
+        angular average at each delay
+    :return amplitudes: np.array
+        amplitude A_n of each harmonic at each delay, shape (len(harmonics), number of delays)
+    :return orientations: np.array
+        angle theta_n of the maximum of each harmonic at each delay, in degrees
+    """
+    angles = np.ascontiguousarray(angles, dtype=float)
+    harmonics = tuple(int(n) for n in harmonics)
+    if len(np.unique(angles % period)) < 2 * len(harmonics) + 1:
+        raise ValueError('{0} harmonics need at least {1} distinct angles'.format(len(harmonics),
+                                                                                 2 * len(harmonics) + 1))
+    _, projection = _harmonic_projection(angles.tobytes(), harmonics, float(period))
+    coefficients = projection @ np.asarray(matrix, dtype=float)
+    cosine, sine = coefficients[1::2], coefficients[2::2]
+    orders = np.array(harmonics)[:, None]
+    orientations = np.degrees(np.arctan2(sine, cosine)) / orders * period / 360.
+    return coefficients[0], np.hypot(cosine, sine), orientations
+
+
+def harmonic_synthesis(angles, offset, amplitudes, orientations, harmonics=(1, 2, 4), period=360.):
+    """ Angular dependence at the given angles from harmonics, as returned by angular_harmonics.
+    :return matrix: np.array
+        shape (len(angles), number of delays)
+    """
+    theta = np.asarray(angles, dtype=float)[:, None, None] * 360. / period
+    orders = np.array(harmonics)[None, :, None]
+    terms = amplitudes[None] * np.cos(np.radians(orders * (theta - orientations[None] * 360. / period)))
+    return offset[None] + terms.sum(axis=1)
+
+
+def symmetric_parts(angles, matrix, shift=None, period=360.):
+    """ Separate a rotation series in its parts symmetric and antisymmetric under rotation by shift,
+
+        symmetric(theta) = (y(theta) + y(theta + shift)) / 2
+        antisymmetric(theta) = (y(theta) - y(theta + shift)) / 2
+
+    With the default shift of half a period, the symmetric part contains the even and the antisymmetric part
+    the odd harmonics. y(theta + shift) is interpolated over the measured angles with a cached operator, so
+    angles need not include the shifted ones.
+
+    :param angles: np.array
+        angle of each scan, in degrees
+    :param matrix: np.array
+        series matrix, one scan per row
+    :param shift: float
+        rotation angle. Defaults to half the period.
+    :return symmetric, antisymmetric: np.array
+        parts at the measured angles, same shape as matrix
+    """
+    angles = np.asarray(angles, dtype=float)
+    matrix = np.asarray(matrix, dtype=float)
+    shift = period / 2 if shift is None else shift
+    shifted = series.interpolation_operator(angles, angles + shift, period=period) @ matrix
+    return (matrix + shifted) / 2, (matrix - shifted) / 2
+
+
+def angle_map(angles, matrix, grid=None, kind='linear', period=360.):
+    """ Series interpolated on a regular angle grid, for image display, see series.parameter_map.
+    :param grid: np.array
+        angles of the map. Defaults to one degree steps over a period.
+    :param kind: str
+        'nearest', 'linear' or 'cubic' interpolation along the angle
+    :return grid: np.array
+    :return image: np.array
+        shape (len(grid), number of delays)
+    """
+    grid = np.arange(0, period, 1.) if grid is None else grid
+    return series.parameter_map(angles, matrix, grid=grid, kind=kind, period=period)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 14:40:02 2026
+
+@author: S.Y. Agustsson
+
+module containing the filtering engine shared by Transient, MultiTransients and the redred legacy functions.
+Filters act along the last axis, so they can be applied to a single trace or to a whole series matrix at once.
+
+Two low pass methods are available, with the same interface:
+    - 'butter': Butterworth filter applied forward and backwards in time domain, with Gustafsson's edge handling
+    - 'fft': multiplication by a frequency response in the real FFT domain. Faster on long traces, and allows
+        arbitrarily sharp cutoffs.
+
+"""
+# %% imports
+import warnings
+from functools import lru_cache
+
+import numpy as np
+import scipy.fft as spfft
+import scipy.signal as spsignal
+
+
+def main():
+    pass
+
+
+# %% Filter design
+
+@lru_cache(maxsize=64)
+def butter_sos(order, cutoff, btype='low'):
+    """ Design a digital Butterworth filter in second order sections form.
+
+    Designs are cached, so repeated filtering with the same settings (GUI spinboxes, batch runs) does not
+    redo the design work. The returned array is read only, since it is shared between calls.
+
+    :param order: int
+        order of the filter
+    :param cutoff: float
+        cutoff frequency as fraction of the Nyquist frequency, 0 < cutoff < 1
+    :param btype: str
+        'low' or 'high'
+    :return sos: np.array
+        second order sections, as used by scipy.signal.sosfiltfilt
+    """
+    sos = spsignal.butter(order, cutoff, btype, analog=False, output='sos')
+    sos.flags.writeable = False
+    return sos
+
+
+@lru_cache(maxsize=64)
+def butter_ba(order, cutoff):
+    """ Design a digital low pass Butterworth filter as (b, a) transfer function, for forward-backward filtering
+    with Gustafsson's initial conditions, which scipy only offers in this form.
+
+    At high orders and low cutoffs the transfer function coefficients lose the filter poles to rounding errors.
+    Designs whose poles differ from the exact ones by more than 1e-8 are rejected.
+
+    :return b, a: np.array
+        read only transfer function coefficients, or None if the transfer function is inaccurate
+    """
+    b, a = spsignal.butter(order, cutoff, 'low', analog=False)
+    poles = spsignal.butter(order, cutoff, 'low', analog=False, output='zpk')[1]
+    if np.abs(poles[:, None] - np.roots(a)[None]).min(axis=1).max() > 1e-8:
+        return None
+    b.flags.writeable = False
+    a.flags.writeable = False
+    return b, a
+
+
+def normalize_cutoff(cutoff, step=None):
+    """ Return the cutoff as fraction of the Nyquist frequency.
+    :param cutoff: float
+        if step is None, cutoff is already a fraction of the Nyquist frequency and is returned as it is,
+        otherwise cutoff is a frequency (THz if step is in ps)
+    :param step: float
+        sampling step of the data
+    """
+    if step is None:
+        return float(cutoff)
+    return float(2 * cutoff * abs(step))
+
+
+@lru_cache(maxsize=64)
+def fft_response(n_fft, cutoff, response='gaussian', order=1):
+    """ Real frequency response of a zero phase low pass filter, on the rfft frequency grid of n_fft points.
+
+    :param n_fft: int
+        number of points of the transformed (padded) trace
+    :param cutoff: float
+        cutoff frequency as fraction of the Nyquist frequency
+    :param response: str
+        shape of the response:
+            - 'brickwall': 1 below cutoff, 0 above. Sharpest, but rings on steps.
+            - 'gaussian': gaussian with attenuation of 1/sqrt(2) at cutoff. No overshoot.
+            - 'butterworth': squared magnitude of a Butterworth filter of given order, equivalent to the
+                forward-backward 'butter' method.
+            - 'hann': raised cosine roll-off from 0 to twice the cutoff, reaching 1/2 at cutoff.
+    :param order: int
+        order of the 'butterworth' response, ignored otherwise.
+    :return response: np.array
+        read only array of length n_fft // 2 + 1
+    """
+    f = 2 * np.arange(n_fft // 2 + 1) / n_fft  # frequency as fraction of Nyquist
+    x = f / cutoff
+    if response == 'brickwall':
+        h = (x <= 1).astype(float)
+    elif response == 'gaussian':
+        h = np.exp(-0.5 * np.log(2) * x ** 2)
+    elif response == 'butterworth':
+        h = 1 / (1 + x ** (2 * order))
+    elif response == 'hann':
+        h = np.where(x < 2, np.cos(np.pi * x / 4) ** 2, 0.)
+    else:
+        raise ValueError('Unknown filter response: {}'.format(response))
+    h.flags.writeable = False
+    return h
+
+
+# %% Filters
+
+def low_pass(data, cutoff=0.1, order=1, step=None, method='butter', response='gaussian', pad=None):
+    """ Zero phase low pass filter along the last axis of data.
+
+    :param data: list or np.array
+        single trace or 2D array with a trace in each row
+    :param cutoff: float
+        cutoff frequency, see normalize_cutoff
+    :param order: int
+        filter order for Butterworth filters.
+    :param step: float
+        sampling step, if cutoff is given as a frequency.
+    :param method: str
+        'butter' for sos_low_pass or 'fft' for fft_low_pass
+    :param response: str
+        frequency response used by the 'fft' method, see fft_response
+    :param pad: int
+        number of points padded at each side by the 'fft' method.
+    :return filtered: np.array
+    """
+    if method == 'butter':
+        return sos_low_pass(data, cutoff, order, step)
+    elif method == 'fft':
+        return fft_low_pass(data, cutoff, step, response=response, order=order, pad=pad)
+    else:
+        raise ValueError('Unknown filter method: {}'.format(method))
+
+
+def sos_low_pass(data, cutoff=0.1, order=1, step=None, zero_phase=True):
+    """ Zero phase Butterworth low pass filter, applied forward and backwards along the last axis of data.
+
+    Edges are handled by Gustafsson's method, choosing the initial states of the forward and backward passes so
+    that the filtered trace does not bend at the ends (F. Gustafsson, "Determining the initial states in
+    forward-backward filtering", IEEE Transactions on Signal Processing, Vol. 44, pp. 988-992, 1996). This needs
+    the (b, a) transfer function, see butter_ba. Where it is numerically inaccurate (high orders at low cutoffs),
+    the second order sections are applied instead, on the trace extended at both ends by its point reflection
+    over several settling times of the filter.
+
+    :param data: list or np.array
+        single trace or 2D array with a trace in each row
+    :param cutoff: float
+        cutoff frequency, see normalize_cutoff
+    :param order: int
+        filter order. The effective order is doubled by the forward-backward application.
+    :param step: float
+        sampling step, if cutoff is given as a frequency.
+    :param zero_phase: bool
+        if False, the filter is applied forward only, as a causal filter equivalent to scipy.signal.lfilter. The
+        filtered trace is then delayed, but a point is not affected by later data.
+    :return filtered: np.array
+    """
+    order, cutoff = int(order), round(normalize_cutoff(cutoff, step), 12)
+    data = np.asarray(data, dtype=float)
+    # scipy requires writable arrays, copying the few coefficients is negligible
+    if zero_phase:
+        transfer = butter_ba(order, cutoff)
+        if transfer is not None:
+            return spsignal.filtfilt(transfer[0].copy(), transfer[1].copy(), data, axis=-1, method='gust')
+    sos = butter_sos(order, cutoff, 'low')
+    if not zero_phase:
+        return spsignal.sosfilt(sos.copy(), data, axis=-1)
+    padding = min(data.shape[-1] - 1, int(np.ceil(3 * order / cutoff)))
+    return spsignal.sosfiltfilt(sos.copy(), data, axis=-1, padlen=padding)
+
+
+def fft_low_pass(data, cutoff=0.1, step=None, response='gaussian', order=1, pad=None):
+    """ Zero phase low pass filter applied as a real frequency response in the FFT domain, along the last axis.
+
+    To avoid wrap-around artefacts, each trace is extended at both ends by its point reflection about the end
+    points (as done by filtfilt) and padded to a fast FFT length.
+
+    :param data: list or np.array
+        single trace or 2D array with a trace in each row
+    :param cutoff: float
+        cutoff frequency, see normalize_cutoff
+    :param step: float
+        sampling step, if cutoff is given as a frequency.
+    :param response: str
+        shape of the frequency response, see fft_response
+    :param order: int
+        order of the 'butterworth' response
+    :param pad: int
+        number of points added at each side. Defaults to a quarter of the trace length.
+    :return filtered: np.array
+    """
+    data = np.asarray(data, dtype=float)
+    n = data.shape[-1]
+    if pad is None:
+        pad = n // 4
+    pad = int(min(pad, n - 1))
+    extended = np.concatenate((2 * data[..., :1] - data[..., pad:0:-1],
+                               data,
+                               2 * data[..., -1:] - data[..., -2:-pad - 2:-1]), axis=-1)
+    n_fft = spfft.next_fast_len(extended.shape[-1], real=True)
+    h = fft_response(n_fft, round(normalize_cutoff(cutoff, step), 12), response, int(order))
+    spectrum = spfft.rfft(extended, n=n_fft, axis=-1)
+    filtered = spfft.irfft(spectrum * h, n=n_fft, axis=-1)
+    return filtered[..., pad:pad + n]
+
+
+# %% Noise spectrum
+
+def power_spectrum(data, nperseg=1024):
+    """ Welch estimate of the power spectral density along the last axis of data.
+
+    Segments are linearly detrended, to limit leakage of the slow transient signal into high frequencies.
+    :param data: list or np.array
+        single trace or 2D array with a trace in each row
+    :param nperseg: int
+        length of each Welch segment
+    :return f: np.array
+        frequencies as fraction of the Nyquist frequency
+    :return psd: np.array
+        power spectral density, one row per trace
+    """
+    data = np.asarray(data, dtype=float)
+    nperseg = min(nperseg, data.shape[-1])
+    return spsignal.welch(data, fs=2., nperseg=nperseg, detrend='linear', axis=-1)
+
+
+def find_cutoff(data, threshold=3., noise_band=(0.5, 1.), nperseg=1024, min_cutoff=0.005, max_cutoff=0.9):
+    """ Choose a low pass cutoff for each trace from its noise spectrum.
+
+    The noise floor is the median power spectral density in noise_band. The cutoff is set where the
+    spectrum first falls below threshold times the noise floor, so that the signal band is preserved.
+
+    :param data: list or np.array
+        single trace or 2D array with a trace in each row
+    :param threshold: float
+        ratio to the noise floor defining the end of the signal band (3 ~ 5 dB)
+    :param noise_band: tuple
+        frequency band, as fractions of Nyquist, where only noise is expected
+    :param nperseg: int
+        length of the Welch segments, see power_spectrum
+    :param min_cutoff, max_cutoff: float
+        limits of the returned cutoffs
+    :return cutoff: np.array
+        cutoff frequency of each trace as fraction of the Nyquist frequency
+    :return noise_floor: np.array
+        noise floor power spectral density of each trace
+    """
+    f, psd = power_spectrum(np.atleast_2d(data), nperseg=nperseg)
+    band = (f >= noise_band[0]) & (f <= noise_band[1])
+    noise_floor = np.median(psd[:, band], axis=1)
+    below = psd <= threshold * noise_floor[:, None]
+    below[:, 0] = False  # DC is always part of the signal
+    below[:, -1] = True  # guarantees a crossing is found
+    cutoff = f[np.argmax(below, axis=1)]
+    return np.clip(cutoff, min_cutoff, max_cutoff), noise_floor
+
+
+def estimate_noise(time, data, time_zero=0., margin=0.5, min_points=10):
+    """ Noise standard deviation of each trace, from the data before time zero and from its high frequency content.
+
+    The baseline estimate is the robust standard deviation (1.4826 median absolute deviation) of the points more
+    than margin before time zero, where only noise is present. It includes slow drifts, and is used whenever at
+    least min_points are available. The high frequency estimate is the robust standard deviation of the first
+    differences divided by sqrt(2), exact for white noise: differencing is a high pass filter which removes the
+    slow signal, and the median ignores the few differences across a sharp rise. It is used for scans without
+    baseline. After low pass filtering it underestimates the noise, as correlated noise is partly removed.
+
+    :param time: np.array
+        time axis common to all traces, or 2D array with the time axis of each trace
+    :param data: np.array
+        single trace or 2D array with a trace in each row
+    :param time_zero: float
+        pump-probe overlap
+    :param margin: float
+        points between time_zero - margin and time_zero are excluded from the baseline
+    :param min_points: int
+        minimum number of baseline points
+    :return sigma: np.array
+        noise standard deviation of each trace
+    :return baseline_sigma: np.array
+        baseline estimate, nan where there are less than min_points baseline points
+    :return high_frequency_sigma: np.array
+        high frequency estimate
+    """
+    data = np.atleast_2d(np.asarray(data, dtype=float))
+    baseline = np.broadcast_to(np.asarray(time, dtype=float) < time_zero - margin, data.shape)
+    values = np.where(baseline, data, np.nan)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # all-nan rows of scans without baseline
+        baseline_sigma = _robust_std(values)
+    baseline_sigma[baseline.sum(axis=1) < min_points] = np.nan
+    high_frequency_sigma = _robust_std(np.diff(data, axis=1)) / np.sqrt(2)
+    sigma = np.where(np.isfinite(baseline_sigma), baseline_sigma, high_frequency_sigma)
+    return sigma, baseline_sigma, high_frequency_sigma
+
+
+def _robust_std(values):
+    """ Standard deviation of each row from its median absolute deviation, ignoring nan."""
+    return 1.4826 * np.nanmedian(np.abs(values - np.nanmedian(values, axis=1, keepdims=True)), axis=1)
+
+
+if __name__ == "__main__":
+    main()
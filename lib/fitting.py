@@ -0,0 +1,796 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Oct 20 15:02:11 2026
+
+@author: S.Y. Agustsson
+
+module containing fitting engines working with the models module, used by MultiTransients.fit_transients.
+
+"""
+# %% imports
+import hashlib
+import os
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+import scipy.sparse as spsparse
+from scipy.optimize import least_squares
+from scipy.stats import chi2, qmc
+
+from lib import models
+from lib import series
+
+
+def main():
+    pass
+
+
+# %% Variable projection
+
+def varpro_fit(model, x, y, p0, sigma=None, absolute_sigma=False, use_bounds=True, full_output=False, **kwargs):
+    """ Fit a separable model by variable projection.
+
+    The linear parameters (amplitudes, offsets) are solved exactly by linear least squares for each trial set of
+    nonlinear parameters (time constants), so that the nonlinear optimizer only searches the, much smaller,
+    nonlinear parameter space. The jacobian of the projected residual uses Kaufman's approximation.
+
+    :param model: models.Model or str
+        separable model, with linear parameters and basis defined
+    :param x, y: np.array
+        data to fit
+    :param p0: list
+        initial guess, either for all model parameters or for the nonlinear parameters only.
+    :param sigma: np.array
+        uncertainty of y, used as 1/sigma weights
+    :param absolute_sigma: bool
+        if True, sigma is the absolute uncertainty of y and pcov is not scaled, as in curve_fit
+    :param use_bounds: bool
+        constrain nonlinear parameters within the model bounds
+    :param full_output: bool
+        if True, also return a dict with the number of function ('nfev') and jacobian ('njev') evaluations
+    :param kwargs:
+        passed to scipy.optimize.least_squares
+    :return popt: np.array
+        optimized parameters, in model order
+    :return pcov: np.array
+        covariance of popt, scaled by the reduced chi square as done by curve_fit unless absolute_sigma is True
+    """
+    model = models.get_model(model)
+    if not model.is_separable:
+        raise ValueError('Model {} has no linear parameters defined, cannot use variable projection.'.format(model.name))
+    linear_idx, nonlinear_idx = model.linear_index()
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    weights = np.ones_like(y) if sigma is None else 1 / np.asarray(sigma, dtype=float)
+    yw = y * weights
+
+    p0 = np.asarray(p0, dtype=float)
+    theta0 = p0[nonlinear_idx] if len(p0) == model.n_parameters else p0
+    if use_bounds:
+        bounds = (np.asarray(model.bounds[0])[nonlinear_idx], np.asarray(model.bounds[1])[nonlinear_idx])
+        theta0 = np.clip(theta0, bounds[0], bounds[1])
+    else:
+        bounds = (-np.inf, np.inf)
+
+    state = {}
+
+    def project(theta):
+        if state.get('theta') is not None and np.array_equal(state['theta'], theta):
+            return state
+        phi = np.column_stack(model.basis(x, *theta)) * weights[:, None]
+        q, r = np.linalg.qr(phi)
+        coefficients = np.linalg.lstsq(r, q.T @ yw, rcond=None)[0]
+        state.update(theta=theta.copy(), phi=phi, q=q, coefficients=coefficients,
+                     residual=phi @ coefficients - yw)
+        return state
+
+    def residual(theta):
+        return project(theta)['residual']
+
+    def jacobian(theta):
+        s = project(theta)
+        derivatives = model.basis_jacobian(x, *theta)
+        columns = []
+        for d_phi in derivatives:
+            v = np.column_stack(d_phi) * weights[:, None] @ s['coefficients']
+            columns.append(v - s['q'] @ (s['q'].T @ v))  # projection on the orthogonal complement of phi
+        return np.column_stack(columns)
+
+    method = kwargs.pop('method', 'trf' if use_bounds else 'lm')
+    result = least_squares(residual, theta0, jac=jacobian, bounds=bounds, method=method, **kwargs)
+    if not result.success:
+        raise RuntimeError('Variable projection fit failed: {}'.format(result.message))
+
+    popt = np.empty(model.n_parameters)
+    popt[nonlinear_idx] = result.x
+    popt[linear_idx] = project(result.x)['coefficients']
+    pcov = covariance(model, x, y, popt, weights, absolute_sigma=absolute_sigma)
+    if full_output:
+        return popt, pcov, {'nfev': result.nfev, 'njev': result.njev}
+    return popt, pcov
+
+
+def covariance(model, x, y, popt, weights=None, absolute_sigma=False):
+    """ Parameter covariance from the full model jacobian at popt, scaled by the reduced chi square unless
+    absolute_sigma is True, consistent with curve_fit. Returns an array of inf if the jacobian is singular."""
+    weights = np.ones_like(y) if weights is None else weights
+    j = model.jacobian(x, *popt) * weights[:, None]
+    residual = (model(x, *popt) - y) * weights
+    scale = 1. if absolute_sigma else (residual @ residual) / max(len(y) - len(popt), 1)
+    try:
+        return np.linalg.inv(j.T @ j) * scale
+    except np.linalg.LinAlgError:
+        return np.full((len(popt), len(popt)), np.inf)
+
+
+# %% Coarse to fine
+
+def coarse_to_fine(fit, x, y, p0, n_bins=200, time_zero=0.):
+    """ Fit first on a decimated copy of the data, then on the full data starting from the coarse optimum.
+
+    The data is averaged in log spaced delay bins (see series.decimate), weighted by the number of points in each
+    bin, so the coarse fit sees the same signal at a fraction of the cost. The fine fit then only needs a few
+    iterations, and converges to the same optimum as a direct fit. If the coarse fit fails, the fine fit starts
+    from p0.
+
+    :param fit: func
+        fit(x, y, p0, sigma=None) returning popt, pcov
+    :param x, y: np.array
+        data to fit
+    :param p0: list
+        initial guess
+    :param n_bins: int
+        approximate number of points of the coarse data
+    :param time_zero: float
+        origin of the delay for log binning
+    :return popt, pcov:
+        result of the fine fit
+    """
+    x = np.asarray(x, dtype=float)
+    if len(x) > 2 * n_bins:
+        x_coarse, y_coarse, counts = series.decimate(x, y, n_bins, time_zero)
+        try:
+            p0 = fit(x_coarse, y_coarse, p0, sigma=1 / np.sqrt(counts))[0]
+        except RuntimeError:
+            pass
+    return fit(x, y, p0)
+
+
+# %% Global fit
+
+def global_fit(model, xs, ys, p0, shared=(), sigmas=None, absolute_sigma=False, use_bounds=True, **kwargs):
+    """ Fit a model to several datasets at once, with some parameters shared between all of them.
+
+    All datasets are concatenated in a single least squares problem, where shared parameters are common and all
+    others are free for each dataset. The model and its jacobian are evaluated on all points at once, and the
+    jacobian is kept as a sparse matrix: each data point depends only on the shared parameters and on the local
+    parameters of its own dataset, so memory grows linearly with the number of datasets.
+
+    :param model: models.Model or str
+    :param xs, ys: list of np.array
+        x and y data of each dataset. Lengths can differ between datasets.
+    :param p0: list or list of lists
+        initial guess for all model parameters, common to all datasets or one list per dataset. Shared parameters
+        are initialized with the average of their initial guesses.
+    :param shared: list of str
+        names of the parameters shared between all datasets
+    :param sigmas: list of np.array
+        uncertainty of each dataset, used as 1/sigma weights
+    :param absolute_sigma: bool
+        if True, sigmas are absolute uncertainties and pcov is not scaled by the reduced chi square
+    :param use_bounds: bool
+        constrain parameters within the model bounds
+    :param kwargs:
+        passed to scipy.optimize.least_squares
+    :return popt: np.array
+        optimized parameters, array of shape (number of datasets, number of model parameters)
+    :return pcov: np.array
+        covariance of the parameters of each dataset, shape (number of datasets, n parameters, n parameters),
+        scaled by the reduced chi square of the whole problem unless absolute_sigma is True. Shared parameters have
+        the same variance in all datasets.
+    """
+    model = models.get_model(model)
+    n_sets = len(xs)
+    n_par = model.n_parameters
+    shared_idx = [model.parameters.index(name) for name in shared]
+    local_idx = [i for i in range(n_par) if i not in shared_idx]
+    n_shared, n_local = len(shared_idx), len(local_idx)
+
+    x = np.concatenate([np.asarray(xi, dtype=float) for xi in xs])
+    y = np.concatenate([np.asarray(yi, dtype=float) for yi in ys])
+    dataset = np.repeat(np.arange(n_sets), [len(xi) for xi in xs])
+    if sigmas is None:
+        weights = np.ones_like(y)
+    else:
+        weights = 1 / np.concatenate([np.broadcast_to(np.asarray(si, dtype=float), np.shape(xi))
+                                      for si, xi in zip(sigmas, xs)])
+
+    p0 = np.asarray(p0, dtype=float)
+    if p0.ndim == 1:
+        p0 = np.tile(p0, (n_sets, 1))
+    theta0 = np.concatenate((p0[:, shared_idx].mean(axis=0), p0[:, local_idx].ravel()))
+
+    def parameters(theta):
+        """ parameter matrix, one row per dataset, from the vector of free parameters"""
+        p = np.empty((n_sets, n_par))
+        p[:, shared_idx] = theta[:n_shared]
+        p[:, local_idx] = theta[n_shared:].reshape(n_sets, n_local)
+        return p
+
+    # sparsity pattern of the jacobian: every point depends on shared and on its own local parameters
+    n_points = len(x)
+    rows = np.repeat(np.arange(n_points), n_par)
+    columns = np.empty((n_points, n_par), dtype=int)
+    columns[:, shared_idx] = np.arange(n_shared)
+    columns[:, local_idx] = n_shared + dataset[:, None] * n_local + np.arange(n_local)
+    columns = columns.ravel()
+    shape = (n_points, n_shared + n_sets * n_local)
+
+    blocks = np.split(np.arange(n_points), np.cumsum([len(xi) for xi in xs])[:-1])
+
+    def evaluate(function, p):
+        """ function of all points, with parameters given per point if the model broadcasts, otherwise evaluated
+        dataset by dataset with scalar parameters (e.g. convolved models, whose grid depends on the dataset)"""
+        if model.broadcasts:
+            return function(x, *p[dataset].T)
+        return np.concatenate([function(x[block], *p_set) for block, p_set in zip(blocks, p)])
+
+    def residual(theta):
+        return (evaluate(model, parameters(theta)) - y) * weights
+
+    def jacobian(theta):
+        j = evaluate(model.jacobian, parameters(theta)) * weights[:, None]
+        return spsparse.csr_matrix((j.ravel(), (rows, columns)), shape=shape)
+
+    if use_bounds:
+        lower = np.asarray(model.bounds[0], dtype=float)
+        upper = np.asarray(model.bounds[1], dtype=float)
+        bounds = (np.concatenate((lower[shared_idx], np.tile(lower[local_idx], n_sets))),
+                  np.concatenate((upper[shared_idx], np.tile(upper[local_idx], n_sets))))
+        theta0 = np.clip(theta0, bounds[0], bounds[1])
+    else:
+        bounds = (-np.inf, np.inf)
+
+    kwargs.setdefault('x_scale', 'jac')
+    result = least_squares(residual, theta0, jac=jacobian, bounds=bounds, method='trf', tr_solver='lsmr', **kwargs)
+    if not result.success:
+        raise RuntimeError('Global fit failed: {}'.format(result.message))
+
+    popt = parameters(result.x)
+    j = evaluate(model.jacobian, popt) * weights[:, None]
+    dof = max(n_points - len(result.x), 1)
+    ends = np.cumsum([len(xi) for xi in xs])
+    pcov = _arrowhead_covariance(j, ends, shared_idx, local_idx)
+    if not absolute_sigma:
+        pcov = pcov * 2 * result.cost / dof
+    return popt, pcov
+
+
+def _arrowhead_covariance(j, ends, shared_idx, local_idx):
+    """ Covariance blocks of each dataset in a global fit, without building the full covariance matrix.
+
+    The normal matrix J^T J of a global fit has an arrowhead structure: a dense block A for the shared
+    parameters, coupling blocks B_k and block diagonal local blocks D_k. Its inverse blocks are obtained
+    through the Schur complement S = A - sum_k B_k D_k^-1 B_k^T.
+
+    :param j: np.array
+        jacobian of all points by all model parameters, shape (number of points, n parameters)
+    :param ends: list of int
+        index of the end of each dataset in the concatenated points
+    :return pcov: np.array
+        unscaled covariance of the model parameters of each dataset
+    """
+    n_sets, n_par = len(ends), j.shape[1]
+    js, jl = j[:, shared_idx], j[:, local_idx]
+    starts = np.concatenate(([0], ends[:-1]))
+    d_inv = np.empty((n_sets, len(local_idx), len(local_idx)))
+    b = np.empty((n_sets, len(shared_idx), len(local_idx)))
+    for k, (start, end) in enumerate(zip(starts, ends)):
+        d_inv[k] = np.linalg.pinv(jl[start:end].T @ jl[start:end])
+        b[k] = js[start:end].T @ jl[start:end]
+    schur = js.T @ js - np.einsum('kij,kjl,kml->im', b, d_inv, b)
+    cov_shared = np.linalg.pinv(schur) if len(shared_idx) else np.zeros((0, 0))
+    b_d = np.einsum('kij,kjl->kil', b, d_inv)  # B_k D_k^-1
+    cov_cross = -np.einsum('ij,kjl->kil', cov_shared, b_d)
+    cov_local = d_inv + np.einsum('kji,jm,kml->kil', b_d, cov_shared, b_d)
+
+    pcov = np.empty((n_sets, n_par, n_par))
+    pcov[np.ix_(range(n_sets), shared_idx, shared_idx)] = cov_shared
+    pcov[np.ix_(range(n_sets), shared_idx, local_idx)] = cov_cross
+    pcov[np.ix_(range(n_sets), local_idx, shared_idx)] = np.transpose(cov_cross, (0, 2, 1))
+    pcov[np.ix_(range(n_sets), local_idx, local_idx)] = cov_local
+    return pcov
+
+
+# %% Multi start
+
+def sample_starts(model, p0, n_starts=32, sampling='lhs', spread=10., seed=None):
+    """ Initial guesses spread over the parameter space, by Latin hypercube or Sobol sampling.
+
+    Each parameter is sampled within its model bounds, in a range around p0: log uniformly between p0 / spread and
+    p0 * spread for positive parameters with lower bound 0 (time constants), otherwise uniformly within
+    p0 +- spread / 5 * max(|p0|, 1e-12).
+
+    :param model: models.Model
+    :param p0: list
+        central guess, returned as first start
+    :param n_starts: int
+        number of starts
+    :param sampling: str
+        'lhs' for Latin hypercube, 'sobol' for a scrambled Sobol sequence
+    :param spread: float
+        width of the sampled range
+    :param seed: int
+        seed of the sampler
+    :return starts: np.array
+        initial guesses, shape (n_starts, number of parameters)
+    """
+    p0 = np.asarray(p0, dtype=float)
+    lower = np.asarray(model.bounds[0], dtype=float)
+    upper = np.asarray(model.bounds[1], dtype=float)
+    if sampling == 'lhs':
+        unit = qmc.LatinHypercube(d=len(p0), seed=seed).random(n_starts - 1)
+    elif sampling == 'sobol':
+        unit = qmc.Sobol(d=len(p0), seed=seed).random_base2(int(np.ceil(np.log2(max(n_starts - 1, 1)))))
+        unit = unit[:n_starts - 1]
+    else:
+        raise ValueError('Unknown sampling: {}'.format(sampling))
+
+    logarithmic = (lower >= 0) & (p0 > 0)
+    width = spread / 5 * np.maximum(np.abs(p0), 1e-12)
+    low = np.maximum(p0 - width, lower)
+    high = np.minimum(p0 + width, upper)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_low = np.log(np.maximum(p0 / spread, np.where(lower > 0, lower, 0)))
+        log_high = np.log(np.minimum(p0 * spread, upper))
+        starts = np.where(logarithmic, np.exp(np.where(logarithmic, log_low + unit * (log_high - log_low), 0)),
+                          low + unit * (high - low))
+    return np.vstack((p0, starts))
+
+
+def _local_fit(arguments):
+    """ Single local fit of multi_start_fit, returning popt, pcov, cost and function evaluations, or None."""
+    model, x, y, start, kwargs = arguments
+    try:
+        popt, pcov, infodict, _, _ = model.fit(x, y, start, full_output=True, **kwargs)
+    except (RuntimeError, ValueError, np.linalg.LinAlgError):
+        return None
+    residual = model(x, *popt) - y
+    return popt, pcov, residual @ residual, infodict['nfev']
+
+
+def multi_start_fit(model, x, y, p0, n_starts=32, sampling='lhs', n_agree=3, rtol=1e-6, spread=10., seed=0,
+                    n_workers=1, executor=None, full_output=False, **kwargs):
+    """ Fit from many initial guesses and keep the best result.
+
+    Local fits start from p0 and from guesses sampled around it (see sample_starts), run in parallel in a process
+    pool. Fitting stops early once n_agree fits reached the same lowest cost, as further starts are then unlikely
+    to find a better minimum.
+
+    :param model: models.Model or str
+    :param x, y: np.array
+        data to fit
+    :param p0: list
+        initial guess
+    :param n_starts: int
+        maximum number of local fits
+    :param sampling: str
+        'lhs' or 'sobol', see sample_starts
+    :param n_agree: int
+        number of fits reaching the best cost, within rtol, after which fitting stops
+    :param rtol: float
+        relative tolerance on the cost for fits to agree
+    :param spread: float
+        width of the sampled range, see sample_starts
+    :param seed: int
+        seed of the sampling
+    :param n_workers: int
+        number of worker processes. 1 fits in the current process; None uses all processors.
+    :param executor: concurrent.futures.Executor
+        pool to run the fits in, to avoid starting processes for each fit of a series. Overrides n_workers.
+    :param full_output: bool
+        if True, also return a dict with the total number of function evaluations ('nfev') and of local fits
+        ('n_fits')
+    :param kwargs:
+        passed to models.Model.fit
+    :return popt, pcov: np.array
+        best fit
+    :raise RuntimeError: if no local fit succeeded
+    """
+    model = models.get_model(model)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    starts = sample_starts(model, p0, n_starts, sampling, spread, seed)
+    arguments = [(model, x, y, start, kwargs) for start in starts]
+    results = []
+
+    def converged():
+        costs = np.array([result[2] for result in results if result is not None])
+        return len(costs) >= n_agree and np.sum(costs <= costs.min() * (1 + rtol) + 1e-300) >= n_agree
+
+    own_executor = executor is None and n_workers != 1
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=n_workers)
+    try:
+        if executor is None:
+            for a in arguments:
+                results.append(_local_fit(a))
+                if converged():
+                    break
+        else:
+            pending = set(executor.submit(_local_fit, a) for a in arguments)
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                results.extend(future.result() for future in done)
+                if converged():
+                    for future in pending:
+                        future.cancel()
+                    break
+    finally:
+        if own_executor:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    successful = [result for result in results if result is not None]
+    if not successful:
+        raise RuntimeError('No fit parameters found from {} starts'.format(len(results)))
+    popt, pcov, _, _ = min(successful, key=lambda result: result[2])
+    if full_output:
+        return popt, pcov, {'nfev': sum(result[3] for result in successful), 'n_fits': len(results)}
+    return popt, pcov
+
+
+# %% Uncertainties
+
+def batched_least_squares(model, x, y, p, free=None, iterations=50, tol=1e-10):
+    """ Levenberg-Marquardt fit of many parameter sets at once, on the same x.
+
+    All fits are advanced together, evaluating the model and its jacobian with parameters given as column
+    arrays, so the cost of many fits close to convergence (bootstrap resamples, profile likelihood points) is
+    that of a few evaluations on a large array. Each fit has its own damping factor.
+
+    :param model: models.Model
+        model broadcasting over parameter arrays (see models.Model.broadcasts)
+    :param x: np.array
+        common x data
+    :param y: np.array
+        y data, shape (number of fits, len(x)), or (len(x),) if shared by all fits
+    :param p: np.array
+        initial parameters of each fit, shape (number of fits, number of parameters)
+    :param free: list of bool
+        parameters which are fitted, the others are kept fixed. Defaults to all.
+    :param iterations: int
+        maximum number of iterations
+    :param tol: float
+        stop when no fit improves its chi square by more than this relative amount
+    :return p: np.array
+        optimized parameters
+    :return chi_square: np.array
+        sum of squared residuals of each fit
+    """
+    x = np.asarray(x, dtype=float)
+    p = np.array(p, dtype=float)
+    free = np.ones(p.shape[1], dtype=bool) if free is None else np.asarray(free, dtype=bool)
+    n_free = free.sum()
+    if not model.broadcasts:
+        return _looped_least_squares(model, x, y, p, free, tol)
+
+    y = np.broadcast_to(y, (len(p), len(x)))
+
+    def residual(parameters, rows):
+        r = model(x, *parameters.T[:, :, None]) - y[rows]
+        cost = np.sum(r ** 2, axis=-1)
+        return r, np.where(np.isfinite(cost), cost, np.inf)
+
+    r, cost = residual(p, np.arange(len(p)))
+    damping = np.full(len(p), 1e-3)
+    active = np.ones(len(p), dtype=bool)  # fits which are not converged yet
+    for _ in range(iterations):
+        rows = np.nonzero(active)[0]
+        if len(rows) == 0:
+            break
+        j = model.jacobian(x, *p[rows].T[:, :, None])[..., free]
+        jt = np.swapaxes(j, 1, 2)
+        jtj = jt @ j
+        jtr = (jt @ r[rows][..., None])[..., 0]
+        diagonal = np.diagonal(jtj, axis1=1, axis2=2)
+        damped = jtj + damping[rows, None, None] * diagonal[:, :, None] * np.eye(n_free)
+        try:
+            step = np.linalg.solve(damped, -jtr[..., None])[..., 0]
+        except np.linalg.LinAlgError:
+            step = -(np.linalg.pinv(damped) @ jtr[..., None])[..., 0]
+        trial = p[rows]
+        trial[:, free] += step
+        r_trial, cost_trial = residual(trial, rows)
+        better = cost_trial < cost[rows]
+        improvement = (cost[rows] - cost_trial) / np.maximum(cost[rows], np.finfo(float).tiny)
+        accepted = rows[better]
+        p[accepted], r[accepted], cost[accepted] = trial[better], r_trial[better], cost_trial[better]
+        damping[rows] = np.where(better, damping[rows] / 3, damping[rows] * 5)
+        active[rows] = np.where(better, improvement > tol, damping[rows] < 1e4)
+    return p, cost
+
+
+def _looped_least_squares(model, x, y, p, free, tol=1e-10):
+    """ batched_least_squares for models which do not broadcast over parameters, one fit at a time."""
+    y = np.broadcast_to(y, (len(p), len(x)))
+    cost = np.empty(len(p))
+    for k, row in enumerate(p):
+        def full(theta):
+            values = row.copy()
+            values[free] = theta
+            return values
+
+        result = least_squares(lambda theta: model(x, *full(theta)) - y[k], row[free], ftol=tol,
+                               jac=lambda theta: model.jacobian(x, *full(theta))[:, free])
+        p[k] = full(result.x)
+        cost[k] = 2 * result.cost
+    return p, cost
+
+
+def bootstrap_interval(model, x, y, popt, n_resamples=200, confidence=0.95, seed=None, chunk_size=None):
+    """ Confidence interval of fit parameters by residual bootstrap.
+
+    Residuals of the fit are resampled with replacement and added to the fitted curve, and each resampled trace
+    is refitted starting from popt. Refits are done in chunks by batched_least_squares.
+
+    :param model: models.Model
+    :param x, y: np.array
+        fitted data
+    :param popt: np.array
+        optimized parameters
+    :param n_resamples: int
+        number of bootstrap resamples
+    :param confidence: float
+        confidence level of the interval
+    :param seed: int or np.random.SeedSequence
+        seed of the random resampling, for reproducible intervals
+    :param chunk_size: int
+        number of resamples fitted at once. Defaults to limit memory use to about 100 MB.
+    :return interval: np.array
+        lower and upper limit of each parameter, shape (number of parameters, 2)
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    popt = np.asarray(popt, dtype=float)
+    rng = np.random.default_rng(seed)
+    fitted = model(x, *popt)
+    residual = y - fitted
+    if chunk_size is None:
+        chunk_size = max(1, int(1e7 / (len(x) * (len(popt) + 2))))
+    samples = []
+    for start in range(0, n_resamples, chunk_size):
+        n = min(chunk_size, n_resamples - start)
+        resampled = fitted + residual[rng.integers(0, len(x), size=(n, len(x)))]
+        samples.append(batched_least_squares(model, x, resampled, np.tile(popt, (n, 1)))[0])
+    samples = np.vstack(samples)
+    tail = 50 * (1 - confidence)
+    return np.nanpercentile(samples, [tail, 100 - tail], axis=0).T
+
+
+def profile_interval(model, x, y, popt, pcov=None, confidence=0.95, n_points=21, width=4.):
+    """ Confidence interval of fit parameters from their profile likelihood.
+
+    Each parameter is fixed on a grid of values around its optimum, refitting all others (all grid points at once
+    by batched_least_squares). The interval limits are where the profile chi square exceeds its minimum by the
+    chi square quantile of the confidence level, scaled by the reduced chi square of the fit.
+
+    :param model: models.Model
+    :param x, y: np.array
+        fitted data
+    :param popt: np.array
+        optimized parameters
+    :param pcov: np.array
+        covariance of popt, used to choose the grid. Defaults to the covariance of the fit at popt.
+    :param confidence: float
+        confidence level of the interval
+    :param n_points: int
+        number of grid points of each profile
+    :param width: float
+        half width of the grid, in standard deviations
+    :return interval: np.array
+        lower and upper limit of each parameter, shape (number of parameters, 2). Limits beyond the grid are nan.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    popt = np.asarray(popt, dtype=float)
+    if pcov is None:
+        pcov = covariance(model, x, y, popt)
+    n_par = len(popt)
+    residual = model(x, *popt) - y
+    cost = residual @ residual
+    threshold = cost + cost / max(len(y) - n_par, 1) * chi2.ppf(confidence, 1)
+
+    interval = np.full((n_par, 2), np.nan)
+    for i in range(n_par):
+        sd = np.sqrt(pcov[i, i]) if np.isfinite(pcov[i, i]) and pcov[i, i] > 0 else 0.1 * abs(popt[i]) + 1e-12
+        grid = popt[i] + sd * np.linspace(-width, width, n_points)
+        p = np.tile(popt, (n_points, 1))
+        p[:, i] = grid
+        free = np.arange(n_par) != i
+        _, profile = batched_least_squares(model, x, y, p, free=free)
+        center = n_points // 2
+        for side, indices in enumerate((np.arange(center, -1, -1), np.arange(center, n_points))):
+            above = np.nonzero(profile[indices] > threshold)[0]
+            if len(above) and above[0] > 0:
+                k, k_prev = indices[above[0]], indices[above[0] - 1]
+                interval[i, side] = np.interp(threshold, [profile[k_prev], profile[k]], [grid[k_prev], grid[k]])
+    return interval
+
+
+def _scan_interval(arguments):
+    """ Confidence interval of a single scan, run by series_intervals in worker processes."""
+    method, model, x, y, popt, pcov, seed, kwargs = arguments
+    if method == 'bootstrap':
+        return bootstrap_interval(model, x, y, popt, seed=seed, **kwargs)
+    elif method == 'profile':
+        return profile_interval(model, x, y, popt, pcov, **kwargs)
+    raise ValueError('Unknown uncertainty method: {}'.format(method))
+
+
+def series_intervals(model, xs, ys, popts, pcovs=None, method='bootstrap', n_workers=None, seed=0, **kwargs):
+    """ Confidence intervals of the fit parameters of each scan of a series, computed in parallel processes.
+
+    Each scan gets its own random seed spawned from seed, so results do not depend on the number of workers or
+    on the order in which scans are processed.
+
+    :param model: models.Model or str
+        fitted model. Must be picklable, as registered models are.
+    :param xs, ys: list of np.array
+        fitted data of each scan
+    :param popts, pcovs: list of np.array
+        fit results of each scan
+    :param method: str
+        'bootstrap' (see bootstrap_interval) or 'profile' (see profile_interval)
+    :param n_workers: int
+        number of worker processes. Defaults to the number of processors; 1 runs in the current process.
+    :param seed: int
+        seed of the bootstrap resampling
+    :param kwargs:
+        passed to bootstrap_interval or profile_interval
+    :return intervals: list of np.array
+        interval of each scan, shape (number of parameters, 2)
+    """
+    model = models.get_model(model)
+    if pcovs is None:
+        pcovs = [None] * len(popts)
+    seeds = np.random.SeedSequence(seed).spawn(len(popts))
+    arguments = [(method, model, x, y, popt, pcov, scan_seed, kwargs)
+                 for x, y, popt, pcov, scan_seed in zip(xs, ys, popts, pcovs, seeds)]
+    n_workers = os.cpu_count() if n_workers is None else n_workers
+    if n_workers <= 1 or len(arguments) <= 1:
+        return [_scan_interval(a) for a in arguments]
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        return list(executor.map(_scan_interval, arguments, chunksize=max(1, len(arguments) // (4 * n_workers))))
+
+
+# %% Fit result cache
+
+class FitCache(object):
+    """ Persistent cache of fit results on disk.
+
+    Results are stored in a .npz file per fit, named by a hash of the fitted arrays, the fit window, the model
+    identity, the initial guess and the fit method, so that a fit is only repeated when any of them changed.
+    Failed fits are cached as well. When the cache exceeds max_size, least recently used results are deleted.
+    """
+
+    def __init__(self, directory=None, max_size=100e6):
+        """
+        :param directory: str
+            folder where results are stored. Defaults to .rrcache/fits in the user home folder.
+        :param max_size: float
+            maximum size of the cache in bytes
+        """
+        if directory is None:
+            directory = os.path.join(os.path.expanduser('~'), '.rrcache', 'fits')
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def key(model, x, y, p0, method='curve_fit', fit_window=(0, 0), **options):
+        """ Hash identifying a fit.
+        :param model: models.Model or function
+        :param x, y: np.array
+            fitted data
+        :param p0: list
+            initial guess
+        :param method: str
+            fit method
+        :param fit_window: tuple
+            (fit_from, fit_to) of the fit
+        :param options:
+            any other setting affecting the result, e.g. bounds
+        :return key: str
+            None if the model cannot be identified (see models.code_identity), and the fit must not be cached.
+        """
+        if isinstance(model, models.Model):
+            identity = model.identity()
+        else:
+            identity = models.code_identity(model)
+        if identity is None:
+            return None
+        h = hashlib.sha1()
+        h.update(np.ascontiguousarray(x, dtype=float).tobytes())
+        h.update(np.ascontiguousarray(y, dtype=float).tobytes())
+        h.update(np.ascontiguousarray(p0, dtype=float).tobytes())
+        h.update('{0}|{1}|{2}|{3}'.format(identity, method, tuple(fit_window), sorted(options.items())).encode())
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.npz')
+
+    def get(self, key):
+        """ Return the cached result as a dict with popt, pcov, residual_norm, duration and success, or None."""
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as stored:
+                result = {name: stored[name] for name in stored.files}
+        except (OSError, ValueError, EOFError, zipfile.BadZipFile):  # truncated or corrupt entry: a cache miss
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        os.utime(path)  # mark as recently used
+        result['success'] = bool(result['success'])
+        return result
+
+    def put(self, key, popt=None, pcov=None, residual_norm=np.nan, duration=0.):
+        """ Store a fit result. popt None marks a failed fit."""
+        success = popt is not None
+        np.savez(self._path(key), success=success,
+                 popt=np.asarray(popt if success else [], dtype=float),
+                 pcov=np.asarray(pcov if success else [], dtype=float),
+                 residual_norm=residual_norm, duration=duration, timestamp=time.time())
+        self.evict()
+
+    def evict(self):
+        """ Delete least recently used results until the cache fits in max_size."""
+        entries = [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith('.npz')]
+        stats = [(os.stat(path), path) for path in entries]
+        total = sum(stat.st_size for stat, _ in stats)
+        for stat, path in sorted(stats, key=lambda item: item[0].st_mtime):
+            if total <= self.max_size:
+                break
+            os.remove(path)
+            total -= stat.st_size
+
+    def clear(self):
+        """ Delete all cached results."""
+        for name in os.listdir(self.directory):
+            if name.endswith('.npz'):
+                os.remove(os.path.join(self.directory, name))
+
+    def fit(self, fit, model, x, y, p0, method='curve_fit', fit_window=(0, 0), **options):
+        """ Return the cached result of a fit, or run it and store its result.
+
+        :param fit: func
+            fit(model, x, y, p0) returning popt, pcov, and raising RuntimeError on failure
+        :return popt, pcov: np.array
+        :raise RuntimeError: if the fit failed, now or when cached
+        """
+        key = self.key(model, x, y, p0, method, fit_window, **options)
+        if key is None:  # the model reads values which cannot be identified
+            return fit(model, x, y, p0)
+        cached = self.get(key)
+        if cached is not None:
+            if not cached['success']:
+                raise RuntimeError('Fit failed (cached result)')
+            return cached['popt'], cached['pcov']
+        start = time.time()
+        try:
+            popt, pcov = fit(model, x, y, p0)
+        except RuntimeError:
+            self.put(key, duration=time.time() - start)
+            raise
+        residual = np.asarray(model(x, *popt)) - y
+        self.put(key, popt, pcov, residual_norm=np.sqrt(residual @ residual), duration=time.time() - start)
+        return popt, pcov
+
+
+if __name__ == "__main__":
+    main()
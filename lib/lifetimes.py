@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Oct 22 15:48:09 2026
+
+@author: S.Y. Agustsson
+
+module containing lifetime distribution analysis: the regularized inverse Laplace transform of transients.
+A trace is described as a distribution of exponential components on a log spaced grid of time constants,
+
+    y(t) = sum_j a_j * exp(-t / tau_j) + offset,      t >= 0
+
+found by Tikhonov regularized non-negative least squares, without guessing the number of components.
+
+"""
+# %% imports
+from functools import lru_cache
+
+import numpy as np
+from scipy.optimize import nnls
+
+
+def main():
+    pass
+
+
+def tau_grid(time, n_taus=100, tau_min=None, tau_max=None):
+    """ Log spaced grid of time constants suited to a time axis: from the sampling step to three times the
+    time range."""
+    delay = np.asarray(time, dtype=float)
+    delay = delay[delay >= 0]
+    if tau_min is None:
+        tau_min = np.diff(np.unique(delay)).min()
+    if tau_max is None:
+        tau_max = 3 * (delay.max() - delay.min())
+    return np.geomspace(tau_min, tau_max, n_taus)
+
+
+def lifetime_kernel(time, taus, kind='decay'):
+    """ Kernel matrix of exponential components, cached for each (time grid, tau grid) pair.
+    :param kind: str
+        'decay' for exp(-t / tau), 'rise' for 1 - exp(-t / tau)
+    :return kernel: np.array
+        read only array of shape (len(time), len(taus))
+    """
+    time = np.ascontiguousarray(time, dtype=float)
+    taus = np.ascontiguousarray(taus, dtype=float)
+    return _kernel(time.tobytes(), taus.tobytes(), kind)
+
+
+@lru_cache(maxsize=16)
+def _kernel(time_bytes, tau_bytes, kind):
+    time = np.frombuffer(time_bytes)
+    taus = np.frombuffer(tau_bytes)
+    kernel = np.exp(-np.outer(time, 1 / taus))
+    if kind == 'rise':
+        kernel = 1 - kernel
+    elif kind != 'decay':
+        raise ValueError('Unknown kernel kind: {}'.format(kind))
+    kernel.flags.writeable = False
+    return kernel
+
+
+@lru_cache(maxsize=16)
+def _normal_matrix(time_bytes, tau_bytes, kind, signed, offset, regularization):
+    """ Design matrix, regularized normal matrix and its largest eigenvalue, cached with the kernel."""
+    kernel = _kernel(time_bytes, tau_bytes, kind)
+    n_time, n_taus = kernel.shape
+    columns = [kernel, -kernel] if signed else [kernel]
+    if offset:
+        columns += [np.ones((n_time, 1)), -np.ones((n_time, 1))]
+    design = np.hstack(columns)
+
+    # second difference smoothing on each tau distribution, scaled to the kernel norm, with a small norm penalty
+    # which prevents overlapping positive and negative components from cancelling each other
+    difference = np.vstack((np.diff(np.eye(n_taus), n=2, axis=0), 0.1 * np.eye(n_taus)))
+    blocks = [difference] * (2 if signed else 1)
+    smoothing = np.zeros((len(blocks) * difference.shape[0], design.shape[1]))
+    for k, block in enumerate(blocks):
+        smoothing[k * difference.shape[0]:(k + 1) * difference.shape[0], k * n_taus:(k + 1) * n_taus] = block
+    scale = regularization ** 2 * np.trace(kernel.T @ kernel) / n_taus
+    normal = design.T @ design + scale * smoothing.T @ smoothing
+    lipschitz = np.linalg.eigvalsh(normal)[-1]
+    for array in (design, smoothing, normal):
+        array.flags.writeable = False
+    return design, smoothing * np.sqrt(scale), normal, lipschitz
+
+
+def lifetime_distribution(time, traces, taus=None, regularization=1e-2, kind='decay', signed=True, offset=True,
+                          method='fista', iterations=3000, time_zero=0.):
+    """ Distribution of lifetimes of one or many traces sharing a time axis.
+
+    Solves min |K a - y|^2 + lambda^2 |L a|^2 with a >= 0, where K is the exponential kernel and L the second
+    difference along the tau grid, which favours smooth distributions, plus a small norm penalty. With signed, positive and negative
+    components are separate non-negative distributions. The default 'fista' method solves all traces at once by
+    accelerated projected gradient descent on the cached normal matrix, 'nnls' solves each trace exactly by
+    scipy.optimize.nnls.
+
+    :param time: np.array
+        common time axis. Only points at or after time_zero are used.
+    :param traces: np.array
+        single trace or 2D array with a trace in each row
+    :param taus: np.array
+        grid of time constants. Defaults to tau_grid(time).
+    :param regularization: float
+        Tikhonov regularization strength lambda, relative to the kernel norm
+    :param kind: str
+        'decay' or 'rise' components, see lifetime_kernel
+    :param signed: bool
+        allow components with negative amplitude
+    :param offset: bool
+        include a constant offset
+    :param method: str
+        'fista' or 'nnls'
+    :param iterations: int
+        number of iterations of the 'fista' method
+    :param time_zero: float
+        time origin of the exponentials
+    :return taus: np.array
+        grid of time constants
+    :return amplitudes: np.array
+        amplitude of each time constant, shape (number of traces, len(taus))
+    :return offsets: np.array
+        offset of each trace
+    :return fitted: np.array
+        fitted traces, on the points used
+    """
+    time = np.asarray(time, dtype=float)
+    traces = np.atleast_2d(np.asarray(traces, dtype=float))
+    used = time >= time_zero
+    delay = time[used] - time_zero
+    y = traces[:, used]
+    if taus is None:
+        taus = tau_grid(delay)
+    taus = np.ascontiguousarray(taus, dtype=float)
+    delay = np.ascontiguousarray(delay)
+    design, smoothing, normal, lipschitz = _normal_matrix(delay.tobytes(), taus.tobytes(), kind, signed, offset,
+                                                          float(regularization))
+
+    if method == 'fista':
+        coefficients = _fista(design, normal, lipschitz, y, iterations)
+    elif method == 'nnls':
+        augmented = np.vstack((design, smoothing))
+        padding = np.zeros(smoothing.shape[0])
+        coefficients = np.array([nnls(augmented, np.concatenate((row, padding)))[0] for row in y]).T
+    else:
+        raise ValueError('Unknown lifetime distribution method: {}'.format(method))
+
+    n_taus = len(taus)
+    amplitudes = coefficients[:n_taus].T
+    if signed:
+        amplitudes = amplitudes - coefficients[n_taus:2 * n_taus].T
+    offsets = coefficients[-2] - coefficients[-1] if offset else np.zeros(len(y))
+    fitted = (design @ coefficients).T
+    return taus, amplitudes, offsets, fitted
+
+
+def _fista(design, normal, lipschitz, y, iterations):
+    """ Accelerated projected gradient (FISTA) for non-negative regularized least squares, for all columns of
+    y.T at once. Momentum is restarted when the objective increases."""
+    target = design.T @ y.T
+    a = np.zeros((design.shape[1], len(y)))
+    z = a.copy()
+    t = np.ones(len(y))
+    objective = np.full(len(y), np.inf)
+    for _ in range(iterations):
+        a_next = np.maximum(z - (normal @ z - target) / lipschitz, 0)
+        current = 0.5 * np.einsum('ij,ij->j', a_next, normal @ a_next) - np.einsum('ij,ij->j', a_next, target)
+        restart = current > objective
+        t_next = np.where(restart, 1., 0.5 * (1 + np.sqrt(1 + 4 * t ** 2)))
+        z = a_next + np.where(restart, 0., (t - 1) / t_next) * (a_next - a)
+        a, t, objective = a_next, t_next, current
+    return a
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Oct 22 10:05:14 2026
+
+@author: S.Y. Agustsson
+
+module containing Bayesian posterior sampling of fit models, by an affine invariant ensemble sampler
+(Goodman & Weare stretch move, as in emcee). The log likelihood of all walkers of an ensemble is evaluated at once,
+passing walker parameters as column arrays to the model, and scans of a series are sampled in parallel processes.
+
+"""
+# %% imports
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from lib import models
+from lib import series
+
+
+def main():
+    pass
+
+
+class Posterior(object):
+    """ Posterior samples of the parameters of a fit model, stored as a thinned chain with summary statistics."""
+
+    def __init__(self, parameters, chain, log_probability, acceptance):
+        """
+        :param parameters: list of str
+            parameter names
+        :param chain: np.array
+            thinned samples after burn in, shape (number of kept steps, number of walkers, number of parameters).
+            Stored as float32 to keep series of posteriors compact.
+        :param log_probability: np.array
+            log posterior of each sample, shape (number of kept steps, number of walkers)
+        :param acceptance: float
+            mean acceptance fraction of the stretch moves
+        """
+        self.parameters = list(parameters)
+        self.chain = np.asarray(chain, dtype=np.float32)
+        self.log_probability = np.asarray(log_probability, dtype=np.float32)
+        self.acceptance = acceptance
+
+    def __repr__(self):
+        return 'Posterior({0} samples of {1}, acceptance {2:.2f})'.format(
+            len(self.samples), ', '.join(self.parameters), self.acceptance)
+
+    @property
+    def samples(self):
+        """ all samples, flattened over steps and walkers"""
+        return self.chain.reshape(-1, self.chain.shape[-1]).astype(float)
+
+    @property
+    def median(self):
+        return np.median(self.samples, axis=0)
+
+    @property
+    def std(self):
+        return np.std(self.samples, axis=0)
+
+    def interval(self, confidence=0.95):
+        """ Central credible interval of each parameter, shape (number of parameters, 2)"""
+        tail = 50 * (1 - confidence)
+        return np.percentile(self.samples, [tail, 100 - tail], axis=0).T
+
+    def summary(self, confidence=0.95):
+        """ Dictionary with median, standard deviation and credible interval of each parameter."""
+        interval = self.interval(confidence)
+        return {name: {'median': m, 'std': s, 'interval': tuple(i)}
+                for name, m, s, i in zip(self.parameters, self.median, self.std, interval)}
+
+
+# %% Sampler
+
+def log_likelihood(model, x, y, sigma, p):
+    """ Gaussian log likelihood of each parameter set (row of p), with uniform prior within the model bounds.
+    Parameter sets are evaluated at once for models broadcasting over parameters, one by one otherwise."""
+    p = np.atleast_2d(p)
+    inside = np.all((p >= model.bounds[0]) & (p <= model.bounds[1]), axis=1)
+    result = np.full(len(p), -np.inf)
+    if not np.any(inside):
+        return result
+    with np.errstate(over='ignore', invalid='ignore'):  # diverging parameter sets get -inf
+        if model.broadcasts:
+            r = (model(x, *p[inside].T[:, :, None]) - y) / sigma
+            result[inside] = -0.5 * np.sum(r ** 2, axis=-1)
+        else:
+            for k in np.nonzero(inside)[0]:
+                r = (model(x, *p[k]) - y) / sigma
+                result[k] = -0.5 * (r @ r)
+    result[~np.isfinite(result)] = -np.inf
+    return result
+
+
+def ensemble_sample(model, x, y, p0, sigma=None, pcov=None, n_walkers=32, n_steps=2000, burn=500, thin=10, a=2.,
+                    coarse_bins=None, seed=None):
+    """ Sample the posterior of the model parameters with an affine invariant ensemble sampler.
+
+    Walkers are split in two halves, each moved by stretch moves towards walkers of the other half, so that all
+    walkers of a half are evaluated at once.
+
+    :param model: models.Model or str
+    :param x, y: np.array
+        data
+    :param p0: list
+        starting parameters, usually the best fit
+    :param sigma: float or np.array
+        uncertainty of y. Defaults to the root mean square residual of the model at p0.
+    :param pcov: np.array
+        covariance of p0, setting the initial spread of the walkers. Defaults to 1e-4 relative spread.
+    :param n_walkers: int
+        number of walkers, at least twice the number of parameters
+    :param n_steps: int
+        number of steps, including burn in
+    :param burn: int
+        number of initial steps discarded
+    :param thin: int
+        only every thin-th step is stored
+    :param a: float
+        scale of the stretch move
+    :param coarse_bins: int
+        if given, the likelihood is evaluated on data averaged in about this many log spaced delay bins, with
+        uncertainty scaled by the number of points in each bin (see series.decimate). Much faster on long
+        scans, for models which vary slowly within bins.
+    :param seed: int or np.random.SeedSequence
+        seed of the random moves, for reproducible chains
+    :return posterior: Posterior
+    """
+    model = models.get_model(model)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    p0 = np.asarray(p0, dtype=float)
+    n_par = len(p0)
+    n_walkers = max(n_walkers + n_walkers % 2, 2 * n_par + 2)
+    rng = np.random.default_rng(seed)
+    if sigma is None:
+        sigma = np.sqrt(np.mean((model(x, *p0) - y) ** 2))
+    if coarse_bins:
+        x, y, counts = series.decimate(x, y, coarse_bins)
+        sigma = np.mean(sigma) / np.sqrt(counts)
+
+    if pcov is not None and np.all(np.isfinite(np.diag(pcov))):
+        spread = np.sqrt(np.abs(np.diag(pcov)))
+    else:
+        spread = 1e-4 * np.maximum(np.abs(p0), 1e-8)
+    walkers = p0 + 0.1 * spread * rng.standard_normal((n_walkers, n_par))
+    walkers = model.clip_to_bounds(walkers)
+    log_p = log_likelihood(model, x, y, sigma, walkers)
+
+    half = n_walkers // 2
+    chain, chain_log_p = [], []
+    accepted = 0
+    for step in range(n_steps):
+        for moving, other in ((slice(0, half), slice(half, None)), (slice(half, None), slice(0, half))):
+            current = walkers[moving]
+            partners = walkers[other][rng.integers(0, half, size=half)]
+            z = ((a - 1) * rng.random(half) + 1) ** 2 / a
+            proposal = partners + z[:, None] * (current - partners)
+            log_p_proposal = log_likelihood(model, x, y, sigma, proposal)
+            with np.errstate(invalid='ignore'):  # proposals with -inf probability from -inf walkers are rejected
+                accept = np.log(rng.random(half)) < (n_par - 1) * np.log(z) + log_p_proposal - log_p[moving]
+            current[accept] = proposal[accept]
+            log_p[moving] = np.where(accept, log_p_proposal, log_p[moving])
+            accepted += accept.sum()
+        if step >= burn and (step - burn) % thin == 0:
+            chain.append(walkers.copy())
+            chain_log_p.append(log_p.copy())
+    return Posterior(model.parameters, np.array(chain), np.array(chain_log_p), accepted / (n_steps * n_walkers))
+
+
+def _sample_scan(arguments):
+    """ Posterior of a single scan, run by series_posteriors in worker processes."""
+    model, x, y, p0, pcov, seed, kwargs = arguments
+    return ensemble_sample(model, x, y, p0, pcov=pcov, seed=seed, **kwargs)
+
+
+def series_posteriors(model, xs, ys, popts, pcovs=None, n_workers=None, seed=0, **kwargs):
+    """ Posterior of the fit parameters of each scan of a series, sampled in parallel processes.
+
+    Each scan gets its own random seed spawned from seed, so chains do not depend on the number of workers.
+
+    :param model: models.Model or str
+        fitted model, must be picklable
+    :param xs, ys: list of np.array
+        data of each scan
+    :param popts, pcovs: list of np.array
+        fit results of each scan, used to start the walkers
+    :param n_workers: int
+        number of worker processes. Defaults to the number of processors; 1 runs in the current process.
+    :param seed: int
+    :param kwargs:
+        passed to ensemble_sample
+    :return posteriors: list of Posterior
+    """
+    model = models.get_model(model)
+    if pcovs is None:
+        pcovs = [None] * len(popts)
+    seeds = np.random.SeedSequence(seed).spawn(len(popts))
+    arguments = [(model, x, y, popt, pcov, scan_seed, kwargs)
+                 for x, y, popt, pcov, scan_seed in zip(xs, ys, popts, pcovs, seeds)]
+    n_workers = os.cpu_count() if n_workers is None else n_workers
+    if n_workers <= 1 or len(arguments) <= 1:
+        return [_sample_scan(a) for a in arguments]
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        return list(executor.map(_sample_scan, arguments))
+
+
+if __name__ == "__main__":
+    main()
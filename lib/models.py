@@ -0,0 +1,710 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Oct 20 09:31:47 2026
+
+@author: S.Y. Agustsson
+
+module containing the fit models used on transients.
+Each Model knows its parameter names, bounds and analytic jacobian, and can be passed directly to curve_fit or to
+MultiTransients.fit_transients. Models are collected in the MODELS registry and can be retrieved by name with
+get_model().
+Kinetic schemes defined by rate equations are built with RateModel, and kinetic models can be convolved with
+the instrument response through convolve_model().
+
+"""
+# %% imports
+import functools
+import hashlib
+import os
+import sysconfig
+import types
+from functools import lru_cache
+
+import numpy as np
+import scipy.fft as spfft
+from scipy.optimize import curve_fit
+from scipy.special import erf
+
+MODELS = {}  # registry of available models, by name
+_LIBRARY_PATHS = tuple(os.path.abspath(sysconfig.get_paths()[name]) for name in ('stdlib', 'purelib', 'platlib'))
+
+
+def main():
+    pass
+
+
+# %% Model class
+
+class Model(object):
+    """ Fit model: a function f(x, *parameters) with named parameters, bounds and jacobian.
+
+    Evaluation broadcasts over x and parameters, so passing parameters as column arrays evaluates several
+    parameter sets at once.
+    """
+    broadcasts = True  # False for models which can only be evaluated with scalar parameters
+
+    def __init__(self, name, function, parameters, jacobian=None, bounds=None, description=None, linear=None,
+                 basis=None, basis_jacobian=None):
+        """
+        :param name: str
+            name used in the MODELS registry
+        :param function: func
+            model function, as f(x, *parameters)
+        :param parameters: list of str
+            names of the parameters, in the order accepted by function
+        :param jacobian: func
+            function j(x, *parameters) returning the list of partial derivatives by each parameter.
+            If None, a central finite difference approximation is used.
+        :param bounds: tuple
+            (lower, upper) lists of parameter bounds, as accepted by curve_fit. Defaults to no bounds.
+        :param description: str
+            formula or short description of the model
+        :param linear: list of str
+            names of the parameters the model depends linearly on. Together with basis, makes the model separable,
+            allowing variable projection fits (see fitting.varpro_fit).
+        :param basis: func
+            function b(x, *nonlinear) returning the list of basis functions multiplying each linear parameter,
+            where nonlinear are the remaining parameters, in model order.
+        :param basis_jacobian: func
+            function returning, for each nonlinear parameter, the list of derivatives of the basis functions.
+        """
+        self.name = name
+        self.function = function
+        self.parameters = list(parameters)
+        self._jacobian = jacobian
+        n = len(self.parameters)
+        if bounds is None:
+            bounds = ([-np.inf] * n, [np.inf] * n)
+        self.bounds = (list(bounds[0]), list(bounds[1]))
+        self.description = description
+        self.linear = list(linear) if linear is not None else []
+        self.basis = basis
+        self.basis_jacobian = basis_jacobian
+
+    def __call__(self, x, *p):
+        return self.function(np.asarray(x, dtype=float), *p)
+
+    def __repr__(self):
+        return 'Model({0}: {1})'.format(self.name, ', '.join(self.parameters))
+
+    @property
+    def n_parameters(self):
+        return len(self.parameters)
+
+    @property
+    def nonlinear(self):
+        """ names of the parameters which are not linear, in model order"""
+        return [name for name in self.parameters if name not in self.linear]
+
+    @property
+    def is_separable(self):
+        return self.basis is not None and len(self.linear) > 0
+
+    def linear_index(self):
+        """ Return indices of linear and nonlinear parameters in the full parameter list."""
+        linear = [self.parameters.index(name) for name in self.linear]
+        nonlinear = [self.parameters.index(name) for name in self.nonlinear]
+        return linear, nonlinear
+
+    def jacobian(self, x, *p):
+        """ Return the jacobian of the model, with shape x.shape + (number of parameters,) """
+        x = np.asarray(x, dtype=float)
+        if self._jacobian is None:
+            columns = self._numerical_jacobian(x, *p)
+        else:
+            columns = self._jacobian(x, *p)
+        return np.stack(np.broadcast_arrays(*columns), axis=-1)
+
+    def _numerical_jacobian(self, x, *p):
+        columns = []
+        for i, value in enumerate(p):
+            h = 1e-6 * max(abs(value), 1e-3)
+            p_up, p_down = list(p), list(p)
+            p_up[i] = value + h
+            p_down[i] = value - h
+            columns.append((self.function(x, *p_up) - self.function(x, *p_down)) / (2 * h))
+        return columns
+
+    def fit(self, x, y, p0, sigma=None, use_bounds=False, **kwargs):
+        """ Fit the model to data with curve_fit, using the analytic jacobian.
+        :param use_bounds: bool
+            if True, the fit is constrained within the model bounds (trust region reflective method), otherwise
+            the faster unconstrained Levenberg-Marquardt method is used.
+        :return popt, pcov:
+            as returned by curve_fit
+        """
+        if use_bounds:
+            kwargs['bounds'] = self.bounds
+        return curve_fit(self, x, y, p0=p0, sigma=sigma, jac=self.jacobian, **kwargs)
+
+    def clip_to_bounds(self, p):
+        """ Return parameters moved inside the model bounds."""
+        return np.clip(np.asarray(p, dtype=float), self.bounds[0], self.bounds[1])
+
+    def identity(self):
+        """ String identifying the model, used as part of fit cache keys (see fitting.FitCache). Includes a hash of
+        the code of the model function, so that editing it invalidates cached fits. None if the function cannot be
+        identified, see code_identity."""
+        code = code_identity(self.function)
+        if code is None:
+            return None
+        return '{0}|{1}|{2}|{3}|{4}'.format(self.name, ','.join(self.parameters), self.description, self.bounds, code)
+
+
+def code_identity(function):
+    """ Hash of a function and of everything its result depends on: bytecode, constants, referenced names and
+    default arguments, including those of nested functions and lambdas, the values captured in its closure and the
+    module globals it reads. Functions called through globals or closures are hashed in turn. Two functions
+    differing only in a constant or in a captured value get different hashes.
+
+    functools.partial objects are identified by their function, arguments and keywords. Callables without code
+    (e.g. numpy ufuncs, classes) are identified by their name only.
+
+    :return identity: str
+        hex digest, or None if a captured or global value cannot be identified (arbitrary objects, object arrays),
+        in which case results of the function must not be cached.
+    """
+    h = hashlib.sha1()
+    try:
+        _hash_callable(h, function, set())
+    except TypeError:
+        return None
+    return h.hexdigest()
+
+
+def _hash_callable(h, function, seen):
+    if isinstance(function, functools.partial):
+        h.update(b'partial')
+        _hash_callable(h, function.func, seen)
+        _hash_value(h, function.args, seen)
+        _hash_value(h, function.keywords, seen)
+        return
+    owner = getattr(function, '__self__', None)
+    function = getattr(function, '__func__', function)  # bound methods
+    h.update('{0}.{1}'.format(getattr(function, '__module__', ''),
+                              getattr(function, '__qualname__', repr(function))).encode())
+    code = getattr(function, '__code__', None)
+    if code is None or id(function) in seen or _is_library(code.co_filename):  # recursive functions are hashed once
+        return
+    seen.add(id(function))
+    if owner is not None and not isinstance(owner, (Model, types.ModuleType)):
+        _hash_value(h, owner, seen)  # models are identified by Model.identity
+    _hash_code(h, code)
+    _hash_value(h, function.__defaults__, seen)
+    _hash_value(h, function.__kwdefaults__, seen)
+    for cell in function.__closure__ or ():
+        try:
+            _hash_value(h, cell.cell_contents, seen)
+        except ValueError:  # empty cell
+            h.update(b'<empty>')
+    global_names = function.__globals__
+    for name in sorted(_code_names(code)):
+        if name in global_names:
+            h.update(name.encode())
+            _hash_value(h, global_names[name], seen)
+
+
+def _is_library(filename):
+    """ True for code of the standard library and installed packages, which is identified by name only."""
+    return os.path.abspath(filename).startswith(_LIBRARY_PATHS)
+
+
+def _hash_code(h, code):
+    h.update(code.co_code)
+    h.update(repr(code.co_names).encode())
+    for constant in code.co_consts:
+        if isinstance(constant, types.CodeType):
+            _hash_code(h, constant)
+        else:
+            h.update(repr(constant).encode())
+
+
+def _code_names(code):
+    """ Global and attribute names referenced by code and by the code nested in it."""
+    names = set(code.co_names)
+    for constant in code.co_consts:
+        if isinstance(constant, types.CodeType):
+            names |= _code_names(constant)
+    return names
+
+
+def _hash_value(h, value, seen):
+    """ Add a value read by a function to the hash. Raises TypeError for values which cannot be identified."""
+    if value is None or isinstance(value, (bool, int, float, complex, str, bytes, np.generic, range, slice)):
+        h.update(repr(value).encode())
+    elif isinstance(value, np.ndarray):
+        if value.dtype.hasobject:
+            raise TypeError('cannot identify object array')
+        h.update('{0}{1}'.format(value.dtype, value.shape).encode())
+        h.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, (tuple, list)):
+        h.update('{0}{1}'.format(type(value).__name__, len(value)).encode())
+        for item in value:
+            _hash_value(h, item, seen)
+    elif isinstance(value, (set, frozenset)):
+        h.update('set{}'.format(len(value)).encode())
+        for item in sorted(value, key=repr):
+            _hash_value(h, item, seen)
+    elif isinstance(value, dict):
+        h.update('dict{}'.format(len(value)).encode())
+        for key in sorted(value, key=repr):
+            _hash_value(h, key, seen)
+            _hash_value(h, value[key], seen)
+    elif isinstance(value, types.ModuleType):
+        h.update(value.__name__.encode())
+    elif isinstance(value, Model):
+        if id(value) not in seen:
+            seen.add(id(value))
+            identity = value.identity()
+            if identity is None:
+                raise TypeError('cannot identify model {}'.format(value.name))
+            h.update(identity.encode())
+    elif isinstance(value, (types.FunctionType, types.MethodType, types.BuiltinFunctionType, functools.partial, type,
+                            np.ufunc)):
+        _hash_callable(h, value, seen)
+    else:
+        raise TypeError('cannot identify {}'.format(type(value).__name__))
+
+
+def register_model(model):
+    """ Add a model to the MODELS registry and return it."""
+    MODELS[model.name] = model
+    return model
+
+
+def get_model(name):
+    """ Return the registered model with the given name. Models are returned as they are."""
+    if isinstance(name, Model):
+        return name
+    try:
+        return MODELS[name]
+    except KeyError:
+        raise KeyError('No fit model named {0}. Available models: {1}'.format(name, ', '.join(MODELS)))
+
+
+# %% Exponential models
+
+def _expfunc_const(x, A, t0, c):
+    return A * (1 - np.exp(- x / t0)) + c
+
+
+def _expfunc_const_jac(x, A, t0, c):
+    e = np.exp(- x / t0)
+    return [1 - e, -A * x * e / t0 ** 2, np.ones_like(x)]
+
+
+def _expfunc_lin_const(x, A, t0, c, d):
+    return A * (1 - np.exp(- x / t0)) + c * x + d
+
+
+def _expfunc_lin_const_jac(x, A, t0, c, d):
+    e = np.exp(- x / t0)
+    return [1 - e, -A * x * e / t0 ** 2, x, np.ones_like(x)]
+
+
+def _double_exponential_pos_neg(x, A1, t1, A2, t2, c, d):
+    return A1 * (1 - np.exp(- x / t1)) - A2 * (1 - np.exp(- x / t2)) + c * x + d
+
+
+def _double_exponential_pos_neg_jac(x, A1, t1, A2, t2, c, d):
+    e1 = np.exp(- x / t1)
+    e2 = np.exp(- x / t2)
+    return [1 - e1, -A1 * x * e1 / t1 ** 2, -(1 - e2), A2 * x * e2 / t2 ** 2, x, np.ones_like(x)]
+
+
+def _exp_basis(x, t0):
+    return [1 - np.exp(- x / t0)]
+
+
+def _exp_basis_jac(x, t0):
+    return [[-x * np.exp(- x / t0) / t0 ** 2]]
+
+
+def _expfunc_const_basis(x, t0):
+    return _exp_basis(x, t0) + [np.ones_like(x)]
+
+
+def _expfunc_const_basis_jac(x, t0):
+    return [_exp_basis_jac(x, t0)[0] + [np.zeros_like(x)]]
+
+
+def _expfunc_lin_const_basis(x, t0):
+    return _exp_basis(x, t0) + [x, np.ones_like(x)]
+
+
+def _expfunc_lin_const_basis_jac(x, t0):
+    return [_exp_basis_jac(x, t0)[0] + [np.zeros_like(x), np.zeros_like(x)]]
+
+
+def _double_exponential_pos_neg_basis(x, t1, t2):
+    return [1 - np.exp(- x / t1), np.exp(- x / t2) - 1, x, np.ones_like(x)]
+
+
+def _double_exponential_pos_neg_basis_jac(x, t1, t2):
+    zero = np.zeros_like(x)
+    return [[-x * np.exp(- x / t1) / t1 ** 2, zero, zero, zero],
+            [zero, x * np.exp(- x / t2) / t2 ** 2, zero, zero]]
+
+
+expfunc_const = register_model(Model(
+    'expfunc_const', _expfunc_const, ['A', 't0', 'c'], _expfunc_const_jac,
+    bounds=([-np.inf, 0, -np.inf], [np.inf] * 3),
+    description='A * (1 - exp(-x / t0)) + c',
+    linear=['A', 'c'], basis=_expfunc_const_basis, basis_jacobian=_expfunc_const_basis_jac))
+
+expFunc_lin_const = register_model(Model(
+    'expFunc_lin_const', _expfunc_lin_const, ['A', 't0', 'c', 'd'], _expfunc_lin_const_jac,
+    bounds=([-np.inf, 0, -np.inf, -np.inf], [np.inf] * 4),
+    description='A * (1 - exp(-x / t0)) + c * x + d',
+    linear=['A', 'c', 'd'], basis=_expfunc_lin_const_basis, basis_jacobian=_expfunc_lin_const_basis_jac))
+
+# same form as expFunc_lin_const, under the name used in the analysis scripts
+single_exponential_activation = register_model(Model(
+    'single_exponential_activation', _expfunc_lin_const, ['A', 't0', 'c', 'd'], _expfunc_lin_const_jac,
+    bounds=([-np.inf, 0, -np.inf, -np.inf], [np.inf] * 4),
+    description='A * (1 - exp(-x / t0)) + c * x + d',
+    linear=['A', 'c', 'd'], basis=_expfunc_lin_const_basis, basis_jacobian=_expfunc_lin_const_basis_jac))
+
+double_exponential_pos_neg = register_model(Model(
+    'double_exponential_pos_neg', _double_exponential_pos_neg, ['A1', 't1', 'A2', 't2', 'c', 'd'],
+    _double_exponential_pos_neg_jac,
+    bounds=([-np.inf, 0, -np.inf, 0, -np.inf, -np.inf], [np.inf] * 6),
+    description='A1 * (1 - exp(-x / t1)) - A2 * (1 - exp(-x / t2)) + c * x + d',
+    linear=['A1', 'A2', 'c', 'd'], basis=_double_exponential_pos_neg_basis,
+    basis_jacobian=_double_exponential_pos_neg_basis_jac))
+
+
+# %% Gaussian convolved models
+
+def _erf_exponential(t, taupulse, taudecay, linearconst, A, C, t_zero):
+    decay = np.exp(taupulse ** 2 / (8 * taudecay ** 2) - t / taudecay)
+    u = np.sqrt(2) * (t + t_zero - taupulse ** 2 / (4 * taudecay)) / taupulse
+    return A * (-decay + linearconst * t + C) * (1 + erf(u))
+
+
+def _erf_exponential_jac(t, taupulse, taudecay, linearconst, A, C, t_zero):
+    decay = np.exp(taupulse ** 2 / (8 * taudecay ** 2) - t / taudecay)
+    u = np.sqrt(2) * (t + t_zero - taupulse ** 2 / (4 * taudecay)) / taupulse
+    g = -decay + linearconst * t + C
+    h = 1 + erf(u)
+    dh_du = 2 / np.sqrt(np.pi) * np.exp(-u ** 2)
+
+    dg_dtp = -decay * taupulse / (4 * taudecay ** 2)
+    du_dtp = -np.sqrt(2) * (t + t_zero) / taupulse ** 2 - np.sqrt(2) / (4 * taudecay)
+    dg_dtd = -decay * (t / taudecay ** 2 - taupulse ** 2 / (4 * taudecay ** 3))
+    du_dtd = np.sqrt(2) * taupulse / (4 * taudecay ** 2)
+    return [A * (dg_dtp * h + g * dh_du * du_dtp),
+            A * (dg_dtd * h + g * dh_du * du_dtd),
+            A * t * h,
+            g * h,
+            A * h,
+            A * g * dh_du * np.sqrt(2) / taupulse]
+
+
+erf_exponential = register_model(Model(
+    'erf_exponential', _erf_exponential, ['taupulse', 'taudecay', 'linearconst', 'A', 'C', 't_zero'],
+    _erf_exponential_jac,
+    bounds=([0, 0, -np.inf, -np.inf, -np.inf, -np.inf], [np.inf] * 6),
+    description='A * (-exp(taupulse^2 / (8 taudecay^2) - t / taudecay) + linearconst * t + C) * '
+                '(1 + erf(sqrt(2) * (t + t_zero - taupulse^2 / (4 taudecay)) / taupulse)), '
+                'exponential decay convolved with a gaussian pulse'))
+
+
+# %% Instrument response convolution
+
+class ConvolvedModel(Model):
+    """ Kinetic model convolved with the instrument response function (IRF).
+
+    The kinetic model describes the response to an instantaneous excitation at t_zero, and is taken as zero
+    before it. It is evaluated on a padded uniform grid and convolved with the IRF through real FFTs, then
+    interpolated back on the data points. The jacobian is obtained the same way, convolving the jacobian of the
+    kinetic model.
+
+    The IRF is either a gaussian, adding the parameter 'fwhm', or a measured IRF given as arrays of time and
+    amplitude. Grids and the transform of a measured IRF are cached, since they are the same at every
+    evaluation of a fit.
+    """
+    broadcasts = False
+
+    def __init__(self, kinetic, irf='gaussian', irf_time=None, step=None, pad=0.1, name=None):
+        """
+        :param kinetic: Model or str
+            kinetic model, or name of a registered one
+        :param irf: 'gaussian' or np.array
+            IRF type, or measured IRF amplitudes
+        :param irf_time: np.array
+            time axis of a measured IRF, with its zero at the excitation time. Ignored for gaussian IRF.
+        :param step: float
+            step of the convolution grid. Defaults to the smallest spacing of the data.
+        :param pad: float
+            padding of the convolution grid at both sides, as fraction of the data time range. Must exceed a few
+            IRF widths.
+        :param name: str
+            model name. Defaults to the kinetic model name followed by '_irf'
+        """
+        self.kinetic = get_model(kinetic)
+        self.gaussian = isinstance(irf, str)
+        if self.gaussian and irf != 'gaussian':
+            raise ValueError('Unknown IRF type: {}'.format(irf))
+        parameters = self.kinetic.parameters + ['t_zero'] + (['fwhm'] if self.gaussian else [])
+        lower = self.kinetic.bounds[0] + [-np.inf] + ([0] if self.gaussian else [])
+        upper = self.kinetic.bounds[1] + [np.inf] + ([np.inf] if self.gaussian else [])
+        if not self.gaussian:
+            self.irf_time = np.asarray(irf_time, dtype=float)
+            self.irf = np.asarray(irf, dtype=float)
+        self.step = step
+        self.pad = pad
+        self._grids = {}
+        Model.__init__(self, name or self.kinetic.name + '_irf', self._evaluate, parameters, self._evaluate_jacobian,
+                       bounds=(lower, upper),
+                       description='({}) convolved with {} IRF'.format(self.kinetic.description,
+                                                                    'gaussian' if self.gaussian else 'measured'))
+
+    def _grid(self, x):
+        """ Step, number of points and FFT length of the convolution grid covering x, cached by data range."""
+        key = (x.min(), x.max(), len(x))
+        if key not in self._grids:
+            step = self.step
+            if step is None:
+                spacing = np.diff(np.unique(x))
+                step = max(spacing.min(), (x.max() - x.min()) / 2 ** 16)
+            pad = self.pad * (x.max() - x.min())
+            n = int(np.ceil((x.max() - x.min() + 2 * pad) / step)) + 2
+            n_fft = spfft.next_fast_len(n, real=True)
+            if len(self._grids) > 32:
+                self._grids.clear()
+            self._grids[key] = (x.min() - pad, step, n, n_fft, spfft.rfftfreq(n_fft, step))
+        return self._grids[key]
+
+    def _response(self, x, kinetic_p, t_zero, jacobian=False):
+        """ Kinetic response on the convolution grid, aligned so that t_zero falls on a grid point. This keeps
+        the model continuous in t_zero, instead of moving the excitation in steps of the grid."""
+        start, step, n, n_fft, frequency = self._grid(x)
+        t = (np.floor((start - t_zero) / step) + np.arange(n)) * step
+        on = np.where(t > 0, 1., np.where(t == 0, 0.5, 0.))
+        response = self.kinetic(t, *kinetic_p) * on
+        if jacobian:
+            response = np.vstack((np.moveaxis(self.kinetic.jacobian(t, *kinetic_p) * on[:, None], -1, 0),
+                                  response))
+        return t + t_zero, response
+
+    def identity(self):
+        identities = Model.identity(self), self.kinetic.identity()
+        if None in identities:
+            return None
+        irf = 'gaussian' if self.gaussian else hashlib.sha1(self.irf_time.tobytes() + self.irf.tobytes()).hexdigest()
+        return '{0}|{1}|{2}|{3}|{4}'.format(identities[0], identities[1], irf, self.step, self.pad)
+
+    def _irf_transform(self, step, n_fft, fwhm):
+        """ Transform of the IRF on the grid, and its derivative by fwhm for gaussian IRFs."""
+        if self.gaussian:
+            return _gaussian_transfer(n_fft, step, fwhm)
+        return _measured_transfer(self.irf_time.tobytes(), self.irf.tobytes(), n_fft, step), None
+
+    def _split(self, p):
+        n = self.kinetic.n_parameters
+        fwhm = p[n + 1] if self.gaussian else None
+        return p[:n], p[n], fwhm
+
+    def _evaluate(self, x, *p):
+        start, step, n, n_fft, frequency = self._grid(x)
+        kinetic_p, t_zero, fwhm = self._split(p)
+        grid, response = self._response(x, kinetic_p, t_zero)
+        transfer, _ = self._irf_transform(step, n_fft, fwhm)
+        convolved = spfft.irfft(spfft.rfft(response, n=n_fft) * transfer, n=n_fft)
+        return np.interp(x, grid, convolved[:n])
+
+    def _evaluate_jacobian(self, x, *p):
+        start, step, n, n_fft, frequency = self._grid(x)
+        kinetic_p, t_zero, fwhm = self._split(p)
+        grid, responses = self._response(x, kinetic_p, t_zero, jacobian=True)
+        transfer, d_transfer = self._irf_transform(step, n_fft, fwhm)
+        spectra = spfft.rfft(responses, n=n_fft, axis=-1)
+        convolved = spfft.irfft(spectra * transfer, n=n_fft, axis=-1)[:, :n]
+        columns = [np.interp(x, grid, column) for column in convolved[:-1]]
+        # shifting t_zero moves the whole convolved signal, which is interpolated linearly on the data points: the
+        # derivative is minus the slope of the interpolating segment. A spectral derivative rings at the step the
+        # zero padding makes at the end of the grid.
+        segment = np.clip(np.searchsorted(grid, x, side='right') - 1, 0, n - 2)
+        columns.append(-np.diff(convolved[-1])[segment] / step)
+        if self.gaussian:
+            columns.append(np.interp(x, grid, spfft.irfft(spectra[-1] * d_transfer, n=n_fft)[:n]))
+        return columns
+
+
+@lru_cache(maxsize=128)
+def _gaussian_transfer(n_fft, step, fwhm):
+    """ Transform of a unit area gaussian of given fwhm, and its derivative by fwhm."""
+    frequency = spfft.rfftfreq(n_fft, step)
+    sigma = fwhm / (2 * np.sqrt(2 * np.log(2)))
+    transfer = np.exp(-2 * (np.pi * frequency * sigma) ** 2)
+    d_transfer = transfer * (-4 * np.pi ** 2 * frequency ** 2 * sigma) / (2 * np.sqrt(2 * np.log(2)))
+    return transfer, d_transfer
+
+
+@lru_cache(maxsize=16)
+def _measured_transfer(irf_time_bytes, irf_bytes, n_fft, step):
+    """ Transform of a measured IRF resampled on the grid step, normalized to unit area.
+    Arrays are passed as bytes to be hashable by the cache."""
+    irf_time = np.frombuffer(irf_time_bytes)
+    irf = np.frombuffer(irf_bytes)
+    t = np.arange(np.ceil(irf_time.min() / step), np.floor(irf_time.max() / step) + 1) * step
+    kernel = np.zeros(n_fft)
+    indices = np.round(t / step).astype(int) % n_fft  # negative times wrap around to the end
+    kernel[indices] = np.interp(t, irf_time, irf)
+    kernel /= kernel.sum()
+    return spfft.rfft(kernel)
+
+
+def convolve_model(kinetic, irf='gaussian', irf_time=None, register=False, **kwargs):
+    """ Return the ConvolvedModel of a kinetic model with the given IRF, optionally adding it to the registry.
+    See ConvolvedModel for arguments."""
+    model = ConvolvedModel(kinetic, irf=irf, irf_time=irf_time, **kwargs)
+    if register:
+        register_model(model)
+    return model
+
+
+# %% Rate equation models
+
+class RateModel(Model):
+    """ Kinetic scheme of populations coupled by first order rates, e.g. A -> B -> ground.
+
+    Populations follow dn/dt = K n, with K the rate matrix built from the transition time constants, and start
+    from the initial populations at x = 0 (zero before). The signal is the sum of the populations weighted by
+    their amplitudes, plus a constant offset. The solution n(x) = V exp(L x) V^-1 n(0) is obtained from the
+    eigendecomposition of K, computed once per set of time constants and cached, so evaluating all time points
+    costs about the same as a sum of exponentials.
+
+    Amplitudes and offset are linear parameters, so the model can be fitted by variable projection.
+    """
+
+    def __init__(self, name, transitions, initial=None, description=None):
+        """
+        :param name: str
+            model name
+        :param transitions: list of tuples
+            (source, target) state names of each transition. target None is a decay to the ground state.
+            Each transition adds a time constant parameter named tau_source_target, or tau_source for decays.
+        :param initial: dict
+            initial population of each state. Defaults to all population in the first state.
+        :param description: str
+        """
+        self.states = []
+        for source, target in transitions:
+            for state in (source, target):
+                if state is not None and state not in self.states:
+                    self.states.append(state)
+        self.transitions = tuple((self.states.index(source), None if target is None else self.states.index(target))
+                                 for source, target in transitions)
+        initial = {self.states[0]: 1.} if initial is None else initial
+        self.initial = tuple(float(initial.get(state, 0.)) for state in self.states)
+
+        taus = ['tau_{0}'.format(source) if target is None else 'tau_{0}_{1}'.format(source, target)
+                for source, target in transitions]
+        amplitudes = ['A_{0}'.format(state) for state in self.states]
+        n_taus = len(taus)
+        if description is None:
+            description = ', '.join('{0} -> {1}'.format(source, 'ground' if target is None else target)
+                                    for source, target in transitions)
+        Model.__init__(self, name, self._evaluate, taus + amplitudes + ['c'], self._evaluate_jacobian,
+                       bounds=([0] * n_taus + [-np.inf] * (len(amplitudes) + 1),
+                               [np.inf] * (n_taus + len(amplitudes) + 1)),
+                       description=description, linear=amplitudes + ['c'], basis=self._basis,
+                       basis_jacobian=self._basis_jacobian)
+
+    @property
+    def n_taus(self):
+        return len(self.transitions)
+
+    def identity(self):
+        identity = Model.identity(self)
+        if identity is None:
+            return None
+        return '{0}|{1}|{2}'.format(identity, self.transitions, self.initial)
+
+    def populations(self, x, *taus):
+        """ Population of each state at times x, array of shape (number of states,) + x.shape.
+        Time constants must be scalars."""
+        x = np.asarray(x, dtype=float)
+        rates, coefficients = _rate_eigensystem(len(self.states), self.transitions, self.initial,
+                                                tuple(float(tau) for tau in taus))
+        t = np.where(x >= 0, x, 0.)
+        populations = np.einsum('ij,j...->i...', coefficients, np.exp(np.multiply.outer(rates, t))).real
+        return populations * (x >= 0)
+
+    def _basis(self, x, *taus):
+        return list(self.populations(x, *taus)) + [np.ones_like(x)]
+
+    def _basis_jacobian(self, x, *taus):
+        """ Derivatives of the populations by each time constant, by central differences on the cached
+        eigendecomposition."""
+        derivatives = []
+        for i, tau in enumerate(taus):
+            h = 1e-6 * abs(tau)
+            up, down = list(taus), list(taus)
+            up[i], down[i] = tau + h, tau - h
+            d = (self.populations(x, *up) - self.populations(x, *down)) / (2 * h)
+            derivatives.append(list(d) + [np.zeros_like(x)])
+        return derivatives
+
+    def _evaluate(self, x, *p):
+        return self._for_each_parameter_set(x, p, self._evaluate_single)
+
+    def _evaluate_jacobian(self, x, *p):
+        return list(np.moveaxis(self._for_each_parameter_set(x, p, self._jacobian_single, extra=(self.n_parameters,)),
+                                -1, 0))
+
+    def _evaluate_single(self, x, *p):
+        taus, amplitudes, c = p[:self.n_taus], p[self.n_taus:-1], p[-1]
+        return np.tensordot(amplitudes, self.populations(x, *taus), axes=1) + c
+
+    def _jacobian_single(self, x, *p):
+        taus, amplitudes = p[:self.n_taus], np.asarray(p[self.n_taus:-1])
+        d_taus = [np.tensordot(amplitudes, np.asarray(d[:-1]), axes=1) for d in self._basis_jacobian(x, *taus)]
+        return np.stack(d_taus + list(self.populations(x, *taus)) + [np.ones_like(x)], axis=-1)
+
+    def _for_each_parameter_set(self, x, p, function, extra=()):
+        """ Evaluate function for parameters given as arrays (e.g. by global fits), once per distinct set of
+        parameters."""
+        if all(np.ndim(value) == 0 for value in p):
+            return function(x, *p)
+        arrays = np.broadcast_arrays(x, *p)
+        x, p = arrays[0], np.stack([a.ravel() for a in arrays[1:]], axis=-1)
+        sets, index = np.unique(p, axis=0, return_inverse=True)
+        index = index.ravel()
+        result = np.empty((x.size,) + extra)
+        x_flat = x.ravel()
+        for k, values in enumerate(sets):
+            selected = index == k
+            result[selected] = function(x_flat[selected], *values)
+        return result.reshape(x.shape + extra)
+
+
+@lru_cache(maxsize=256)
+def _rate_eigensystem(n_states, transitions, initial, taus):
+    """ Eigenvalues of the rate matrix and coefficients of each exponential in each population.
+
+    Populations are n_i(x) = sum_j coefficients[i, j] * exp(rates[j] * x). Equal time constants make the rate
+    matrix defective, they are split by a negligible relative amount to keep the eigenvectors independent.
+    """
+    k = np.zeros((n_states, n_states))
+    taus = np.asarray(taus, dtype=float) * (1 + 1e-7 * np.arange(len(taus)))
+    for (source, target), tau in zip(transitions, taus):
+        k[source, source] -= 1 / tau
+        if target is not None:
+            k[target, source] += 1 / tau
+    rates, vectors = np.linalg.eig(k)
+    weights = np.linalg.solve(vectors, np.asarray(initial, dtype=float))
+    coefficients = vectors * weights
+    coefficients.flags.writeable = False
+    return rates, coefficients
+
+
+two_state_sequential = register_model(RateModel('two_state_sequential', [('A', 'B'), ('B', None)]))
+
+three_state_sequential = register_model(RateModel('three_state_sequential', [('A', 'B'), ('B', 'C'), ('C', None)]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Fri Oct 23 09:41:52 2026
+
+@author: S.Y. Agustsson
+
+module containing the analysis of coherent oscillations (e.g. coherent phonons) in the residuals of transients,
+after subtraction of the fitted incoherent background: windowed, zero padded amplitude spectra of a whole series in
+one batched FFT, time-frequency maps (short time Fourier and Morlet wavelet transforms) of whole series, and
+linear prediction singular value decomposition (LPSVD) of damped cosines,
+
+    y(t) = sum_k A_k * exp(-t * damping_k) * cos(2 pi f_k t + phase_k)
+
+With time in ps, frequencies are in THz and dampings in 1/ps.
+
+"""
+# %% imports
+from functools import lru_cache
+
+import numpy as np
+import scipy.fft as spfft
+from scipy.signal import get_window
+
+from lib import series
+
+
+def main():
+    pass
+
+
+# %% Spectra
+
+def residual_spectra(time, residuals, window='hann', pad_factor=4):
+    """ Amplitude spectra of the residuals of a series, in one batched real FFT.
+
+    Each row is resampled on an evenly spaced axis if needed, its mean removed, multiplied by the window and zero
+    padded to pad_factor times its length (rounded up to a fast FFT length). Spectra are normalized to the
+    window sum, so that a cosine of amplitude A gives a peak of height A.
+
+    :param time: np.array
+        common time axis
+    :param residuals: np.array
+        single trace or 2D array with a trace in each row
+    :param window: str or tuple
+        window passed to scipy.signal.get_window, e.g. 'hann', 'blackman', ('kaiser', 8) or 'boxcar'
+    :param pad_factor: int
+        zero padding factor, interpolating the spectrum
+    :return frequencies: np.array
+        frequency axis, in inverse units of time
+    :return spectra: np.array
+        amplitude spectra, shape (number of traces, len(frequencies))
+    """
+    time, residuals = series.resample_uniform(time, residuals)
+    n_points = residuals.shape[1]
+    step = (time[-1] - time[0]) / (n_points - 1)
+    taper = get_window(window, n_points)
+    n_fft = spfft.next_fast_len(int(pad_factor * n_points), real=True)
+    centered = np.nan_to_num((residuals - np.nanmean(residuals, axis=1, keepdims=True)) * taper, nan=0.)
+    spectra = np.abs(spfft.rfft(centered, n=n_fft, axis=1, workers=-1)) * 2 / taper.sum()
+    return spfft.rfftfreq(n_fft, step), spectra
+
+
+# %% Linear prediction
+
+def lpsvd(time, trace, n_components=2, order=None):
+    """ Frequencies, dampings, amplitudes and phases of damped cosines in a trace, by linear prediction SVD.
+
+    Backward linear prediction coefficients are solved from the prediction matrix truncated to its
+    2 * n_components largest singular values, which removes most of the noise (Kumaresan and Tufts). Signal
+    poles are the roots of the prediction polynomial outside the unit circle, amplitudes and phases follow
+    from linear least squares. Non oscillating components (zero frequency poles) are discarded, so slow
+    leftovers of the background can require a larger n_components.
+
+    :param time: np.array
+        evenly spaced time axis. Traces which are not evenly spaced are resampled.
+    :param trace: np.array
+        oscillating signal, e.g. fit residuals. Non finite values at the ends of the trace, e.g. outside the time
+        range of a scan stacked on a wider grid, are cut off.
+    :param n_components: int
+        number of damped cosines
+    :param order: int
+        prediction order. Defaults to three quarters of the number of points, at most 256.
+    :return frequencies, dampings, amplitudes, phases: np.array
+        parameters of each cosine, sorted by decreasing amplitude, with amplitude and phase at time zero.
+        Components which are not found are nan.
+    """
+    time, trace = series.resample_uniform(time, trace)
+    finite = np.flatnonzero(np.isfinite(trace[0]))
+    if len(finite) == 0:
+        raise ValueError('LPSVD trace has no finite values')
+    time, trace = time[finite[0]:finite[-1] + 1], trace[0, finite[0]:finite[-1] + 1]
+    if len(finite) < len(trace):
+        raise ValueError('LPSVD trace has non finite values between {0} and {1}'.format(time[0], time[-1]))
+    step = (time[-1] - time[0]) / (len(time) - 1)
+    n_points = len(trace)
+    rank = 2 * n_components
+    order = min(3 * n_points // 4, 256) if order is None else order
+    if not rank < order < n_points - rank:
+        raise ValueError('LPSVD order must be between {0} and {1}'.format(rank, n_points - rank))
+
+    # backward prediction: x[n] = sum_k b_k x[n + k]
+    prediction = np.lib.stride_tricks.sliding_window_view(trace[1:], order)[:n_points - order]
+    u, s, vt = np.linalg.svd(prediction, full_matrices=False)
+    b = vt[:rank].T @ ((u[:, :rank].T @ trace[:n_points - order]) / s[:rank])
+    roots = np.roots(np.concatenate(([1.], -b)))
+    poles = 1 / roots[np.argsort(np.abs(roots))[::-1][:rank]]
+
+    rates = np.log(poles.astype(complex)) / step
+    vandermonde = np.exp(np.outer(time - time[0], rates))
+    coefficients = np.linalg.lstsq(vandermonde, trace, rcond=None)[0] * np.exp(-rates * time[0])
+
+    frequencies = rates.imag / (2 * np.pi)
+    oscillating = frequencies > 1e-6 / step
+    result = np.full((4, n_components), np.nan)
+    found = np.column_stack((frequencies, -rates.real, 2 * np.abs(coefficients), np.angle(coefficients)))[oscillating]
+    found = found[np.argsort(found[:, 2])[::-1]][:n_components]
+    result[:, :len(found)] = found.T
+    return tuple(result)
+
+
+# %% Time-frequency maps
+
+@lru_cache(maxsize=32)
+def _taper(window, n_points):
+    taper = get_window(window, n_points)
+    taper.flags.writeable = False
+    return taper
+
+
+@lru_cache(maxsize=32)
+def _morlet_bank(n_fft, step, frequency_bytes, n_cycles):
+    """ Morlet wavelets in the frequency domain, one per row, on the positive frequencies of a real FFT of length
+    n_fft. Each wavelet is a gaussian of relative width 1 / n_cycles, scaled to 2 at its centre frequency so that a
+    cosine of amplitude A gives a map of height A."""
+    frequencies = np.frombuffer(frequency_bytes)
+    axis = spfft.rfftfreq(n_fft, step)
+    bank = 2 * np.exp(-0.5 * ((axis - frequencies[:, None]) * n_cycles / frequencies[:, None]) ** 2)
+    bank.flags.writeable = False
+    return bank
+
+
+def stft_map(time, traces, window_length=None, hop=None, window='hann', pad_factor=2):
+    """ Short time Fourier transform amplitude maps of one or many traces sharing a time axis.
+
+    Segments of all traces are taken as strided views and transformed in one batched real FFT, with the mean of each
+    segment removed. Spectra are normalized as in residual_spectra.
+
+    :param time: np.array
+        common time axis, resampled evenly if needed
+    :param traces: np.array
+        single trace or 2D array with a trace in each row
+    :param window_length: float
+        duration of the segments, in units of time. Defaults to a tenth of the time range.
+    :param hop: int
+        number of points between segments. Defaults to an eighth of the segment length.
+    :param window: str or tuple
+        window of the segments, see scipy.signal.get_window. Windows are cached.
+    :param pad_factor: int
+        zero padding factor of the segments
+    :return delays: np.array
+        centre time of each segment
+    :return frequencies: np.array
+        frequency axis, in inverse units of time
+    :return maps: np.array
+        float32 amplitude maps, shape (number of traces, len(frequencies), len(delays))
+    """
+    time, traces = series.resample_uniform(time, traces)
+    step = (time[-1] - time[0]) / (len(time) - 1)
+    if window_length is None:
+        window_length = (time[-1] - time[0]) / 10
+    n_window = int(np.clip(round(window_length / step), 4, len(time)))
+    hop = max(n_window // 8, 1) if hop is None else hop
+    taper = _taper(window, n_window)
+    n_fft = spfft.next_fast_len(int(pad_factor * n_window), real=True)
+
+    segments = np.lib.stride_tricks.sliding_window_view(traces, n_window, axis=1)[:, ::hop]
+    segments = (segments - segments.mean(axis=2, keepdims=True)) * taper
+    spectra = np.abs(spfft.rfft(segments, n=n_fft, axis=2, workers=-1)) * (2 / taper.sum())
+    delays = time[n_window // 2::hop][:segments.shape[1]]
+    return delays, spfft.rfftfreq(n_fft, step), spectra.transpose(0, 2, 1).astype(np.float32)
+
+
+def wavelet_map(time, traces, frequencies=None, n_cycles=6., stride=1):
+    """ Continuous Morlet wavelet transform amplitude maps of one or many traces sharing a time axis.
+
+    Each trace is transformed once, multiplied by the cached bank of wavelets in the frequency domain and
+    transformed back for all frequencies at once. Traces are zero padded against wrap around. The time resolution
+    at frequency f is about n_cycles / (2 pi f), the frequency resolution f / n_cycles.
+
+    :param time: np.array
+        common time axis, resampled evenly if needed
+    :param traces: np.array
+        single trace or 2D array with a trace in each row
+    :param frequencies: np.array
+        centre frequencies of the wavelets. Defaults to 64 frequencies from four periods per time range to a
+        quarter of the sampling rate.
+    :param n_cycles: float
+        number of oscillations within the wavelet width, trading time for frequency resolution
+    :param stride: int
+        only every stride-th time point is kept in the maps
+    :return delays: np.array
+        time axis of the maps
+    :return frequencies: np.array
+    :return maps: np.array
+        float32 amplitude maps, shape (number of traces, len(frequencies), len(delays))
+    """
+    time, traces = series.resample_uniform(time, traces)
+    step = (time[-1] - time[0]) / (len(time) - 1)
+    n_points = traces.shape[1]
+    if frequencies is None:
+        frequencies = np.linspace(4 / (time[-1] - time[0]), 0.25 / step, 64)
+    frequencies = np.ascontiguousarray(frequencies, dtype=float)
+    padding = int(np.ceil(3 * n_cycles / (2 * np.pi * frequencies.min() * step)))
+    n_fft = spfft.next_fast_len(n_points + padding)
+    bank = _morlet_bank(n_fft, float(step), frequencies.tobytes(), float(n_cycles))
+
+    maps = np.empty((len(traces), len(frequencies), len(range(0, n_points, stride))), dtype=np.float32)
+    analytic = np.zeros((len(frequencies), n_fft), dtype=complex)
+    for i, spectrum in enumerate(spfft.rfft(traces - traces.mean(axis=1, keepdims=True), n=n_fft, axis=1,
+                                            workers=-1)):
+        analytic[:, :bank.shape[1]] = bank * spectrum
+        maps[i] = np.abs(spfft.ifft(analytic, axis=1, workers=-1)[:, :n_points:stride])
+    return time[::stride], frequencies, maps
+
+
+def time_frequency_map(time, traces, method='stft', **kwargs):
+    """ Time-frequency amplitude maps, by short time Fourier transform ('stft', see stft_map) or Morlet wavelet
+    transform ('wavelet', see wavelet_map)."""
+    if method == 'stft':
+        return stft_map(time, traces, **kwargs)
+    elif method == 'wavelet':
+        return wavelet_map(time, traces, **kwargs)
+    raise ValueError('Unknown time-frequency method: {}'.format(method))
+
+
+if __name__ == "__main__":
+    main()
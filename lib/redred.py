@@ -24,6 +24,8 @@ from matplotlib import cm
 import tkinter as tk
 from tkinter import filedialog
 
+from lib import filters
+
 #%%
 def main():
 
@@ -316,16 +318,16 @@ class rrScan(object):
         self.trace = self.trace - np.average(self.trace[7460:7500:1])
         self.analysisHistory.append('remove_DC_offset')
 
-    def filterit(self, cutHigh = 0.1, order = 2):
-        """ apply simple low pass filter to data"""
-        b, a = spsignal.butter(order, cutHigh, 'low', analog= False)
-        self.trace = spsignal.lfilter(b,a,self.rawtrace)
+    def filterit(self, cutHigh = 0.1, order = 2, zero_phase = False):
+        """ apply simple low pass filter to data. The filter is causal unless zero_phase is True, see
+        filters.sos_low_pass"""
+        self.trace = filters.sos_low_pass(self.rawtrace, cutHigh, order, zero_phase=zero_phase)
         self.filter = cutHigh
         self.analysisHistory.append('filter')
 
     def nyqistFreq(self):
         """returns the Nyquist frequency from time data"""
-        return(abs(0.5 * len(self.time) / self.time[-1] - self.time[0]))
+        return(abs(0.5 * len(self.time) / (self.time[-1] - self.time[0])))
 
     def filterFreq(self):
         """ Gives low pass filter frequency in THz """
@@ -692,9 +694,9 @@ class rrScans(object):
                 print('There is no such parametr')
 #%%functions applying redred functions to every scan in the list
 
-    def filterit(self, cutHigh = 0.1, order = 2):
+    def filterit(self, cutHigh = 0.1, order = 2, zero_phase = False):
         for item in self.scans:
-            item=item.filterit(cutHigh, order)
+            item=item.filterit(cutHigh, order, zero_phase)
 
     def removeDC(self):
         for item in self.scans:
@@ -825,10 +827,10 @@ def timezero_shift(timeData, timeZero = 0, reverse = 'False'):
     #return(newtimedata, timeshift)
     return(timeData)
 
-def quick_filter(trace, order = 2, cutfreq = 0.1):
-    """ apply simple low pass filter to data"""
-    b, a = sp.signal.butter(order, cutfreq, 'low', analog= False)
-    filtered_trace = sp.signal.lfilter(b,a,trace)
+def quick_filter(trace, order = 2, cutfreq = 0.1, zero_phase = False):
+    """ apply simple low pass filter to data. The filter is causal unless zero_phase is True, see
+    filters.sos_low_pass"""
+    filtered_trace = filters.sos_low_pass(trace, cutfreq, order, zero_phase=zero_phase)
     return(filtered_trace)
 
 def file_to_dict(filepath):
@@ -0,0 +1,560 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 10:12:31 2026
+
+@author: S.Y. Agustsson
+
+module containing vectorized functions acting on a whole dependence series at once.
+A series is represented as a 2D "series matrix" with one scan per row, all sharing
+the same time axis.
+
+"""
+# %% imports
+import warnings
+from functools import lru_cache
+
+import numpy as np
+from scipy import sparse
+from scipy.interpolate import CubicSpline
+from scipy.ndimage import median_filter, uniform_filter1d
+from scipy.sparse.linalg import svds
+from scipy.special import erf
+
+
+def main():
+    pass
+
+
+# %% Series matrix
+
+def stack_traces(times, traces, time_grid=None):
+    """ Stack a list of traces in a 2D array with a scan in each row, on a common time axis.
+
+    If all scans share the same time axis they are stacked as they are, otherwise each
+    trace is linearly interpolated on time_grid. If time_grid is not given, a grid is made
+    on the time range common to all scans, with the largest number of points found in the series.
+
+    :param times: list of arrays
+        time axis of each scan
+    :param traces: list of arrays
+        data of each scan
+    :param time_grid: np.array or None
+        common time axis on which to interpolate the data.
+    :return time_grid: np.array
+        common time axis
+    :return matrix: np.array
+        2D array of shape (len(traces), len(time_grid))
+    """
+    times = [np.asarray(t, dtype=float) for t in times]
+    traces = [np.asarray(t, dtype=float) for t in traces]
+
+    if time_grid is None:
+        same_axis = all(len(t) == len(times[0]) for t in times) and all(
+            np.array_equal(t, times[0]) for t in times[1:])
+        if same_axis:
+            return times[0].copy(), np.vstack(traces)
+        t_min = max(t.min() for t in times)
+        t_max = min(t.max() for t in times)
+        n_points = max(len(t) for t in times)
+        time_grid = np.linspace(t_min, t_max, n_points)
+    else:
+        time_grid = np.asarray(time_grid, dtype=float)
+
+    matrix = np.empty((len(traces), len(time_grid)))
+    for i, (t, y) in enumerate(zip(times, traces)):
+        if t[0] > t[-1]:  # np.interp requires increasing x
+            t, y = t[::-1], y[::-1]
+        matrix[i] = np.interp(time_grid, t, y)
+    return time_grid, matrix
+
+
+def resample_uniform(time, matrix):
+    """ Linearly interpolate a series matrix on an evenly spaced, increasing, time axis with the same number of points.
+
+    Scans from the delay stage sweep are not evenly spaced in time. Since all rows share the same axis, interpolation
+    indices and weights are computed once and applied to the whole matrix.
+    :return time: np.array
+        evenly spaced time axis
+    :return matrix: np.array
+        interpolated series matrix
+    """
+    time = np.asarray(time, dtype=float)
+    matrix = np.atleast_2d(np.asarray(matrix, dtype=float))
+    if time[0] > time[-1]:
+        time, matrix = time[::-1], matrix[:, ::-1]
+    step = np.diff(time)
+    if np.allclose(step, step.mean(), rtol=1e-3):
+        return time, matrix
+    grid = np.linspace(time[0], time[-1], len(time))
+    index = np.clip(np.searchsorted(time, grid, side='right') - 1, 0, len(time) - 2)
+    weight = (grid - time[index]) / (time[index + 1] - time[index])
+    return grid, matrix[:, index] * (1 - weight) + matrix[:, index + 1] * weight
+
+
+# %% Interpolation
+
+def interpolation_operator(x, grid, kind='linear', period=None):
+    """ Sparse matrix of interpolation weights from samples at x to the points of grid, such that
+    operator @ values interpolates values (or all columns of a matrix with a row per sample) on grid.
+
+    Operators are cached for each (x, grid, kind, period), so that maps of many delay points, or repeated maps of the
+    same series, are a single sparse matrix product. Repeated x values are averaged, and values outside the range of
+    x are taken from the closest sample, as by np.interp.
+
+    :param x: np.array
+        positions of the samples, in any order
+    :param grid: np.array
+        positions at which values are interpolated
+    :param kind: str
+        'nearest', 'linear' or 'cubic' (cubic spline, not-a-knot or periodic)
+    :param period: float
+        if given, x is periodic (e.g. 360 for angles in degrees) and interpolation wraps around
+    :return operator: scipy.sparse.csr_matrix
+        shape (len(grid), len(x))
+    """
+    x = np.ascontiguousarray(x, dtype=float)
+    grid = np.ascontiguousarray(grid, dtype=float)
+    return _interpolation_operator(x.tobytes(), grid.tobytes(), kind, period)
+
+
+@lru_cache(maxsize=32)
+def _interpolation_operator(x_bytes, grid_bytes, kind, period):
+    x = np.frombuffer(x_bytes)
+    grid = np.frombuffer(grid_bytes)
+    if period:
+        x, grid = x % period, grid % period
+    unique, inverse, counts = np.unique(x, return_inverse=True, return_counts=True)
+    n_unique = len(unique)
+    nodes, index = unique, np.arange(n_unique)
+    if period:
+        nodes = np.concatenate(([unique[-1] - period], unique, [unique[0] + period]))
+        index = np.concatenate(([n_unique - 1], index, [0]))
+    else:
+        grid = np.clip(grid, unique[0], unique[-1])
+    rows = np.arange(len(grid))
+
+    if n_unique == 1:
+        operator = sparse.csr_matrix(np.ones((len(grid), 1)))
+    elif kind in ('linear', 'nearest'):
+        left = np.clip(np.searchsorted(nodes, grid, side='right') - 1, 0, len(nodes) - 2)
+        weight = np.clip((grid - nodes[left]) / (nodes[left + 1] - nodes[left]), 0, 1)
+        if kind == 'nearest':
+            weight = np.round(weight)
+        operator = sparse.csr_matrix((np.concatenate((1 - weight, weight)),
+                                      (np.concatenate((rows, rows)), np.concatenate((index[left], index[left + 1])))),
+                                     shape=(len(grid), n_unique))
+    elif kind == 'cubic':
+        if period:
+            spline = CubicSpline(nodes[1:], np.eye(n_unique)[index[1:]], bc_type='periodic')
+        else:
+            spline = CubicSpline(unique, np.eye(n_unique))
+        operator = sparse.csr_matrix(spline(grid))
+    else:
+        raise ValueError('Unknown interpolation kind: {}'.format(kind))
+
+    # average repeated samples
+    averaging = sparse.csr_matrix((1 / counts[inverse], (inverse, np.arange(len(x)))), shape=(n_unique, len(x)))
+    operator = (operator @ averaging).tocsr()
+    operator.eliminate_zeros()
+    operator.data.flags.writeable = False
+    return operator
+
+
+def parameter_map(values, matrix, grid=None, n_points=200, kind='linear', period=None):
+    """ Image of a series on a regular grid of a dependence parameter, e.g. a (temperature, delay) map.
+
+    The series is interpolated along the parameter axis, at all delays at once, with a cached interpolation operator
+    (see interpolation_operator), which costs a few operations per pixel for 'linear' and 'nearest'.
+
+    :param values: np.array
+        parameter value of each scan (row of matrix)
+    :param matrix: np.array
+        series matrix, one scan per row on a common time axis
+    :param grid: np.array
+        parameter values of the image rows. Defaults to n_points evenly spaced values over the range of values.
+    :param n_points: int
+        number of image rows if grid is not given
+    :param kind: str
+        interpolation along the parameter axis, 'nearest', 'linear' or 'cubic'
+    :param period: float
+        period of a periodic parameter, e.g. 360 for angles
+    :return grid: np.array
+        parameter axis
+    :return image: np.array
+        C contiguous array of shape (len(grid), number of delays), ready for imshow or pcolormesh
+    """
+    values = np.asarray(values, dtype=float)
+    if grid is None:
+        grid = np.linspace(values.min(), values.max(), n_points)
+    grid = np.asarray(grid, dtype=float)
+    operator = interpolation_operator(values, grid, kind=kind, period=period)
+    if operator.nnz > 4 * operator.shape[0]:  # dense cubic spline weights are faster as a BLAS product
+        operator = operator.toarray()
+    return grid, np.ascontiguousarray(operator @ np.asarray(matrix))
+
+
+# %% Time zero
+
+def find_time_zero(time, matrix, method='derivative', smooth=21, window=None, iterations=15):
+    """ Find pump-probe overlap (time zero) for each scan of a series matrix.
+
+    method 'derivative' looks for the steepest edge in the smoothed traces, refined to
+    sub-sample precision by a parabola through the three points around the maximum.
+    method 'erf' uses the derivative result as starting point and fits an error function
+    step  A/2 * (1 + erf((t - t0) / w)) + c  on a window around the edge, simultaneously for all
+    scans, through a batched Gauss-Newton optimization.
+
+    :param time: np.array
+        common time axis of the series, monotonous
+    :param matrix: np.array
+        2D array with a scan in each row
+    :param method: str
+        'derivative' or 'erf'
+    :param smooth: int
+        width, in points, of the moving average applied before differentiation.
+    :param window: int
+        half width, in points, of the region around the edge used by the 'erf' fit. Defaults to 3 * smooth.
+    :param iterations: int
+        number of Gauss-Newton steps used by the 'erf' fit.
+    :return t0: np.array
+        time zero of each scan
+    """
+    time = np.asarray(time, dtype=float)
+    matrix = np.atleast_2d(np.asarray(matrix, dtype=float))
+    time, matrix = resample_uniform(time, matrix)
+    n_scans, n_points = matrix.shape
+    rows = np.arange(n_scans)
+
+    if smooth > 1:
+        smoothed = uniform_filter1d(matrix, size=smooth, axis=1, mode='nearest')
+    else:
+        smoothed = matrix
+    derivative = np.abs(np.gradient(smoothed, time, axis=1))
+    # ignore edge points, where filtering and gradient are least reliable
+    edge = max(smooth, 1)
+    derivative[:, :edge] = 0
+    derivative[:, n_points - edge:] = 0
+    peak = np.clip(np.argmax(derivative, axis=1), 1, n_points - 2)
+
+    # parabolic interpolation of the peak position, in units of points
+    y_prev = derivative[rows, peak - 1]
+    y_peak = derivative[rows, peak]
+    y_next = derivative[rows, peak + 1]
+    denominator = y_prev - 2 * y_peak + y_next
+    with np.errstate(divide='ignore', invalid='ignore'):
+        offset = np.where(denominator != 0, 0.5 * (y_prev - y_next) / denominator, 0.)
+    offset = np.clip(offset, -1, 1)
+    t0 = np.interp(peak + offset, np.arange(n_points), time)
+
+    if method == 'derivative':
+        return t0
+    elif method == 'erf':
+        if window is None:
+            window = 3 * max(smooth, 1)
+        return _fit_erf_edge(time, matrix, t0, peak, window, iterations)
+    else:
+        raise ValueError('Unknown time zero method: {}'.format(method))
+
+
+def _fit_erf_edge(time, matrix, t0, peak, window, iterations):
+    """ Batched Gauss-Newton fit of an error function step around the given edge positions."""
+    n_scans, n_points = matrix.shape
+    idx = np.clip(peak[:, None] + np.arange(-window, window + 1), 0, n_points - 1)
+    t = time[idx]
+    y = matrix[np.arange(n_scans)[:, None], idx]
+
+    # initial guesses: amplitude from window ends, width from window size
+    c = y[:, :3].mean(axis=1)
+    amplitude = y[:, -3:].mean(axis=1) - c
+    width = np.abs(t[:, -1] - t[:, 0]) / 8
+    p = np.column_stack((amplitude, t0, width, c))
+    min_width = np.abs(np.diff(time)).min() / 10
+
+    for _ in range(iterations):
+        A, x0, w, c = p.T
+        u = (t - x0[:, None]) / w[:, None]
+        gauss = np.exp(-u ** 2) / np.sqrt(np.pi)
+        model = 0.5 * A[:, None] * (1 + erf(u)) + c[:, None]
+        residual = y - model
+        jacobian = np.stack((0.5 * (1 + erf(u)),
+                             -A[:, None] * gauss / w[:, None],
+                             -A[:, None] * gauss * u / w[:, None],
+                             np.ones_like(u)), axis=2)
+        jtj = np.einsum('nki,nkj->nij', jacobian, jacobian)
+        jtr = np.einsum('nki,nk->ni', jacobian, residual)
+        jtj += 1e-9 * np.eye(4) * np.trace(jtj, axis1=1, axis2=2)[:, None, None]
+        step = np.linalg.solve(jtj, jtr[..., None])[..., 0]
+        p = p + step
+        p[:, 2] = np.maximum(np.abs(p[:, 2]), min_width)
+
+    t_fit = p[:, 1]
+    # reject diverging fits, falling back on the derivative estimate
+    diverged = ~np.isfinite(t_fit) | (t_fit < t.min(axis=1)) | (t_fit > t.max(axis=1))
+    t_fit[diverged] = t0[diverged]
+    return t_fit
+
+
+# %% Decimation
+
+def log_bins(time, n_bins=200, time_zero=0.):
+    """ Bin edges evenly spaced in log of the delay from time_zero, on both sides of it.
+
+    Near time zero bins are as fine as the data, while the slow tail, where most points of a transient lie and the
+    signal varies slowly, is averaged in few bins.
+    :param time: np.array
+        time axis
+    :param n_bins: int
+        approximate number of bins
+    :param time_zero: float
+        delay origin
+    :return edges: np.array
+        increasing bin edges
+    """
+    delay = np.asarray(time, dtype=float) - time_zero
+    span = np.abs(delay).max()
+    spacing = np.diff(np.unique(delay))
+    finest = spacing.min() if len(spacing) else span
+    finest = max(finest, span * 1e-6)
+    # bins are shared between the two sides in proportion to the decades they span
+    decades = np.log10(np.maximum(np.array([-delay.min(), delay.max()]), finest) / (finest / 2))
+    n_negative = int(round(n_bins * decades[0] / decades.sum()))
+    positive = np.geomspace(finest / 2, max(delay.max(), finest), max(n_bins - n_negative, 1) + 1)
+    negative = -np.geomspace(finest / 2, max(-delay.min(), finest), max(n_negative, 1) + 1)[::-1]
+    edges = np.concatenate((negative, positive)) + time_zero
+    edges[0], edges[-1] = np.nextafter(time.min(), -np.inf), np.nextafter(time.max(), np.inf)
+    return np.unique(edges)
+
+
+def decimate(time, trace, n_bins=200, time_zero=0.):
+    """ Average a trace in log spaced delay bins, see log_bins. Empty bins are dropped.
+    :return time, trace: np.array
+        mean time and trace in each bin
+    :return counts: np.array
+        number of points in each bin. The uncertainty of a binned point scales as 1 / sqrt(counts).
+    """
+    time = np.asarray(time, dtype=float)
+    trace = np.asarray(trace, dtype=float)
+    edges = log_bins(time, n_bins, time_zero)
+    index = np.clip(np.searchsorted(edges, time, side='right') - 1, 0, len(edges) - 2)
+    counts = np.bincount(index, minlength=len(edges) - 1)
+    full = counts > 0
+    binned_time = np.bincount(index, weights=time, minlength=len(edges) - 1)[full] / counts[full]
+    binned_trace = np.bincount(index, weights=trace, minlength=len(edges) - 1)[full] / counts[full]
+    return binned_time, binned_trace, counts[full]
+
+
+# %% Decomposition
+
+def truncated_svd(matrix, n_components=10, method='randomized', center=False, n_oversamples=10, n_iter=4,
+                  seed=None):
+    """ Leading singular values and vectors of a series matrix.
+
+    The 'randomized' method (Halko, Martinsson and Tropp) projects the matrix on a random subspace slightly larger
+    than n_components, refined by a few power iterations, and only decomposes this small projection. Memory and
+    time scale with n_components instead of the matrix size, so thousands of scans of tens of thousands of
+    points can be decomposed on a workstation. 'arpack' uses the iterative scipy.sparse.linalg.svds, 'dense'
+    the full numpy SVD.
+
+    :param matrix: np.array
+        2D array with a scan in each row. float32 matrices are decomposed in single precision.
+    :param n_components: int
+        number of singular values and vectors
+    :param method: str
+        'randomized', 'arpack' or 'dense'
+    :param center: bool
+        subtract the mean scan first, making this a principal component analysis
+    :param n_oversamples: int
+        extra dimensions of the random subspace of the 'randomized' method
+    :param n_iter: int
+        power iterations of the 'randomized' method, improving accuracy on slowly decaying spectra
+    :param seed: int
+        seed of the random projection
+    :return u: np.array
+        left singular vectors, scan weights, shape (number of scans, n_components)
+    :return s: np.array
+        singular values, decreasing
+    :return vt: np.array
+        right singular vectors, basis transients, shape (n_components, number of points)
+    """
+    matrix = np.atleast_2d(matrix)
+    if matrix.dtype != np.float32:
+        matrix = np.asarray(matrix, dtype=float)
+    if center:
+        matrix = matrix - matrix.mean(axis=0)
+    n_components = min(n_components, min(matrix.shape))
+
+    if method == 'dense':
+        u, s, vt = np.linalg.svd(matrix, full_matrices=False)
+        u, s, vt = u[:, :n_components], s[:n_components], vt[:n_components]
+    elif method == 'arpack':
+        u, s, vt = svds(matrix, k=min(n_components, min(matrix.shape) - 1))
+        order = np.argsort(s)[::-1]
+        u, s, vt = u[:, order], s[order], vt[order]
+    elif method == 'randomized':
+        rng = np.random.default_rng(seed)
+        size = min(n_components + n_oversamples, min(matrix.shape))
+        q = matrix @ rng.standard_normal((matrix.shape[1], size)).astype(matrix.dtype)
+        for _ in range(n_iter):
+            q = np.linalg.qr(q)[0]
+            q = matrix @ np.linalg.qr(matrix.T @ q)[0]
+        q = np.linalg.qr(q)[0]
+        u_small, s, vt = np.linalg.svd(q.T @ matrix, full_matrices=False)
+        u, s, vt = (q @ u_small)[:, :n_components], s[:n_components], vt[:n_components]
+    else:
+        raise ValueError('Unknown SVD method: {}'.format(method))
+
+    # deterministic signs: largest element of each basis transient is positive
+    signs = np.sign(vt[np.arange(len(vt)), np.argmax(np.abs(vt), axis=1)])
+    signs[signs == 0] = 1
+    return u * signs, s, vt * signs[:, None]
+
+
+# %% Averaging
+
+def weighted_average(matrix, sigmas):
+    """ Inverse variance weighted average of the scans of a series matrix, so that noisy scans count less.
+    :param matrix: np.array
+        series matrix, one scan per row
+    :param sigmas: np.array
+        noise standard deviation of each scan
+    :return average: np.array
+        weighted average scan
+    :return sigma: np.array
+        standard deviation of the average at each point
+    """
+    weights = 1 / np.asarray(sigmas, dtype=float) ** 2
+    average = weights @ np.asarray(matrix, dtype=float) / weights.sum()
+    return average, np.full(average.shape, 1 / np.sqrt(weights.sum()))
+
+
+# %% Quality screening
+
+def scan_statistics(times, traces):
+    """ Cheap quality statistics of raw scans, computed at once for scans of the same length.
+
+    :param times, traces: list of np.array
+        raw time axis and trace of each scan, possibly of different lengths or empty
+    :return statistics: dict
+        arrays with an entry per scan:
+            - 'n_points': number of points
+            - 'nan_fraction': fraction of non finite time or trace values
+            - 'sweep_points': number of points of the monotonic delay sweep kept by Transient.crop_time_scale,
+                0 if the scan has no complete sweep
+            - 'noise': high frequency noise, robust standard deviation of the first differences of the trace
+                divided by sqrt(2)
+    """
+    times = [np.asarray(t, dtype=float).ravel() for t in times]
+    traces = [np.asarray(y, dtype=float).ravel() for y in traces]
+    n_scans = len(times)
+    statistics = {'n_points': np.array([min(len(t), len(y)) for t, y in zip(times, traces)]),
+                  'nan_fraction': np.ones(n_scans),
+                  'sweep_points': np.zeros(n_scans, dtype=int),
+                  'noise': np.full(n_scans, np.nan)}
+    lengths = statistics['n_points']
+    for length in np.unique(lengths[lengths > 2]):
+        rows = np.flatnonzero(lengths == length)
+        t = np.vstack([times[i][:length] for i in rows])
+        y = np.vstack([traces[i][:length] for i in rows])
+        finite = np.isfinite(t) & np.isfinite(y)
+        statistics['nan_fraction'][rows] = 1 - finite.mean(axis=1)
+        statistics['sweep_points'][rows] = _sweep_points(np.where(finite, t, np.nan))
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)  # all-nan scans
+            d = np.diff(y, axis=1)
+            deviation = np.abs(d - np.nanmedian(d, axis=1, keepdims=True))
+            statistics['noise'][rows] = 1.4826 * np.nanmedian(deviation, axis=1) / np.sqrt(2)
+    return statistics
+
+
+def _sweep_points(t):
+    """ Length of the monotonic sweep between the extremes of each time axis (row of t), as cropped by
+    Transient.crop_time_scale: from the first extreme reached after the start to the next opposite extreme."""
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        t_max = np.nanmax(t, axis=1, keepdims=True)
+        t_min = np.nanmin(t, axis=1, keepdims=True)
+    rising = t[:, :1] < t[:, 1:2]  # start moving up: the sweep runs from the maximum down to the minimum
+    first = np.where(rising, t >= t_max, t <= t_min)
+    start = np.argmax(first, axis=1)
+    after = np.arange(t.shape[1]) >= start[:, None]
+    last = np.where(rising, t <= t_min, t >= t_max) & after
+    end = np.argmax(last, axis=1)
+    valid = first.any(axis=1) & last.any(axis=1) & (t[:, 0] != t[:, 1])
+    return np.where(valid, end - start, 0)
+
+
+def screen_scans(times, traces, R0=None, min_points=100, max_nan_fraction=0.01, noise_factor=10.,
+                 R0_deviation=None):
+    """ Screen raw scans for corrupt or aborted measurements, see scan_statistics.
+
+    :param times, traces: list of np.array
+        raw time axis and trace of each scan
+    :param R0: list
+        static reflectivity of each scan, None where unknown
+    :param min_points: int
+        minimum number of points of the delay sweep
+    :param max_nan_fraction: float
+        maximum fraction of non finite values
+    :param noise_factor: float
+        maximum ratio of the noise of a scan to the median noise of the series
+    :param R0_deviation: float
+        maximum relative deviation of R0 from the median of the series. None skips this check.
+    :return reasons: list of list of str
+        reasons for rejecting each scan, empty for scans which pass
+    :return statistics: dict
+        see scan_statistics
+    """
+    statistics = scan_statistics(times, traces)
+    reasons = [[] for _ in range(len(statistics['n_points']))]
+    median_noise = np.nanmedian(statistics['noise']) if np.any(np.isfinite(statistics['noise'])) else np.nan
+    if R0 is not None and R0_deviation is not None:
+        R0 = np.array([np.nan if r is None else r for r in R0], dtype=float)
+        R0_median = np.nanmedian(R0) if np.any(np.isfinite(R0)) else np.nan
+    for i, scan_reasons in enumerate(reasons):
+        if statistics['n_points'][i] == 0:
+            scan_reasons.append('no data')
+            continue
+        if statistics['nan_fraction'][i] > max_nan_fraction:
+            scan_reasons.append('{:.1%} non finite values'.format(statistics['nan_fraction'][i]))
+        if statistics['sweep_points'][i] < min_points:
+            scan_reasons.append('delay sweep of {0} points, less than {1}'.format(statistics['sweep_points'][i],
+                                                                                   min_points))
+        if statistics['noise'][i] > noise_factor * median_noise:
+            scan_reasons.append('noise {:.1f} times the series median'.format(statistics['noise'][i] / median_noise))
+        if R0 is not None and R0_deviation is not None and abs(R0[i] - R0_median) > R0_deviation * abs(R0_median):
+            scan_reasons.append('R0 = {0:.4g} deviates from the series median {1:.4g}'.format(R0[i], R0_median))
+    return reasons, statistics
+
+
+# %% Outlier rejection
+
+def hampel_filter(matrix, window=21, n_sigma=4.):
+    """ Hampel filter applied along each row of a series matrix.
+
+    Points deviating from the rolling median by more than n_sigma times the median absolute
+    deviation from it (scaled to a gaussian standard deviation) are replaced by the rolling median.
+    The deviation is estimated over the whole row, which is both faster and less noisy than a rolling estimate
+    on the short windows needed to catch spikes.
+
+    :param matrix: np.array
+        2D array with a scan in each row. All rows must have the same length.
+    :param window: int
+        size, in points, of the rolling median window.
+    :param n_sigma: float
+        rejection threshold in units of standard deviation.
+    :return filtered: np.array
+        copy of matrix with outliers replaced
+    :return mask: np.array
+        boolean array, True where a point was rejected
+    """
+    matrix = np.atleast_2d(np.asarray(matrix, dtype=float))
+    median = median_filter(matrix, size=(1, window), mode='nearest')
+    deviation = np.abs(matrix - median)
+    sigma = 1.4826 * np.median(deviation, axis=1, keepdims=True)
+    mask = (deviation > n_sigma * sigma) & (sigma > 0)
+    filtered = np.where(mask, median, matrix)
+    return filtered, mask
+
+
+if __name__ == "__main__":
+    main()
@@ -7,14 +7,23 @@ Created on Mon May 15 09:57:29 2017
 
 import os
 import re
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
 import pandas as pd
 import scipy.io as spio
-import scipy.signal as spsignal
 from matplotlib import cm, pyplot as plt
 from scipy.optimize import curve_fit
 
+from lib import angular
+from lib import filters
+from lib import fitting
+from lib import lifetimes
+from lib import mcmc
+from lib import models
+from lib import oscillations
+from lib import series as srs
+from lib import ttm
 from lib import utils
 
 
@@ -69,6 +78,7 @@ class Transient(object):
 
         self.time = np.array([])  # cleaned time axis
         self.trace = np.array([])  # cleaned and modified data trace
+        self.rejected_mask = None  # True where points of trace were rejected as outliers
 
         ######################################
         #              Metadata              #
@@ -113,6 +123,7 @@ class Transient(object):
         self.analysis_log = {}  # Keeps track of analysis changes performed
         self.fit_function = None
         self.fit_parameters = None
+        self.sigma = None  # Noise standard deviation of trace, see estimate_noise
 
         ######################################
         #             input info             #
@@ -127,7 +138,7 @@ class Transient(object):
             self.key_parameter_value = None
         self.series_name = series_name
         # ignore list for metadata export. Add here any further non-metadata attributes created in this class.
-        self.DATA_ATTRIBUTES = ('raw_time', 'raw_trace', 'time', 'trace', 'DATA_ATTRIBUTES')
+        self.DATA_ATTRIBUTES = ('raw_time', 'raw_trace', 'time', 'trace', 'rejected_mask', 'DATA_ATTRIBUTES')
 
     # %% metadata management
     def key_parameter_value(self):
@@ -179,7 +190,7 @@ class Transient(object):
                     metadata[key] = value
         return metadata
 
-    def log_it(self, keyword, overwrite=False, *args, **kargs):
+    def log_it(self, keyword, *args, overwrite=False, **kargs):
         """
         Generate log entry for analysis_log.
             creates a key with given key in analysis_log, making it:
@@ -215,23 +226,25 @@ class Transient(object):
             if entry == None:  # trigger boolean behaviour, flipping previous registered status if available
                 self.analysis_log[keyword] = not previous_value
 
-            elif entry is list:
-                if overwrite:
+            elif isinstance(entry, list):
+                if overwrite or not isinstance(previous_value, list):
                     self.analysis_log[keyword] = entry
                     # setattr(self, key_string, previous_value + entry)
                 else:
-                    entry = previous_value.append(entry)
+                    self.analysis_log[keyword] = previous_value + entry
+            elif isinstance(entry, dict):
+                if overwrite or not isinstance(previous_value, dict):
                     self.analysis_log[keyword] = entry
-            elif entry is dict:
-                if overwrite:
-                    self.analysis_log[keyword] = entry
-                else:
-                    new_entry = {}
-                    for key in entry:
+                else:  # keep all previous keys, extending those logged again: lists are concatenated, others appended
+                    new_entry = dict(previous_value)
+                    for key, value in entry.items():
                         if key in previous_value:
-                            new_entry[key] = previous_value[key].append(entry[key])
+                            previous = previous_value[key]
+                            if not isinstance(previous, list):
+                                previous = [previous]
+                            new_entry[key] = previous + (value if isinstance(value, list) else [value])
                         else:
-                            new_entry[key] = entry[key]
+                            new_entry[key] = value
 
                     self.analysis_log[keyword] = new_entry
         except KeyError:  # rises Key error when key was not previously assigned -> no previous record of this analysis
@@ -480,14 +493,20 @@ class Transient(object):
     # %% Data manipulation
 
     def clean_data(self, cropTimeScale=True, shiftTime=0, flipTime=True, removeDC=True, filterLowPass=True,
-                   flipTrace=False):
-        """Perform a standard set of data cleaning, good for quick plotting and test purposes."""
+                   flipTrace=False, rejectOutliers=False, filterOrder=1):
+        """Perform a standard set of data cleaning, good for quick plotting and test purposes.
+        filterLowPass can be set to 'auto' to choose the filter cutoff from the noise spectrum, filterOrder is the order
+        of the low pass filter."""
         if cropTimeScale:
             self.crop_time_scale()
+        if rejectOutliers:
+            self.reject_outliers()
         if shiftTime:
             self.shift_time(shiftTime)
-        if filterLowPass:
-            self.filter_low_pass()
+        if filterLowPass == 'auto':
+            self.filter_low_pass(cutHigh='auto', order=filterOrder)
+        elif filterLowPass:
+            self.filter_low_pass(order=filterOrder)
         if flipTrace:
             self.flip_trace()
         if removeDC:
@@ -503,6 +522,7 @@ class Transient(object):
         self.analysis_log = {}  # reset log
         self.time = []  # reset time and trace
         self.trace = []
+        self.rejected_mask = None
         # print('crop time scale, len: ' + str(len(self.raw_time)))
         maxT = max(self.raw_time)
         minT = min(self.raw_time)
@@ -546,6 +566,8 @@ class Transient(object):
         self.time = self.time[::-1]
         self.time = -np.array(self.time)
         self.trace = self.trace[::-1]
+        if self.rejected_mask is not None:
+            self.rejected_mask = self.rejected_mask[::-1]
         self.log_it('Flip Time')
 
     def flip_trace(self):
@@ -572,24 +594,88 @@ class Transient(object):
         self.trace = self.trace - shift
         self.log_it('Remove DC', window=window, shift=shift)
 
-    def filter_low_pass(self, cutHigh=0.1, order=1, return_frequency=False):  # todo: add different methods between which to choose
+    def estimate_noise(self, time_zero=0., margin=0.5, min_points=10):
+        """ Estimate the noise standard deviation of the trace, from the points before time zero or, when there are
+        too few, from its high frequency content. See filters.estimate_noise.
+        The result is stored in sigma, and used to weight fits and averages.
+        :return sigma: float
+        """
+        sigma, baseline, high_frequency = filters.estimate_noise(self.time, self.trace, time_zero=time_zero,
+                                                                 margin=margin, min_points=min_points)
+        self.sigma = float(sigma[0])
+        self.log_it('Noise Estimate', overwrite=True, sigma=self.sigma, baseline=float(baseline[0]),
+                    high_frequency=float(high_frequency[0]))
+        return self.sigma
+
+    def reject_outliers(self, window=21, n_sigma=4.):
+        """ Remove spikes from the trace with a Hampel filter: points further than n_sigma robust standard deviations
+        from the rolling median over window points are replaced by the median. See series.hampel_filter.
+        Rejected points are stored as a boolean mask in self.rejected_mask. Should be applied before filtering,
+        which would otherwise smear spikes over the neighbouring points."""
+        filtered, mask = srs.hampel_filter(self.trace, window=window, n_sigma=n_sigma)
+        self.trace = filtered[0]
+        self._record_rejection(mask[0], window, n_sigma)
+
+    def _record_rejection(self, mask, window, n_sigma):
+        """ Merge a new rejection mask with the previous one and log it."""
+        if self.rejected_mask is not None and len(self.rejected_mask) == len(mask):
+            mask = mask | self.rejected_mask
+        self.rejected_mask = mask
+        self.log_it('Reject Outliers', window=window, n_sigma=n_sigma, rejected=int(mask.sum()))
+
+    def filter_low_pass(self, cutHigh=0.1, order=1, return_frequency=False, method='butter', response='gaussian'):
         """ apply simple low pass filter to data. if return_frequency is True, returns the filter frequency value
         in THz ( if time data is in ps)
 
-        This function applies a linear filter twice, once forward and once backwards.
-        The combined filter has linear phase.
-        To avoid spikes at edges of the scan, Gustaffson's method is used:
-         F. Gustaffson, “Determining the initial states in forward-backward filtering”,
-         Transactions on Signal Processing, Vol. 46, pp. 988-992, 1996.
-         """
+        cutHigh is the cutoff as fraction of the Nyquist frequency. If 'auto', it is chosen from the noise spectrum
+        of the trace, see filters.find_cutoff.
 
-        b, a = spsignal.butter(order, cutHigh, 'low', analog=False)
-        self.trace = spsignal.filtfilt(b, a, self.trace, method='gust')
-        frequency = utils.get_nyquist_frequency(self.time) * cutHigh
-        self.log_it('Low Pass Filter', frequency=frequency, nyq_factor=cutHigh, order=order)
+        method 'butter' applies a Butterworth filter twice, once forward and once backwards.
+        The combined filter has zero phase. To avoid spikes at edges of the scan, Gustaffson's method is used, and
+        designs are cached and shared with all other scans. See filters.sos_low_pass.
+        method 'fft' multiplies the spectrum of the padded trace by a zero phase response, chosen by response among
+        'gaussian', 'brickwall', 'butterworth' (of given order) and 'hann'. Faster on long traces and allows sharp
+        cutoffs. See filters.low_pass.
+         """
+        if cutHigh == 'auto':
+            cutoff, noise_floor = filters.find_cutoff(self.trace)
+            cutHigh = self._log_auto_cutoff(cutoff[0], noise_floor[0])
+        self.trace = filters.low_pass(self.trace, cutHigh, order, method=method, response=response)
+        frequency = self._log_low_pass(cutHigh, order, method, response)
         if return_frequency:
             return frequency
 
+    def _log_auto_cutoff(self, cutoff, noise_floor):
+        """ Write the automatic cutoff entry in analysis_log and return the cutoff, rounded to two significant
+        digits so that similar scans share the same cached filter design."""
+        cutoff = float('{:.2g}'.format(cutoff))
+        self.log_it('Auto Cutoff', nyq_factor=cutoff, noise_floor=noise_floor)
+        return cutoff
+
+    def _log_low_pass(self, cutHigh, order, method='butter', response='gaussian'):
+        """ Write the low pass filter entry in analysis_log and return the filter frequency."""
+        frequency = utils.get_nyquist_frequency(self.time) * cutHigh
+        if method == 'fft':
+            self.log_it('Low Pass Filter', frequency=frequency, nyq_factor=cutHigh, order=order, method=method,
+                        response=response)
+        else:
+            self.log_it('Low Pass Filter', frequency=frequency, nyq_factor=cutHigh, order=order, method=method)
+        return frequency
+
+    def time_frequency(self, method='stft', **kwargs):
+        """ Time-frequency amplitude map of the trace, see oscillations.time_frequency_map.
+        :param method: str
+            'stft' for short time Fourier transform, 'wavelet' for Morlet continuous wavelet transform
+        :param kwargs:
+            passed to the transform, e.g. window_length for 'stft' or frequencies and n_cycles for 'wavelet'
+        :return delays: np.array
+        :return frequencies: np.array
+        :return tf_map: np.array
+            float32 amplitude map, shape (len(frequencies), len(delays))
+        """
+        delays, frequencies, maps = oscillations.time_frequency_map(self.time, self.trace, method, **kwargs)
+        return delays, frequencies, maps[0]
+
     def normalize_to_parameter(self, parameter):
         """ Normalize scan by dividing by its pump power value"""
         if getattr(self, parameter):
@@ -637,6 +723,7 @@ class MultiTransients(object):
         :param key_parameter: str
             the parameter which changes throughout each scan, making it a "key_parameter" dependence series.
         """
+        self.quarantine = []  # scans rejected by screen_scans, with the reasons for rejection
 
         if transients_list is None:
             self.transients = []
@@ -767,38 +854,101 @@ class MultiTransients(object):
         except KeyError:
             pass
 
-    def import_files(self, files, append=False, key_parameter=None, description=None):
+    def import_files(self, files, append=False, key_parameter=None, description=None, screen=False, **kwargs):
         """imports any series of data files. Files can be:
                - string of full path of a single scan
                - list of full paths of a single scan
                - folder from which all files will be imported
            - append : if true, appends new scans to object, if false overwrites.
+           - screen : if true, raw scans are screened before cleaning, and corrupt or aborted scans, as well as
+               files which cannot be imported, are moved to quarantine instead of stopping the import. See
+               screen_scans, to which kwargs are passed. Off by default.
         """
         if not append:
             self.transients = []  # clear scans in memory
+            self.quarantine = []  # and scans rejected by earlier imports
             # check if 'files' is single file (str), list of files ([str,str,...]) or folder containing files.
-        if isinstance(files, str):
-            self.transients.append(Transient(key_parameter=key_parameter, description=description))
-            self.transients[-1].import_file(files)
-            print('Imported file ' + files)
-        elif isinstance(files, list) or isinstance(files, tuple):
-            for i in range(len(files)):
-                self.transients.append(Transient(key_parameter=key_parameter, description=description))
-                self.transients[-1].import_file(files[i])
-            print('Imported files form list')
-        elif os.path.isdir(files):
-            folderlist = os.listdir(files)
-            for i in range(len(folderlist)):
-                fullpath = files + '//' + folderlist[i]
-                self.transients.append(Transient(key_parameter=key_parameter, description=description))
-                self.transients[-1].import_file(fullpath)
-                print('Imported files form folder')
-        self.import_metadata_from_transients()
+        if isinstance(files, str) and os.path.isdir(files):
+            paths = [files + '//' + name for name in os.listdir(files)]
+        elif isinstance(files, str):
+            paths = [files]
+        else:
+            paths = list(files)
+        imported = []
+        n_quarantined = len(self.quarantine)
+        for path in paths:
+            transient = Transient(key_parameter=key_parameter, description=description)
+            if not screen:
+                transient.import_file(path)
+                self.transients.append(transient)
+                continue
+            try:
+                transient.import_file(path, cleanData=False)
+            except (OSError, ValueError, KeyError, IndexError, spio.matlab.MatReadError) as err:  # unreadable file
+                transient.original_filepath = path
+                self._quarantine(transient, ['import failed: {}'.format(err)])
+                continue
+            imported.append(transient)
+
+        if screen:
+            self.transients += imported
+            quarantined = self.screen_scans(imported, **kwargs)
+            for transient in [transient for transient in imported if transient not in quarantined]:
+                try:
+                    transient.clean_data()
+                except (IndexError, ValueError) as err:
+                    self.transients.remove(transient)
+                    self._quarantine(transient, ['cleaning failed: {}'.format(err)])
+            n_quarantined = len(self.quarantine) - n_quarantined
+            print('Imported {0} files, {1} quarantined'.format(len(paths) - n_quarantined, n_quarantined))
+        else:
+            print('Imported {} files'.format(len(paths)))
+        if self.transients:
+            self.import_metadata_from_transients()
         # self.key_parameter = self.get_dependence_parameter()
         # self.sort_scan_list_by_parameter()  # todo: uncomment when get dependence parmater is fixed
 
         # %% data analysis
 
+    def screen_scans(self, transients=None, min_points=100, max_nan_fraction=0.01, noise_factor=10.,
+                     R0_deviation=None):
+        """ Screen raw scans for corrupt or aborted measurements, and move failing scans from transients to
+        quarantine, with the reasons for rejection. Statistics are computed at once for all scans, see
+        series.screen_scans: number of points, non finite values, presence of a monotonic delay sweep, noise and
+        static reflectivity R0 compared to the rest of the series.
+        :param transients: list of Transient
+            scans to screen. Defaults to all scans of the series.
+        :param min_points: int
+            minimum number of points of the delay sweep
+        :param max_nan_fraction: float
+            maximum fraction of non finite values
+        :param noise_factor: float
+            maximum ratio of the noise of a scan to the median noise of the series
+        :param R0_deviation: float
+            maximum relative deviation of R0 from the median of the series. None, the default, skips this check,
+            as R0 varies legitimately along temperature or fluence series.
+        :return quarantined: list of Transient
+            scans moved to quarantine
+        """
+        transients = self.transients if transients is None else transients
+        reasons, _ = srs.screen_scans([transient.raw_time for transient in transients],
+                                      [transient.raw_trace for transient in transients],
+                                      R0=[transient.R0 for transient in transients], min_points=min_points,
+                                      max_nan_fraction=max_nan_fraction, noise_factor=noise_factor,
+                                      R0_deviation=R0_deviation)
+        quarantined = [transient for transient, scan_reasons in zip(transients, reasons) if scan_reasons]
+        for transient, scan_reasons in zip(transients, reasons):
+            if scan_reasons:
+                self._quarantine(transient, scan_reasons)
+        self.transients = [transient for transient in self.transients if transient not in quarantined]
+        return quarantined
+
+    def _quarantine(self, transient, reasons):
+        """ Store a rejected scan in quarantine and report it."""
+        transient.log_it('Quarantine', *reasons, overwrite=True)
+        self.quarantine.append({'file': transient.original_filepath, 'transient': transient, 'reasons': reasons})
+        print('Quarantined {0}: {1}'.format(transient.original_filepath, '; '.join(reasons)))
+
     def saveas_csv(self, directory=None):  # todo: implement dynamic paramter choosing option
         """ creates a directory inside the given directory where it will save all data in csv format."""
         if directory is None:
@@ -819,14 +969,29 @@ class MultiTransients(object):
             item.export_file_csv(save_dir)
 
     def clean_data_all_scans(self, cropTimeScale=True, shiftTime=0, flipTime=True, removeDC=True, filterLowPass=True,
-                             flipTrace=False):
+                             flipTrace=False, findTimeZero=False, rejectOutliers=False, filterOrder=1):
         """
-
+        Run clean_data on all scans. If rejectOutliers is True, spikes and R0 dropouts are rejected on the whole series
+        through reject_outliers, right after cropping the time scale. If filterLowPass is 'auto', filter cutoffs are
+        chosen from the noise spectra of the whole series, see filter_low_pass. The filter has order filterOrder with
+        fixed or automatic cutoffs. If findTimeZero is True, time zero is then detected and corrected on the whole
+        series through find_time_zero.
         :return:
         """
+        if rejectOutliers or filterLowPass == 'auto':
+            for transient in self.transients:
+                transient.clean_data(cropTimeScale=cropTimeScale, flipTime=False, removeDC=False, filterLowPass=False)
+            cropTimeScale = False
+            if rejectOutliers:
+                self.reject_outliers()
+            if filterLowPass == 'auto':
+                self.filter_low_pass(cutHigh='auto', order=filterOrder)
+                filterLowPass = False
         for transient in self.transients:
             transient.clean_data(cropTimeScale=cropTimeScale, shiftTime=shiftTime, flipTime=flipTime, removeDC=removeDC,
-                                 filterLowPass=filterLowPass, flipTrace=flipTrace)
+                                 filterLowPass=filterLowPass, flipTrace=flipTrace, filterOrder=filterOrder)
+        if findTimeZero:
+            self.find_time_zero()
 
     def input_attribute(self, attribute_name, value):
         """
@@ -852,9 +1017,327 @@ class MultiTransients(object):
 
     # %% analysis
 
-    def filter_low_pass(self, cutHigh=0.1, order=2):
-        for item in self.transients:
-            item = item.filter_low_pass(cutHigh, order)
+    def get_series_matrix(self, time_grid=None):
+        """ Stack all transients in a 2D array, one scan per row, on a common time axis.
+        :param time_grid: np.array
+            time axis on which to interpolate all scans. If None, the common time axis of the scans is used, if
+            present, otherwise an evenly spaced grid over the time range common to all scans.
+        :return time: np.array
+            common time axis
+        :return matrix: np.array
+            2D array of shape (number of scans, len(time))
+        """
+        times = [transient.time for transient in self.transients]
+        traces = [transient.trace for transient in self.transients]
+        return srs.stack_traces(times, traces, time_grid=time_grid)
+
+    def decompose(self, n_components=5, method='randomized', center=False, time_grid=None, single_precision=False,
+                  **kwargs):
+        """ Truncated singular value decomposition (or principal component analysis) of the series.
+
+        The series matrix is built on a common time axis (see get_series_matrix) and decomposed in its leading
+        components, see series.truncated_svd. Each scan is approximated as the sum of the basis transients
+        weighted by its component weights.
+        :param n_components: int
+            number of components
+        :param method: str
+            'randomized', 'arpack' or 'dense'
+        :param center: bool
+            subtract the mean scan first, for a principal component analysis
+        :param time_grid: np.array
+            common time axis, see get_series_matrix
+        :param single_precision: bool
+            decompose in float32, halving memory use on large series
+        :return singular_values: np.array
+            singular spectrum, decreasing
+        :return time: np.array
+            common time axis
+        :return basis: np.array
+            basis transients, one per row
+        :return weights: dict
+            dictionary of Data objects with the weight of each component (singular value times left singular
+            vector) as function of the key parameter
+        """
+        time, matrix = self.get_series_matrix(time_grid)
+        if single_precision:
+            matrix = matrix.astype(np.float32)
+        u, s, vt = srs.truncated_svd(matrix, n_components, method=method, center=center, **kwargs)
+        key_parameter_values = [transient.key_parameter_value for transient in self.transients]
+        weights = {}
+        for k in range(len(s)):
+            name = 'component{}'.format(k)
+            weights[name] = Data(key_parameter_values, u[:, k] * s[k], self.key_parameter, name)
+        return s, time, vt, weights
+
+    def lifetime_map(self, taus=None, regularization=1e-2, time_grid=None, **kwargs):
+        """ Lifetime distribution of every scan, as map of amplitudes versus key parameter and time constant.
+
+        All scans are put on a common time axis (see get_series_matrix) and solved at once, see
+        lifetimes.lifetime_distribution for the method and further keyword arguments.
+        :param taus: np.array
+            grid of time constants. Defaults to a log spaced grid suited to the time axis.
+        :param regularization: float
+            Tikhonov regularization strength
+        :param time_grid: np.array
+            common time axis, see get_series_matrix
+        :return key_parameter_values: np.array
+            key parameter of each scan
+        :return taus: np.array
+            grid of time constants
+        :return amplitudes: np.array
+            amplitude of each time constant for each scan, shape (number of scans, len(taus))
+        :return offsets: np.array
+            constant offset of each scan
+        """
+        time, matrix = self.get_series_matrix(time_grid)
+        taus, amplitudes, offsets, _ = lifetimes.lifetime_distribution(time, matrix, taus=taus,
+                                                                       regularization=regularization, **kwargs)
+        key_parameter_values = np.array([transient.key_parameter_value for transient in self.transients])
+        return key_parameter_values, taus, amplitudes, offsets
+
+    def angular_decomposition(self, harmonics=(1, 2, 4), angle_parameter='sample_orientation', period=360.,
+                              time_grid=None):
+        """ Angular harmonics of a rotation series at every delay point, see angular.angular_harmonics.
+        :param harmonics: tuple of int
+            harmonic orders, e.g. (1, 2, 4) for 1 theta, 2 theta and 4 theta components
+        :param angle_parameter: str
+            transient attribute holding the angle of each scan, e.g. 'sample_orientation' or 'probe_polarization'
+        :param period: float
+            period of the angle, in degrees
+        :param time_grid: np.array
+            common time axis, see get_series_matrix
+        :return time: np.array
+            common time axis
+        :return offset: np.array
+            angular average at each delay
+        :return amplitudes: np.array
+            amplitude of each harmonic at each delay, shape (len(harmonics), len(time))
+        :return orientations: np.array
+            angle of the maximum of each harmonic at each delay, in degrees
+        """
+        time, matrix = self.get_series_matrix(time_grid)
+        offset, amplitudes, orientations = angular.angular_harmonics(self._parameter_values(angle_parameter), matrix,
+                                                                     harmonics, period=period)
+        return time, offset, amplitudes, orientations
+
+    def angle_delay_map(self, angle_parameter='sample_orientation', grid=None, part=None, kind='linear', period=360.,
+                        time_grid=None):
+        """ Rotation series interpolated on a regular angle grid, as image of angle and delay, see angular.angle_map.
+        :param angle_parameter: str
+            transient attribute holding the angle of each scan
+        :param grid: np.array
+            angles of the map. Defaults to one degree steps.
+        :param part: str
+            if 'symmetric' or 'antisymmetric', only this part under rotation by half a period is mapped, see
+            angular.symmetric_parts.
+        :param kind: str
+            'nearest', 'linear' or 'cubic' interpolation along the angle
+        :param period: float
+            period of the angle, in degrees
+        :param time_grid: np.array
+            common time axis, see get_series_matrix
+        :return grid: np.array
+            angle axis
+        :return time: np.array
+            delay axis
+        :return image: np.array
+            shape (len(grid), len(time))
+        """
+        time, matrix = self.get_series_matrix(time_grid)
+        angles = self._parameter_values(angle_parameter)
+        if part is not None:
+            if part not in ('symmetric', 'antisymmetric'):
+                raise ValueError('part must be symmetric or antisymmetric, not {}'.format(part))
+            symmetric, antisymmetric = angular.symmetric_parts(angles, matrix, period=period)
+            matrix = symmetric if part == 'symmetric' else antisymmetric
+        grid, image = angular.angle_map(angles, matrix, grid, kind=kind, period=period)
+        return grid, time, image
+
+    def parameter_delay_map(self, parameter=None, grid=None, n_points=200, kind='linear', period=None,
+                            time_grid=None):
+        """ Image of the series as function of a dependence parameter and delay, e.g. a (temperature, delay) map,
+        interpolated on a regular parameter grid with cached weights, see series.parameter_map.
+        :param parameter: str
+            transient attribute on the parameter axis. Defaults to the key parameter.
+        :param grid: np.array
+            parameter values of the image rows. Defaults to n_points evenly spaced values.
+        :param n_points: int
+            number of image rows if grid is not given
+        :param kind: str
+            interpolation along the parameter axis, 'nearest', 'linear' or 'cubic'
+        :param period: float
+            period of a periodic parameter, e.g. 360 for angles
+        :param time_grid: np.array
+            common time axis, see get_series_matrix
+        :return grid: np.array
+            parameter axis
+        :return time: np.array
+            delay axis
+        :return image: np.array
+            shape (len(grid), len(time)), e.g. for plt.pcolormesh(time, grid, image)
+        """
+        time, matrix = self.get_series_matrix(time_grid)
+        grid, image = srs.parameter_map(self._parameter_values(parameter), matrix, grid=grid, n_points=n_points,
+                                        kind=kind, period=period)
+        return grid, time, image
+
+    def _parameter_values(self, parameter=None):
+        """ Value of the given transient attribute, or of the key parameter, for each scan."""
+        if parameter is None:
+            values = [transient.key_parameter_value for transient in self.transients]
+        else:
+            values = [getattr(transient, parameter) for transient in self.transients]
+        if any(value is None for value in values):
+            raise ValueError('{} missing in some transients'.format(parameter or self.key_parameter))
+        return np.array(values, dtype=float)
+
+    def find_time_zero(self, method='derivative', common=False, apply=True, **kwargs):
+        """ Detect the pump-probe overlap of all scans at once and shift their time scales accordingly.
+
+        :param method: str
+            'derivative' for the steepest edge in the smoothed traces, 'erf' for a batched error function fit
+            around it. See series.find_time_zero for details and further keyword arguments.
+        :param common: bool
+            if True, all scans are shifted by the median time zero of the series, otherwise each scan by its own.
+        :param apply: bool
+            if False, only returns time zero values, without shifting the time scales.
+        :return t0: np.array
+            time zero found for each scan, in the order of self.transients
+        """
+        time, matrix = self.get_series_matrix()
+        t0 = srs.find_time_zero(time, matrix, method=method, **kwargs)
+        if apply:
+            shifts = np.full(len(t0), np.median(t0)) if common else t0
+            for transient, value, shift in zip(self.transients, t0, shifts):
+                transient.shift_time(shift)
+                transient.log_it('Time Zero', time_zero=value, method=method, common=common)
+        return t0
+
+    def _groups_by_length(self):
+        """ Split transients in lists of scans with the same number of points, which can be stacked in a matrix."""
+        lengths = np.array([len(transient.trace) for transient in self.transients])
+        return [[self.transients[i] for i in np.flatnonzero(lengths == length)] for length in np.unique(lengths)]
+
+    def reject_outliers(self, window=21, n_sigma=4., dropout_fraction=0.2):
+        """ Reject spikes from all scans at once and flag scans affected by laser dropouts.
+
+        Scans are stacked by trace length and despiked with a single Hampel filter pass, see Transient.reject_outliers.
+        Scans whose static reflectivity R0 deviates from the median of the series by more than dropout_fraction of
+        it are flagged as dropouts in their analysis_log.
+        :return dropouts: np.array
+            boolean array, True for scans flagged as laser dropouts
+        """
+        for group in self._groups_by_length():
+            matrix = np.vstack([np.asarray(transient.trace, dtype=float) for transient in group])
+            filtered, mask = srs.hampel_filter(matrix, window=window, n_sigma=n_sigma)
+            for transient, trace, scan_mask in zip(group, filtered, mask):
+                transient.trace = trace
+                transient._record_rejection(scan_mask, window, n_sigma)
+
+        R0 = np.array([np.nan if transient.R0 is None else transient.R0 for transient in self.transients], dtype=float)
+        R0_median = np.nanmedian(R0)
+        with np.errstate(invalid='ignore'):
+            dropouts = np.abs(R0 - R0_median) > dropout_fraction * abs(R0_median)
+        for transient, dropout in zip(self.transients, dropouts):
+            if dropout:
+                transient.log_it('R0 Dropout', R0=transient.R0, series_median=R0_median)
+                print('Laser dropout detected in {}: R0 = {}'.format(transient.name, transient.R0))
+        return dropouts
+
+    def estimate_noise(self, time_zero=0., margin=0.5, min_points=10, flag_factor=3.):
+        """ Estimate the noise of all scans at once, for scans of the same length, see Transient.estimate_noise.
+
+        Scans whose noise exceeds flag_factor times the median of the series are flagged as noisy in their
+        analysis_log. Noise estimates weight scans in fit_transients, fit_transients_global and weighted_average,
+        so that noisy scans count less.
+        :param flag_factor: float
+            ratio to the median noise of the series above which scans are flagged
+        :return sigmas: np.array
+            noise standard deviation of each scan, in the order of self.transients
+        :return noisy: np.array
+            boolean array, True for flagged scans
+        """
+        sigmas = np.zeros(len(self.transients))
+        index = {id(transient): i for i, transient in enumerate(self.transients)}
+        for group in self._groups_by_length():
+            sigma, baseline, high_frequency = filters.estimate_noise(
+                np.vstack([transient.time for transient in group]), np.vstack([transient.trace for transient in group]),
+                time_zero=time_zero, margin=margin, min_points=min_points)
+            for transient, scan_sigma, scan_baseline, scan_high in zip(group, sigma, baseline, high_frequency):
+                transient.sigma = float(scan_sigma)
+                transient.log_it('Noise Estimate', overwrite=True, sigma=transient.sigma, baseline=float(scan_baseline),
+                                 high_frequency=float(scan_high))
+                sigmas[index[id(transient)]] = scan_sigma
+
+        median = np.median(sigmas)
+        noisy = sigmas > flag_factor * median
+        for transient, flag in zip(self.transients, noisy):
+            if flag:
+                transient.log_it('Noise Flag', overwrite=True, sigma=transient.sigma, series_median=median)
+                print('Noisy scan {0}: sigma = {1:.3g}, series median {2:.3g}'.format(transient.name, transient.sigma,
+                                                                                     median))
+            else:
+                transient.analysis_log.pop('Noise Flag', None)
+        return sigmas, noisy
+
+    def weighted_average(self, time_grid=None):
+        """ Average of all scans on a common time axis, weighted by the inverse noise variance of each scan, see
+        estimate_noise. Scans without noise estimate are estimated first.
+        :param time_grid: np.array
+            common time axis, see get_series_matrix
+        :return time: np.array
+        :return average: np.array
+        :return sigma: np.array
+            standard deviation of the average
+        """
+        if any(transient.sigma is None for transient in self.transients):
+            self.estimate_noise()
+        time, matrix = self.get_series_matrix(time_grid)
+        average, sigma = srs.weighted_average(matrix, [transient.sigma for transient in self.transients])
+        return time, average, sigma
+
+    def find_filter_cutoff(self, common=False, **kwargs):
+        """ Choose low pass cutoffs for all scans from their noise spectra, estimated together for scans of the same
+        length. See filters.find_cutoff for keyword arguments.
+        :param common: bool
+            if True, the highest cutoff of the series is returned for all scans, preserving the signal band of each.
+        :return cutoffs: np.array
+            cutoff of each scan as fraction of the Nyquist frequency, in the order of self.transients
+        :return noise_floors: np.array
+            noise floor power spectral density of each scan
+        """
+        cutoffs = np.zeros(len(self.transients))
+        noise_floors = np.zeros(len(self.transients))
+        index = {id(transient): i for i, transient in enumerate(self.transients)}
+        for group in self._groups_by_length():
+            cutoff, noise_floor = filters.find_cutoff([transient.trace for transient in group], **kwargs)
+            rows = [index[id(transient)] for transient in group]
+            cutoffs[rows] = cutoff
+            noise_floors[rows] = noise_floor
+        if common:
+            cutoffs[:] = cutoffs.max()
+        return cutoffs, noise_floors
+
+    def filter_low_pass(self, cutHigh=0.1, order=2, method='butter', response='gaussian', common=False):
+        """ Low pass filter all scans. Scans with the same number of points and cutoff are filtered together in a
+        single call. If cutHigh is 'auto', cutoffs are chosen through find_filter_cutoff, with a single cutoff for
+        the whole series if common is True. See Transient.filter_low_pass"""
+        if cutHigh == 'auto':
+            cutoffs, noise_floors = self.find_filter_cutoff(common=common)
+            cutoffs = [transient._log_auto_cutoff(cutoff, noise_floor)
+                       for transient, cutoff, noise_floor in zip(self.transients, cutoffs, noise_floors)]
+        else:
+            cutoffs = [cutHigh] * len(self.transients)
+        cutoff_of = {id(transient): cutoff for transient, cutoff in zip(self.transients, cutoffs)}
+
+        for group in self._groups_by_length():
+            for cutoff in sorted(set(cutoff_of[id(transient)] for transient in group)):
+                subgroup = [transient for transient in group if cutoff_of[id(transient)] == cutoff]
+                filtered = filters.low_pass([transient.trace for transient in subgroup], cutoff, order, method=method,
+                                            response=response)
+                for transient, trace in zip(subgroup, filtered):
+                    transient.trace = trace
+                    transient._log_low_pass(cutoff, order, method, response)
 
     def remove_DC_offset(self):
         for item in self.transients:
@@ -976,30 +1459,78 @@ class MultiTransients(object):
         plt.show()
 
     def fit_transients(self, fit_function, parameters, fit_from=0, fit_to=0, method='curve_fit', ext_plot=None,
-                       print_results=True, recursive_optimization=False, colorlist=None, saveDir=None):
+                       print_results=True, recursive_optimization=False, colorlist=None, saveDir=None, cache=None,
+                       continuation=False, seed=None, coarse_bins=None, uncertainty=None, confidence=0.95,
+                       n_workers=None, random_seed=0, weighted=False):
         """
             Fit given model to a series of Transients.
-        :param fit_function:
-            Model which will be fitted to the data
+        :param fit_function: function, models.Model or str
+            Model which will be fitted to the data. Registered models can be given by name. For models.Model
+            instances, their analytic jacobian and parameter bounds are used.
         :param parameters: list, (list of lists - no longer supported)
             Initial parameters for the given function
         :param fit_from: int
             Minimum  from which to perform fit.
         :param fit_to: int
             Maximum data point (x axis) from which to perform fit.
-        :param method: function
-            Fitting method used: supports 'curve_fit'
+        :param method: str
+            Fitting method used: supports
+                - 'curve_fit': scipy.optimize.curve_fit on all parameters
+                - 'varpro': variable projection, for separable models.Model (see fitting.varpro_fit). The linear
+                    parameters are solved exactly at each step, so parameters can also contain initial guesses
+                    for the nonlinear parameters (time constants) only.
+                - 'multistart': curve_fit from many initial guesses sampled around parameters, keeping the best
+                    result, for fits prone to local minima. Local fits run on n_workers processes, see
+                    fitting.multi_start_fit. Requires a models.Model.
         :param recursive_optimization: bool
             If true, it uses the optimized fit from previous cycle to initialize the next fitting
         :param ext_plot: bool
             if true, plots the results in a matplotlib figure
         :param print_results: bool
             if true prints fitting results in console while being obtained.
+        :param cache: bool or fitting.FitCache
+            if given, results are stored in and taken from this persistent cache (True uses the default
+            fitting.FitCache), so that only scans whose data, fit window, model or initial guess changed are fitted.
+        :param continuation: bool
+            If true, scans are fitted in key parameter order, walking outward from the seed scan, each initialized
+            with the result of its already fitted neighbour. If a fit fails, it is repeated starting from the
+            fitted solution closest to the data, then from parameters. Function evaluations are logged in each
+            transient as 'Fit Evaluations'.
+        :param seed: int
+            index of the scan from which continuation starts, ideally a scan with good signal. Defaults to the scan
+            with lowest key parameter.
+        :param coarse_bins: int
+            if given, each scan is first fitted on a copy decimated to about this many log spaced delay bins, then
+            refined on the full data, see fitting.coarse_to_fine. Much faster on long scans.
+        :param uncertainty: str
+            if given, confidence intervals of the fit parameters are computed for each scan, and stored in the
+            returned Data objects. 'bootstrap' for residual bootstrap, 'profile' for profile likelihood, see
+            fitting.series_intervals. Requires a models.Model.
+        :param confidence: float
+            confidence level of the intervals
+        :param n_workers: int
+            number of processes used for the intervals and the multistart method. Defaults to the number of
+            processors.
+        :param random_seed: int
+            seed of the bootstrap resampling and of the multistart sampling, for reproducible results
+        :param weighted: bool
+            if true, scans with a noise estimate (see estimate_noise) are fitted weighted by their sigma, with
+            absolute_sigma, so that covariances reflect the measured noise instead of the scatter of the residuals.
         :return all_popt: dict
             dictionary with transient label as key and fit optimized parameters as values
         :return all_pcov: dict
 
         """
+        if isinstance(fit_function, str):
+            fit_function = models.get_model(fit_function)
+        if cache is True:
+            cache = fitting.FitCache()
+        if (uncertainty is not None or method == 'multistart') and not isinstance(fit_function, models.Model):
+            raise ValueError('Confidence intervals and multistart fits require a models.Model as fit_function')
+        executor = None
+        if method == 'multistart' and n_workers != 1:
+            executor = ProcessPoolExecutor(max_workers=n_workers)
+        fit_options = {'seed': random_seed, 'executor': executor} if method == 'multistart' else {}
         if ext_plot is None:
             fig = plt.figure('Fit of transients')
             plt.clf()
@@ -1019,24 +1550,26 @@ class MultiTransients(object):
 
         all_popt = {}  # dict type output
         all_pcov = {}
+        labels = ['{0} {1}'.format(transient.key_parameter_value, transient.get_unit(transient.key_parameter))
+                  for transient in self.transients]
+        for label in labels:
+            all_popt[label] = []
+            all_pcov[label] = []
 
-        key_parameter_values = []
-        fit_parameters_data = {}  # dict of Data type output
-        try:
-            if len(parameters[0]) > 1:
-                pars = parameters[0]
-        except TypeError:
-            pars = parameters
-        for i, fit_parameter in enumerate(pars):
-            fit_parameters_data['par{}'.format(i)] = []
+        if continuation:
+            order, toward_seed = self._continuation_order(seed)
+        else:
+            order, toward_seed = range(len(self.transients)), {}
+        fitted = {}  # popt of successful fits, by scan index
+        fitted_pcov = {}  # pcov of successful fits, by scan index, as labels of scans can coincide
+        total_nfev = 0
 
         last_popt = parameters
-        for i, transient in enumerate(self.transients):
-            xdata = transient.time[fit_from:-fit_to]
-            ydata = transient.trace[fit_from:-fit_to]
-            key_parameter_values.append(transient.key_parameter_value)
-            key_parameter = transient.key_parameter
-            label = '{0} {1}'.format(transient.key_parameter_value, transient.get_unit(transient.key_parameter))
+        for i in order:
+            transient = self.transients[i]
+            xdata, ydata = self._fit_window(transient, fit_from, fit_to)
+            label = labels[i]
+            sigma = transient.sigma if weighted else None
 
             try:
                 if len(parameters[0]) > 1:
@@ -1047,12 +1580,29 @@ class MultiTransients(object):
                 else:
                     guess = parameters
 
-            all_popt[label] = []
-            all_pcov[label] = []
-
-            if method == 'curve_fit':
-                try:
-                    popt, pcov = curve_fit(fit_function, xdata, ydata, p0=guess)
+            if method in ('curve_fit', 'varpro', 'multistart'):
+                if continuation:
+                    guesses = self._continuation_guesses(fit_function, xdata, ydata, fitted, toward_seed.get(i), guess)
+                else:
+                    guesses = [guess]
+                for attempt, guess in enumerate(guesses):
+                    info = {}
+                    try:
+                        if cache:
+                            popt, pcov = cache.fit(
+                                lambda *args: self._fit_single(*args, method=method, info=info,
+                                                               coarse_bins=coarse_bins, sigma=sigma, **fit_options),
+                                fit_function, xdata, ydata, guess, method, (fit_from, fit_to), coarse_bins=coarse_bins,
+                                sigma=sigma, **{key: value for key, value in fit_options.items() if key != 'executor'})
+                        else:
+                            popt, pcov = self._fit_single(fit_function, xdata, ydata, guess, method, info, coarse_bins,
+                                                          sigma=sigma, **fit_options)
+                    except RuntimeError:
+                        continue
+                    nfev = info.get('nfev', 0)
+                    total_nfev += nfev
+                    if continuation:
+                        transient.log_it('Fit Evaluations', overwrite=True, nfev=nfev, attempts=attempt + 1)
                     if recursive_optimization:
                         last_popt = popt
                     if print_results:
@@ -1064,17 +1614,35 @@ class MultiTransients(object):
 
                     all_popt[label] = popt
                     all_pcov[label] = pcov
-
-                    for i, item in enumerate(popt):
-                        fit_parameters_data['par{}'.format(i)].append(item)
-
-                except RuntimeError:
+                    fitted[i] = popt
+                    fitted_pcov[i] = pcov
+                    break
+                else:
                     print('no fit parameters found for transient: {}'.format(label))
             elif method == 'fmin':
                 print('fmin not yet implemented')  # todo: add support for fmin
+        if executor is not None:
+            executor.shutdown()
+        if print_results and continuation:
+            print('total function evaluations: {}'.format(total_nfev))
 
-        for key, value in fit_parameters_data.items():
-            fit_parameters_data[key] = Data(key_parameter_values, value, key_parameter, key)
+        # Data of successful fits, in series order
+        fit_parameters_data = {}  # dict of Data type output
+        successful = sorted(fitted)
+        fit_key_parameter_values = [self.transients[i].key_parameter_value for i in successful]
+        for i in successful:
+            for j, item in enumerate(fitted[i]):
+                fit_parameters_data.setdefault('par{}'.format(j), []).append(item)
+        intervals = None
+        if uncertainty is not None and successful:
+            windows = [self._fit_window(self.transients[i], fit_from, fit_to) for i in successful]
+            intervals = np.array(fitting.series_intervals(
+                fit_function, [w[0] for w in windows], [w[1] for w in windows], [fitted[i] for i in successful],
+                [fitted_pcov[i] for i in successful], method=uncertainty, n_workers=n_workers, seed=random_seed,
+                confidence=confidence))
+        for j, (key, value) in enumerate(fit_parameters_data.items()):
+            fit_parameters_data[key] = Data(fit_key_parameter_values, value, self.key_parameter, key,
+                                            confidence_interval=None if intervals is None else intervals[:, j])
 
         if ext_plot:
             pass
@@ -1084,16 +1652,343 @@ class MultiTransients(object):
             pass
         return all_popt, all_pcov, fit_parameters_data
 
+    def fit_transients_global(self, fit_function, parameters, shared, fit_from=0, fit_to=0, print_results=True,
+                              weighted=False):
+        """
+            Fit given model to all transients at once, with the parameters named in shared common to the whole
+            series (e.g. decay times of a fluence series) and all others free for each scan. See fitting.global_fit.
+        :param fit_function: models.Model or str
+            Model which will be fitted to the data.
+        :param parameters: list or list of lists
+            Initial parameters, common to all scans or one list per scan.
+        :param shared: list of str
+            names of the model parameters shared by all scans.
+        :param fit_from: int
+            Minimum data point from which to perform fit.
+        :param fit_to: int
+            number of data points excluded at the end of each scan.
+        :param print_results: bool
+            if true prints fitting results in console.
+        :param weighted: bool
+            if true and all scans have a noise estimate (see estimate_noise), scans are weighted by their inverse
+            noise, so that noisy scans constrain the shared parameters less, and covariances are absolute.
+        :return all_popt: dict
+            dictionary with transient label as key and fit optimized parameters as values
+        :return all_pcov: dict
+        :return fit_parameters_data: dict
+            dictionary of Data objects, one per parameter, as function of the key parameter
+        """
+        fit_function = models.get_model(fit_function)
+        windows = [self._fit_window(transient, fit_from, fit_to) for transient in self.transients]
+        sigmas = None
+        if weighted and all(transient.sigma is not None for transient in self.transients):
+            sigmas = [np.full(len(w[0]), transient.sigma) for w, transient in zip(windows, self.transients)]
+        popt, pcov = fitting.global_fit(fit_function, [w[0] for w in windows], [w[1] for w in windows], parameters,
+                                        shared=shared, sigmas=sigmas, absolute_sigma=sigmas is not None)
+
+        all_popt = {}
+        all_pcov = {}
+        fit_parameters_data = {}
+        key_parameter_values = [transient.key_parameter_value for transient in self.transients]
+        for transient, scan_popt, scan_pcov in zip(self.transients, popt, pcov):
+            label = '{0} {1}'.format(transient.key_parameter_value, transient.get_unit(transient.key_parameter))
+            all_popt[label] = scan_popt
+            all_pcov[label] = scan_pcov
+            if print_results:
+                print('{0}: popt: {1}'.format(label, scan_popt))
+        for i, name in enumerate(fit_function.parameters):
+            fit_parameters_data['par{}'.format(i)] = Data(key_parameter_values, popt[:, i], self.key_parameter, name)
+        return all_popt, all_pcov, fit_parameters_data
+
+    def sample_posteriors(self, fit_function, parameters, fit_from=0, fit_to=0, confidence=0.95, n_workers=None,
+                          random_seed=0, **kwargs):
+        """
+            Sample the Bayesian posterior of the fit parameters of each scan, see mcmc.ensemble_sample.
+            Each scan is first fitted from parameters, and walkers start around the fit. Scans are sampled in
+            parallel processes.
+        :param fit_function: models.Model or str
+        :param parameters: list
+            initial parameters of the fits
+        :param fit_from: int
+            Minimum data point from which to perform fit.
+        :param fit_to: int
+            number of data points excluded at the end of each scan.
+        :param confidence: float
+            level of the credible intervals stored in the Data objects
+        :param n_workers: int
+            number of processes. Defaults to the number of processors.
+        :param random_seed: int
+            seed of the samplers, for reproducible chains
+        :param kwargs:
+            passed to mcmc.ensemble_sample, e.g. n_walkers, n_steps, burn, thin, coarse_bins
+        :return posteriors: dict
+            dictionary with transient label as key and mcmc.Posterior as values
+        :return fit_parameters_data: dict
+            dictionary of Data objects with the posterior median of each parameter and its credible interval, as
+            function of the key parameter
+        """
+        fit_function = models.get_model(fit_function)
+        fitted = []
+        for transient in self.transients:
+            xdata, ydata = self._fit_window(transient, fit_from, fit_to)
+            try:
+                popt, pcov = self._fit_single(fit_function, xdata, ydata, parameters)
+                fitted.append((transient, xdata, ydata, popt, pcov))
+            except RuntimeError:
+                print('no fit parameters found for transient: {}'.format(transient.key_parameter_value))
+        sampled = mcmc.series_posteriors(fit_function, [f[1] for f in fitted], [f[2] for f in fitted],
+                                         [f[3] for f in fitted], [f[4] for f in fitted], n_workers=n_workers,
+                                         seed=random_seed, **kwargs)
+        posteriors = {}
+        for (transient, _, _, _, _), posterior in zip(fitted, sampled):
+            label = '{0} {1}'.format(transient.key_parameter_value, transient.get_unit(transient.key_parameter))
+            posteriors[label] = posterior
+
+        fit_parameters_data = {}
+        if sampled:
+            key_parameter_values = [f[0].key_parameter_value for f in fitted]
+            medians = np.array([posterior.median for posterior in sampled])
+            intervals = np.array([posterior.interval(confidence) for posterior in sampled])
+            for i, name in enumerate(fit_function.parameters):
+                fit_parameters_data['par{}'.format(i)] = Data(key_parameter_values, medians[:, i], self.key_parameter,
+                                                              name, confidence_interval=intervals[:, i])
+        return posteriors, fit_parameters_data
+
+    def fit_two_temperature(self, model=None, vary=('gamma', 'g'), fit_from=0, fit_to=0, lattice=True,
+                            print_results=True, **kwargs):
+        """
+            Fit a two temperature model to a fluence series, with material parameters shared by all scans and
+            amplitudes of electron and lattice temperature free for each scan. See ttm.TwoTemperatureModel.fit.
+            Fluences are taken from the pump_energy of each transient, see Transient.calc_energy_densities.
+        :param model: ttm.TwoTemperatureModel
+            model with initial parameters. Defaults to a model with default parameters.
+        :param vary: list of str
+            names of the fitted model parameters
+        :param fit_from: int
+            Minimum data point from which to perform fit.
+        :param fit_to: int
+            number of data points excluded at the end of each scan.
+        :param lattice: bool
+            include the lattice temperature in the signal
+        :return model: ttm.TwoTemperatureModel
+            fitted model, with parameters and errors
+        :return fit_parameters_data: dict
+            dictionary of Data objects of the amplitudes, as function of the key parameter
+        """
+        if model is None:
+            model = ttm.TwoTemperatureModel()
+        fluence = [transient.pump_energy for transient in self.transients]
+        if any(f is None for f in fluence):
+            raise ValueError('pump_energy missing, run calc_energy_densities on all transients first.')
+        windows = [self._fit_window(transient, fit_from, fit_to) for transient in self.transients]
+        parameters, amplitudes = model.fit([w[0] for w in windows], [w[1] for w in windows], fluence, vary=vary,
+                                           lattice=lattice, **kwargs)
+        if print_results:
+            for name in vary:
+                print('{0}: {1:.4g} +- {2:.2g}'.format(name, parameters[name], model.errors[name]))
+
+        names = ['A_electron', 'A_lattice', 'offset'] if lattice else ['A_electron', 'offset']
+        key_parameter_values = [transient.key_parameter_value for transient in self.transients]
+        fit_parameters_data = {}
+        for i, name in enumerate(names):
+            fit_parameters_data[name] = Data(key_parameter_values, amplitudes[:, i], self.key_parameter, name)
+        for transient, scan_amplitudes in zip(self.transients, amplitudes):
+            transient.log_it('Two Temperature Fit', vary=list(vary), amplitudes=list(scan_amplitudes))
+        return model, fit_parameters_data
+
+    def extract_oscillations(self, fit_function, parameters, fit_from=0, fit_to=0, n_components=2, window='hann',
+                             pad_factor=4, order=None, time_grid=None, print_results=False):
+        """
+            Coherent oscillations in the residuals of the series, after subtraction of the fitted incoherent
+            background. Residuals of all scans are stacked on a common time axis, their windowed and zero padded
+            amplitude spectra computed in one batched FFT, and frequencies, dampings, amplitudes and phases of
+            the strongest damped cosines extracted by linear prediction SVD. See oscillations.residual_spectra and
+            oscillations.lpsvd.
+        :param fit_function: models.Model, function or str
+            model of the incoherent background
+        :param parameters: list
+            initial parameters of the background fits
+        :param fit_from: int
+            Minimum data point from which to perform fit and oscillation analysis, typically after the rise.
+        :param fit_to: int
+            number of data points excluded at the end of each scan.
+        :param n_components: int
+            number of damped cosines extracted from each scan
+        :param window: str or tuple
+            window of the spectra, see scipy.signal.get_window
+        :param pad_factor: int
+            zero padding factor of the spectra
+        :param order: int
+            linear prediction order, see oscillations.lpsvd
+        :param time_grid: np.array
+            common time axis of the residuals, see get_series_matrix
+        :param print_results: bool
+            if true prints the frequencies found for each scan
+        :return frequencies: np.array
+            frequency axis of the spectra, THz for time in ps
+        :return spectra: np.array
+            amplitude spectrum of the residuals of each successfully fitted scan, one per row
+        :return oscillation_data: dict
+            dictionary of Data objects as function of the key parameter: 'peak_frequency' of each spectrum, and
+            'frequency', 'damping', 'amplitude' and 'phase' of each damped cosine, numbered by decreasing amplitude
+        """
+        if isinstance(fit_function, str):
+            fit_function = models.get_model(fit_function)
+        fitted, times, residuals = [], [], []
+        for transient in self.transients:
+            xdata, ydata = self._fit_window(transient, fit_from, fit_to)
+            try:
+                popt, _ = self._fit_single(fit_function, xdata, ydata, parameters)
+            except (RuntimeError, ValueError):
+                print('no fit parameters found for transient: {}'.format(transient.key_parameter_value))
+                continue
+            fitted.append(transient)
+            times.append(xdata)
+            residuals.append(ydata - fit_function(xdata, *popt))
+        if not fitted:
+            raise RuntimeError('No background fit succeeded.')
+        time, matrix = srs.stack_traces(times, residuals, time_grid=time_grid)
+        time, matrix = srs.resample_uniform(time, matrix)
+        frequencies, spectra = oscillations.residual_spectra(time, matrix, window=window, pad_factor=pad_factor)
+        components = np.full((len(matrix), 4, n_components), np.nan)
+        for i, row in enumerate(matrix):
+            try:
+                components[i] = oscillations.lpsvd(time, row, n_components, order=order)
+            except (ValueError, np.linalg.LinAlgError) as err:
+                print('no oscillations found for transient {0}: {1}'.format(fitted[i].key_parameter_value, err))
+
+        key_parameter_values = [transient.key_parameter_value for transient in fitted]
+        oscillation_data = {'peak_frequency': Data(key_parameter_values, frequencies[np.argmax(spectra, axis=1)],
+                                                   self.key_parameter, 'peak_frequency')}
+        for k in range(n_components):
+            for j, name in enumerate(('frequency', 'damping', 'amplitude', 'phase')):
+                label = '{0}{1}'.format(name, k)
+                oscillation_data[label] = Data(key_parameter_values, components[:, j, k], self.key_parameter, label)
+        for transient, scan_components in zip(fitted, components):
+            transient.log_it('Oscillation Analysis', overwrite=True, frequencies=list(scan_components[0]),
+                             dampings=list(scan_components[1]))
+            if print_results:
+                print('{0}: frequencies: {1}'.format(transient.key_parameter_value, scan_components[0]))
+        return frequencies, spectra, oscillation_data
+
+    def time_frequency_maps(self, method='stft', time_grid=None, **kwargs):
+        """ Time-frequency amplitude maps of all scans, computed at once on a common time axis, see
+        Transient.time_frequency.
+        :param method: str
+            'stft' or 'wavelet'
+        :param time_grid: np.array
+            common time axis, see get_series_matrix
+        :return key_parameter_values: np.array
+        :return delays: np.array
+        :return frequencies: np.array
+        :return maps: np.array
+            float32 cube of amplitude maps, shape (number of scans, len(frequencies), len(delays))
+        """
+        time, matrix = self.get_series_matrix(time_grid)
+        delays, frequencies, maps = oscillations.time_frequency_map(time, matrix, method, **kwargs)
+        key_parameter_values = np.array([transient.key_parameter_value for transient in self.transients])
+        return key_parameter_values, delays, frequencies, maps
+
+    @staticmethod
+    def _fit_window(transient, fit_from=0, fit_to=0):
+        """ Return time and trace of a transient, without the first fit_from and the last fit_to points."""
+        end = len(transient.time) - fit_to
+        return np.asarray(transient.time[fit_from:end]), np.asarray(transient.trace[fit_from:end])
+
+    @staticmethod
+    def _fit_single(fit_function, xdata, ydata, guess, method='curve_fit', info=None, coarse_bins=None, sigma=None,
+                    **kwargs):
+        """ Fit a single transient with the given method, see fit_transients.
+        Raises RuntimeError if no fit parameters are found.
+        :param info: dict
+            if given, the number of function evaluations is stored in it as 'nfev'
+        :param coarse_bins: int
+            if given, fit coarse to fine with this number of coarse points, see fitting.coarse_to_fine
+        :param sigma: float
+            if given, noise standard deviation of the data. The fit is weighted by it, with absolute_sigma, so
+            that covariances reflect the measured noise rather than the scatter of the residuals.
+        :param kwargs:
+            passed to fitting.multi_start_fit by the 'multistart' method
+        """
+        nfev = []
+        noise = sigma
+
+        def fit(x, y, p0, sigma=None):
+            # the coarse fit of coarse_to_fine passes its own relative weights, all other fits use the noise
+            absolute_sigma = sigma is None and noise is not None
+            if absolute_sigma:
+                sigma = np.full(len(x), noise)
+            if method == 'varpro':
+                popt, pcov, infodict = fitting.varpro_fit(fit_function, x, y, p0, sigma=sigma,
+                                                          absolute_sigma=absolute_sigma, full_output=True)
+            elif method == 'multistart':
+                popt, pcov, infodict = fitting.multi_start_fit(fit_function, x, y, p0, sigma=sigma,
+                                                               absolute_sigma=absolute_sigma, full_output=True,
+                                                               **kwargs)
+            elif isinstance(fit_function, models.Model):
+                popt, pcov, infodict, _, _ = fit_function.fit(x, y, p0, sigma=sigma, absolute_sigma=absolute_sigma,
+                                                              full_output=True)
+            else:
+                popt, pcov, infodict, _, _ = curve_fit(fit_function, x, y, p0=p0, sigma=sigma,
+                                                       absolute_sigma=absolute_sigma, full_output=True)
+            nfev.append(infodict['nfev'])
+            return popt, pcov
+
+        if coarse_bins:
+            popt, pcov = fitting.coarse_to_fine(fit, xdata, ydata, guess, coarse_bins)
+        else:
+            popt, pcov = fit(xdata, ydata, guess)
+        if info is not None:
+            info['nfev'] = sum(nfev)
+        return popt, pcov
+
+    def _continuation_order(self, seed=None):
+        """ Order of the scans in continuation fits: outward from the seed scan, in key parameter order.
+        :return order: list of int
+            indices of the scans, in fitting order
+        :return toward_seed: dict
+            index of the neighbour toward the seed of each scan
+        """
+        ranked = sorted(range(len(self.transients)), key=lambda i: self.transients[i].key_parameter_value)
+        start = 0 if seed is None else ranked.index(seed)
+        order = [ranked[start]]
+        toward_seed = {}
+        for distance in range(1, len(ranked)):
+            for position, neighbour in ((start + distance, start + distance - 1),
+                                        (start - distance, start - distance + 1)):
+                if 0 <= position < len(ranked):
+                    order.append(ranked[position])
+                    toward_seed[ranked[position]] = ranked[neighbour]
+        return order, toward_seed
+
+    @staticmethod
+    def _continuation_guesses(fit_function, xdata, ydata, fitted, neighbour, parameters):
+        """ Initial guesses tried in turn by continuation fits: the result of the neighbour toward the seed (or,
+        if it failed, of the last successful fit), the fitted solution closest to the data, and parameters."""
+        if not fitted:
+            return [parameters]
+        guesses = [fitted[neighbour] if neighbour in fitted else list(fitted.values())[-1]]
+        residuals = [np.sum((fit_function(xdata, *popt) - ydata) ** 2) for popt in fitted.values()]
+        best = list(fitted.values())[int(np.nanargmin(residuals))] if np.any(np.isfinite(residuals)) else None
+        if best is not None and best is not guesses[0]:
+            guesses.append(best)
+        guesses.append(parameters)
+        return guesses
+
 
 class Data(object):
     """ This object stores data obtained from a fit such as decay times, amplitudes etc and provides analysis tools"""
 
-    def __init__(self, x, y, x_label, y_label):
-        """ initialization"""
+    def __init__(self, x, y, x_label, y_label, confidence_interval=None):
+        """ initialization
+        :param confidence_interval: np.array
+            lower and upper limit of the confidence interval of each y value, shape (len(y), 2)
+        """
         self.x_data = x
         self.y_data = y
         self.x_data = np.array(self.x_data)
         self.y_data = np.array(self.y_data)
+        self.confidence_interval = None if confidence_interval is None else np.array(confidence_interval)
 
         self.x_label = x_label
         self.y_label = y_label
@@ -1119,6 +2014,9 @@ class Data(object):
             ax = plt_handle
 
         ax.scatter(self.x_data, self.y_data, *args, **kargs)
+        if self.confidence_interval is not None:
+            error = np.abs(self.confidence_interval.T - self.y_data)
+            ax.errorbar(self.x_data, self.y_data, yerr=error, fmt='none', ecolor='gray')
         ax.set_xlabel(self.x_label, fontsize=15)
         ax.set_ylabel(self.y_label, fontsize=15)
         ax.set_title(title, fontsize=15)
@@ -1127,17 +2025,18 @@ class Data(object):
         if show:
             plt.show()
 
-    def fit_data(self, fit_function, initial_parameters, x_range=(0, 0)):
+    def fit_data(self, fit_function, initial_parameters, x_range=(0, 0), coarse_bins=None):
         """
 
-        :param function: func
-            function used for data fitting
+        :param function: func, models.Model or str
+            function used for data fitting. See MultiTransients.fit_transients
         :param initial_parameters: list
             initial parameters for inizializing fitting procedure
         :param x_range: [int,int]
             limits to use for fitting [ start , stop ]
-        :param ydata: lsit or np.array
-            y_data, takes precedence over self.y_data
+        :param coarse_bins: int
+            if given, fit first on data decimated to about this many log spaced bins, then on the full data.
+            See fitting.coarse_to_fine
         :return popt:
             optimized parameters
         :return pcov:
@@ -1146,13 +2045,16 @@ class Data(object):
         if x_range == (0, 0):
             x_range = (0, len(self.x_data))
         x_data = self.x_data[x_range[0]:x_range[1]]
-        y_data = self.y_data
-        popt, pcov = curve_fit(fit_function, x_data, y_data, p0=initial_parameters)
-        return popt, pcov
+        y_data = self.y_data[x_range[0]:x_range[1]]
+        if isinstance(fit_function, str):
+            fit_function = models.get_model(fit_function)
+        return MultiTransients._fit_single(fit_function, x_data, y_data, initial_parameters, coarse_bins=coarse_bins)
 
 
 class FitFunction(object):
-    """ wrapper class for fit functions"""
+    """ wrapper class for fit functions.
+    Kept for backwards compatibility: these return (values, labels) and cannot be passed to curve_fit.
+    Use the models module instead, e.g. models.get_model('double_exponential_pos_neg')."""
 
     def __init__(self):
         """ """
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Wed Oct 21 11:20:36 2026
+
+@author: S.Y. Agustsson
+
+module containing the two temperature model (TTM) of electron and lattice temperatures after optical excitation,
+integrated for all fluences of a series at once, and its fit to fluence dependence series.
+
+    gamma * Te * dTe/dt = -g * (Te - Tl) + S(t)
+    c_lattice * dTl/dt = g * (Te - Tl) - c_lattice * (Tl - temperature) / tau_lattice
+
+S(t) is a gaussian pulse depositing the absorbed fluence (1 - reflectivity) * F over the penetration depth.
+Units: time in ps, temperatures in K, gamma in J/(m^3 K^2), c_lattice in J/(m^3 K), g in W/(m^3 K), depth in nm,
+fluence in mJ/cm^2 (units of Transient.pump_energy).
+
+"""
+# %% imports
+import numpy as np
+from scipy.optimize import least_squares
+from scipy.special import erf
+
+
+def main():
+    pass
+
+
+DEFAULT_PARAMETERS = {'gamma': 100.,  # electronic heat capacity coefficient
+                      'c_lattice': 2e6,  # lattice heat capacity
+                      'g': 1e17,  # electron-phonon coupling constant
+                      'tau_lattice': np.inf,  # lattice cooling time, by heat diffusion out of the probed volume
+                      'depth': 20.,  # penetration depth
+                      'reflectivity': 0.,
+                      'fwhm': 0.1,  # pump pulse duration
+                      't_zero': 0.,  # pump pulse arrival time
+                      'temperature': 300.}  # initial temperature
+# parameters which are fitted on a logarithmic scale, as they are positive and span many orders of magnitude
+LOG_PARAMETERS = ('gamma', 'c_lattice', 'g', 'tau_lattice', 'depth', 'fwhm')
+
+
+class TwoTemperatureModel(object):
+    """ Two temperature model, integrated for many fluences simultaneously.
+
+    Each time step is split in the energy deposited by the pulse, which is exact for the linear electronic heat
+    capacity, and the electron-lattice coupling, solved exactly at fixed heat capacities. The integration is
+    therefore stable at any step, also at low temperature where the coupling is very stiff, which allows steps
+    growing after the pulse. All fluences are advanced together as arrays.
+    """
+
+    def __init__(self, **parameters):
+        """
+        :param parameters:
+            material and excitation parameters, see DEFAULT_PARAMETERS. Missing ones take the default value.
+        """
+        for name in parameters:
+            if name not in DEFAULT_PARAMETERS:
+                raise KeyError('Unknown two temperature model parameter: {}'.format(name))
+        self.parameters = dict(DEFAULT_PARAMETERS, **parameters)
+        self.errors = {}
+
+    def __repr__(self):
+        return 'TwoTemperatureModel({})'.format(', '.join('{0}={1:.4g}'.format(name, value)
+                                                          for name, value in self.parameters.items()))
+
+    def source_density(self, fluence):
+        """ Absorbed energy density, in J/m^3, for the given fluences in mJ/cm^2."""
+        p = self.parameters
+        return np.asarray(fluence, dtype=float) * 10 * (1 - p['reflectivity']) / (p['depth'] * 1e-9)
+
+    def simulate(self, time, fluence, step=None, max_step=None):
+        """ Electron and lattice temperatures for each fluence.
+
+        :param time: np.array
+            times at which temperatures are returned, in ps
+        :param fluence: float or np.array
+            pump fluences, in mJ/cm^2
+        :param step: float
+            integration step in ps during the pump pulse. Defaults to a tenth of the pulse duration. After the pulse
+            the step grows geometrically up to max_step, as temperatures vary more and more slowly.
+        :param max_step: float
+            largest integration step. Defaults to a thousandth of the time range.
+        :return electron, lattice: np.array
+            temperatures, with shape (number of fluences, len(time))
+        """
+        time = np.asarray(time, dtype=float)
+        grid = self.time_grid(time, step, max_step)
+        p = self.parameters
+        # energy deposited in each step, from the cumulative gaussian pulse profile
+        sigma = p['fwhm'] / (2 * np.sqrt(2 * np.log(2)))
+        cumulative = 0.5 * (1 + erf((grid - p['t_zero']) / (np.sqrt(2) * sigma)))
+        deposited = np.multiply.outer(self.source_density(np.atleast_1d(fluence)), np.diff(cumulative))
+
+        electron, lattice = self._integrate(deposited, np.diff(grid))
+        electron = np.array([np.interp(time, grid, row) for row in electron])
+        lattice = np.array([np.interp(time, grid, row) for row in lattice])
+        return electron, lattice
+
+    def time_grid(self, time, step=None, max_step=None):
+        """ Integration grid covering time: uniform with the given step until the end of the pump pulse, then
+        with steps growing by 2% up to max_step."""
+        p = self.parameters
+        step = p['fwhm'] / 10 if step is None else step
+        start = min(time.min(), p['t_zero'] - 3 * p['fwhm'])
+        end = max(time.max(), start + step)
+        max_step = max(step, (end - start) / 1000) if max_step is None else max(step, max_step)
+        pulse_end = min(p['t_zero'] + 3 * p['fwhm'], end)
+        grid = np.arange(start, pulse_end + step, step)
+        n_growing = int(np.ceil(np.log(max_step / step) / np.log(1.02))) + 1
+        steps = step * np.minimum(1.02 ** np.arange(1, n_growing + 1), max_step / step)
+        after = grid[-1] + np.cumsum(steps)
+        if after[-1] < end:
+            n_uniform = np.ceil((end - after[-1]) / max_step)
+            after = np.concatenate((after, after[-1] + max_step * np.arange(1, n_uniform + 1)))
+        return np.concatenate((grid, after[:np.searchsorted(after, end) + 1]))
+
+    def _integrate(self, deposited, steps):
+        """ Advance the temperatures of all fluences through the steps of deposited energy density."""
+        p = self.parameters
+        n_fluences, n_steps = deposited.shape
+        gamma, c_lattice = p['gamma'], p['c_lattice']
+        coupling = p['g'] * 1e-12 * steps  # W to J/ps
+        cooling = np.exp(-steps / p['tau_lattice'])
+        electron = np.empty((n_fluences, n_steps + 1))
+        lattice = np.empty((n_fluences, n_steps + 1))
+        te = np.full(n_fluences, float(p['temperature']))
+        tl = te.copy()
+        electron[:, 0], lattice[:, 0] = te, tl
+        for i in range(n_steps):
+            te = np.sqrt(te ** 2 + 2 * deposited[:, i] / gamma)  # electronic energy is gamma * Te^2 / 2
+            c_electron = gamma * te
+            total = c_electron + c_lattice
+            equilibrium = (c_electron * te + c_lattice * tl) / total
+            difference = (te - tl) * np.exp(-coupling[i] * total / (c_electron * c_lattice))
+            te = equilibrium + difference * c_lattice / total
+            tl = equilibrium - difference * c_electron / total
+            tl = p['temperature'] + (tl - p['temperature']) * cooling[i]
+            electron[:, i + 1], lattice[:, i + 1] = te, tl
+        return electron, lattice
+
+    def basis(self, times, fluence, lattice=True):
+        """ Temperature increases used as basis of the signal of each scan.
+        :return basis: list of np.array
+            for each scan, array with columns electron and (if lattice) lattice temperature increase, and a
+            constant offset.
+        """
+        grid = np.unique(np.concatenate([np.asarray(t, dtype=float) for t in times]))
+        electron, lattice_t = self.simulate(grid, fluence)
+        t0 = self.parameters['temperature']
+        basis = []
+        for i, t in enumerate(times):
+            columns = [np.interp(t, grid, electron[i]) - t0]
+            if lattice:
+                columns.append(np.interp(t, grid, lattice_t[i]) - t0)
+            columns.append(np.ones(len(t)))
+            basis.append(np.column_stack(columns))
+        return basis
+
+    def signal(self, times, fluence, amplitudes, lattice=True):
+        """ Signal of each scan as linear combination of the temperature increases, see basis."""
+        return [b @ a for b, a in zip(self.basis(times, fluence, lattice), amplitudes)]
+
+    def fit(self, times, traces, fluence, vary=('gamma', 'g'), lattice=True, **kwargs):
+        """ Fit material parameters, shared by all scans of a fluence series, to the transients.
+
+        The signal of each scan is a linear combination of electron and lattice temperature increase, plus an
+        offset, with free amplitudes for each scan. Amplitudes are solved exactly by linear least squares for each
+        trial set of material parameters, so that the optimizer only searches the parameters in vary.
+        The updated parameters and their standard errors are stored in parameters and errors.
+
+        :param times, traces: list of np.array
+            time axis and data of each scan
+        :param fluence: list
+            pump fluence of each scan, mJ/cm^2
+        :param vary: list of str
+            names of the fitted parameters. The others are kept fixed.
+        :param lattice: bool
+            include the lattice temperature in the signal
+        :param kwargs:
+            passed to scipy.optimize.least_squares
+        :return parameters: dict
+            all model parameters after the fit
+        :return amplitudes: np.array
+            amplitudes of the basis of each scan, shape (number of scans, number of basis functions)
+        """
+        vary = list(vary)
+        traces = [np.asarray(y, dtype=float) for y in traces]
+        log = np.array([name in LOG_PARAMETERS for name in vary])
+        values = np.array([self.parameters[name] for name in vary], dtype=float)
+        u0 = np.where(log, np.log10(values), values)
+
+        def set_parameters(u):
+            for name, value, is_log in zip(vary, u, log):
+                self.parameters[name] = 10 ** value if is_log else value
+
+        def solve(u):
+            set_parameters(u)
+            amplitudes, residuals = [], []
+            for b, y in zip(self.basis(times, fluence, lattice), traces):
+                a = np.linalg.lstsq(b, y, rcond=None)[0]
+                amplitudes.append(a)
+                residuals.append(b @ a - y)
+            return np.array(amplitudes), np.concatenate(residuals)
+
+        kwargs.setdefault('diff_step', 1e-4)
+        result = least_squares(lambda u: solve(u)[1], u0, **kwargs)
+        if not result.success:
+            raise RuntimeError('Two temperature model fit failed: {}'.format(result.message))
+        amplitudes, residual = solve(result.x)
+
+        # standard errors, converted from the logarithmic scale
+        dof = max(len(residual) - len(vary), 1)
+        try:
+            cov = np.linalg.inv(result.jac.T @ result.jac) * (residual @ residual) / dof
+            errors = np.sqrt(np.diag(cov))
+        except np.linalg.LinAlgError:
+            errors = np.full(len(vary), np.inf)
+        errors = np.where(log, errors * np.log(10) * 10 ** result.x, errors)
+        self.errors = dict(zip(vary, errors))
+        return dict(self.parameters), amplitudes
+
+
+if __name__ == "__main__":
+    main()
@@ -263,7 +263,7 @@ def get_energy_density(spot_size=100, power=1, rep_rate=283000):
 
 def get_nyquist_frequency(timedata):
     """returns the Nyquist frequency from time data"""
-    return (abs(0.5 * len(timedata) / timedata[-1] - timedata[0]))
+    return (abs(0.5 * len(timedata) / (timedata[-1] - timedata[0])))
 
 
 if __name__ == "__main__":
@@ -16,6 +16,7 @@ from matplotlib import cm, colorbar
 from lib import utils as gfs
 from lib import redred as rr
 from lib.transient import Transient, MultiTransients
+from lib.models import single_exponential_activation
 
 
 def main():
@@ -90,7 +91,8 @@ def main():
 
     initial_values = [0.00005, 0.05, -1, -1]
 
-    popt, pcov, fit_data = data.fit_transients(single_exponential_activation, initial_values, 750, 1, ext_plot=ax, colorlist=colorlist)
+    popt, pcov, fit_data = data.fit_transients(single_exponential_activation, initial_values, 750, 1, ext_plot=ax,
+                                               colorlist=colorlist, cache=True)
 
 
     print(fit_data.keys())
@@ -132,15 +134,6 @@ def main():
   #  ax1.set_ylim([0, 0.002])
 
 
-# define fitting function
-def single_exponential_activation(x, A, t0, c, d):
-    return A * (1 - np.exp(- x / t0)) + c * x + d
-
-
-def double_exponential_pos_neg(x, A1, t1, A2, t2, c, d):
-    return A1 * (1 - np.exp(- x / t1)) + A2 * (1 - np.exp(- x / t2)) + c * x + d
-
-
 def print_series_parameters(transient_list):
     print('{0:16} {1:5} {2:5}'.format(' ', 'Pump', 'Probe'))
     print('{0:16}:{1:.3f} {2:.3f}'.format('Energy Density', transient_list[0].pump_energy,
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 15:48:36 2026
+
+@author: S.Y. Agustsson
+
+tests of the models convolved with the instrument response, see models.ConvolvedModel
+
+"""
+import numpy as np
+import pytest
+
+from lib import fitting, models
+
+
+@pytest.mark.parametrize('p', [[1., 2., 0.1, 0.3, 0.2], [1., 2., 0., 0.37, 0.05], [1., 0.5, 0.3, 0., 0.5]])
+def test_jacobian_matches_finite_differences(p):
+    model = models.convolve_model('expfunc_const')
+    x = np.linspace(-2, 10, 600)
+    numerical = np.stack(model._numerical_jacobian(x, *p), axis=-1)
+    error = np.abs(model.jacobian(x, *p) - numerical).max(axis=0) / np.abs(numerical).max(axis=0)
+    assert error[model.parameters.index('t_zero')] < 1e-6
+    assert np.all(error < 1e-5)
+
+
+def test_global_fit():
+    model = models.convolve_model('expfunc_const')
+    rng = np.random.default_rng(1)
+    xs = [np.linspace(-2, 10, 400), np.linspace(-1.5, 12, 500)]
+    true = np.array([[1., 2., 0.1, 0.3, 0.2], [0.5, 2., 0.05, 0.25, 0.2]])
+    ys = [model(x, *p) + 1e-3 * rng.standard_normal(len(x)) for x, p in zip(xs, true)]
+    popt, pcov = fitting.global_fit(model, xs, ys, true + 0.01, shared=['t0', 'fwhm'])
+    assert popt.shape == true.shape and pcov.shape == (2, 5, 5)
+    assert np.allclose(popt, true, atol=0.02)
+    assert popt[0, 1] == popt[1, 1]
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 16:12:05 2026
+
+@author: S.Y. Agustsson
+
+tests of the low pass filters, see filters.low_pass
+
+"""
+import glob
+import os
+
+import numpy as np
+import pytest
+import scipy.signal as spsignal
+
+from lib import filters
+from lib.transient import Transient
+
+DATA = os.path.join(os.path.dirname(__file__), '..', 'test_scripts', 'test_data')
+
+
+@pytest.fixture(scope='module')
+def trace():
+    transient = Transient(key_parameter='temperature', description='test')
+    transient.import_file(sorted(glob.glob(os.path.join(DATA, '*.mat')))[0], cleanData=False)
+    transient.crop_time_scale()
+    return np.asarray(transient.trace)
+
+
+@pytest.mark.parametrize('cutoff', [0.1, 0.01])
+@pytest.mark.parametrize('order', [1, 2])
+def test_edges_match_gustafsson_filtfilt(trace, cutoff, order):
+    b, a = spsignal.butter(order, cutoff, 'low', analog=False)
+    expected = spsignal.filtfilt(b, a, trace, method='gust')
+    filtered = filters.low_pass(trace, cutoff, order)
+    assert np.allclose(filtered[:40], expected[:40], rtol=0, atol=1e-9)
+    assert np.allclose(filtered[-40:], expected[-40:], rtol=0, atol=1e-9)
+
+
+def test_series_matrix_filtered_like_single_traces(trace):
+    filtered = filters.low_pass(np.vstack([trace, -trace]), 0.05, 2)
+    assert np.allclose(filtered[0], filters.low_pass(trace, 0.05, 2))
+    assert np.allclose(filtered[1], -filtered[0])
+
+
+def test_inaccurate_transfer_function_falls_back_to_sections(trace):
+    assert filters.butter_ba(8, 0.01) is None
+    filtered = filters.low_pass(trace, 0.01, 8)
+    assert np.all(np.isfinite(filtered))
+    assert np.abs(filtered - trace)[200:-200].max() < np.abs(trace).max()
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 15:20:11 2026
+
+@author: S.Y. Agustsson
+
+regression tests of the fit cache keys, see fitting.FitCache and models.code_identity
+
+"""
+import functools
+import sys
+
+import numpy as np
+from scipy.optimize import curve_fit
+
+from lib import fitting, models
+
+TAU = 5.
+
+
+def make(tau):
+    return lambda x, a, b: a * np.exp(-x / tau) + b
+
+
+def with_global(x, a, b):
+    return a * np.exp(-x / TAU) + b
+
+
+def fit(model, x, y, p0):
+    return curve_fit(model, x, y, p0=p0)
+
+
+def test_closures_differing_in_captured_value(tmp_path):
+    cache = fitting.FitCache(str(tmp_path))
+    x = np.linspace(0, 20, 200)
+    y = np.exp(-x / 5.) + 0.1
+    popt_5, _ = cache.fit(fit, make(5.), x, y, [1, 0])
+    popt_50, _ = cache.fit(fit, make(50.), x, y, [1, 0])
+    assert np.allclose(popt_5, [1, 0.1])
+    assert not np.allclose(popt_50, popt_5, atol=1e-3)
+    assert np.allclose(popt_50, curve_fit(make(50.), x, y, p0=[1, 0])[0])
+    assert models.code_identity(make(5.)) == models.code_identity(make(5.))
+
+
+def test_changed_global_constant(monkeypatch):
+    before = models.code_identity(with_global)
+    monkeypatch.setattr(sys.modules[__name__], 'TAU', 50.)
+    assert models.code_identity(with_global) != before
+
+
+def test_partial_arguments():
+    assert models.code_identity(functools.partial(make(5.), b=0)) != models.code_identity(
+        functools.partial(make(5.), b=1))
+
+
+def test_unidentifiable_values_are_not_cached(tmp_path):
+    class Settings(object):
+        tau = 5.
+
+    settings = Settings()
+
+    def model(x, a, b):
+        return a * np.exp(-x / settings.tau) + b
+
+    assert models.code_identity(model) is None
+    cache = fitting.FitCache(str(tmp_path))
+    x = np.linspace(0, 20, 200)
+    cache.fit(fit, model, x, np.exp(-x / 5.), [1, 0])
+    assert not list(tmp_path.iterdir())